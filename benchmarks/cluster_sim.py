@@ -0,0 +1,164 @@
+"""Local check of cluster mode against a simulated gateway
+
+Starts the IPC hub and worker processes without connecting to Discord. The simulated
+gateway routes guild events to the worker owning the guild's shard, and every worker
+broadcasts a cache invalidation that all the other workers must receive.
+
+Usage: python -m benchmarks.cluster_sim --workers 4 --shards 16 --guilds 1000
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import queue
+import random
+import sys
+import time
+
+from src.cluster import IPCClient, IPCHub, assign_shards, shard_id
+from src.utils.misc import make_table
+
+
+async def _simulated_worker(
+    worker, shard_ids, shard_count, address, authkey, workers, events
+):
+    client = IPCClient(address, f"worker-{worker}", authkey)
+    await client.connect()
+
+    invalidations = set()
+    client.subscribe("invalidate", lambda data: invalidations.add(data["key"]))
+
+    # Wait for everyone to connect, otherwise early broadcasts are lost
+    await client.set_state(f"ready:{worker}", True)
+    while (
+        sum(client.state.get(f"ready:{other}", False) for other in range(workers))
+        < workers
+    ):
+        await asyncio.sleep(0.01)
+
+    await client.publish("invalidate", {"name": "members", "key": worker})
+
+    loop = asyncio.get_running_loop()
+    received = misrouted = 0
+    while True:
+        event = await loop.run_in_executor(None, events.get)
+        if event is None:
+            break
+        received += 1
+        if shard_id(event["guild_id"], shard_count) not in shard_ids:
+            misrouted += 1
+
+    deadline = time.monotonic() + 10
+    while len(invalidations) < workers - 1 and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+
+    await client.close()
+    return {
+        "worker": worker,
+        "shards": len(shard_ids),
+        "events": received,
+        "misrouted": misrouted,
+        "invalidations": len(invalidations),
+        "config": client.state.get("config") == {"simulated": True},
+    }
+
+
+def simulated_worker(
+    worker, shard_ids, shard_count, address, authkey, workers, events, results
+):
+    results.put(
+        asyncio.run(
+            _simulated_worker(
+                worker, shard_ids, shard_count, address, authkey, workers, events
+            )
+        )
+    )
+
+
+async def main(args):
+    hub = IPCHub()
+    await hub.start()
+    await hub.set_state("config", {"simulated": True})
+
+    context = multiprocessing.get_context("spawn")
+    assignment = assign_shards(args.shards, args.workers)
+    owner = {
+        shard: worker for worker, shards in enumerate(assignment) for shard in shards
+    }
+    events = [context.Queue() for _ in range(args.workers)]
+    results = context.Queue()
+
+    processes = [
+        context.Process(
+            target=simulated_worker,
+            args=(
+                worker,
+                assignment[worker],
+                args.shards,
+                hub.address,
+                hub.authkey,
+                args.workers,
+                events[worker],
+                results,
+            ),
+        )
+        for worker in range(args.workers)
+    ]
+    for process in processes:
+        process.start()
+
+    # Simulated gateway: every guild event goes to the worker running its shard
+    rng = random.Random(args.seed)
+    start = time.perf_counter()
+    for _ in range(args.guilds):
+        guild_id = rng.getrandbits(63)
+        events[owner[shard_id(guild_id, args.shards)]].put({"guild_id": guild_id})
+    for worker_events in events:
+        worker_events.put(None)
+
+    loop = asyncio.get_running_loop()
+    reports = []
+    for _ in processes:
+        try:
+            reports.append(await loop.run_in_executor(None, results.get, True, 60))
+        except queue.Empty:
+            break
+    elapsed = time.perf_counter() - start
+
+    for process in processes:
+        process.join(5)
+    await hub.close()
+
+    reports.sort(key=lambda report: report["worker"])
+    print(
+        make_table(
+            [list(report.values()) for report in reports],
+            labels=[
+                "Worker",
+                "Shards",
+                "Events",
+                "Misrouted",
+                "Invalidations",
+                "Config",
+            ],
+        )
+    )
+    print(f"{args.guilds} events routed in {elapsed:.2f}s")
+
+    ok = len(reports) == args.workers and all(
+        not report["misrouted"]
+        and report["invalidations"] == args.workers - 1
+        and report["config"]
+        for report in reports
+    )
+    print("OK" if ok else "FAILED")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--shards", type=int, default=16)
+    parser.add_argument("--guilds", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=None)
+    sys.exit(0 if asyncio.run(main(parser.parse_args())) else 1)
@@ -0,0 +1,764 @@
+"""In-process stand-ins for Discord and MongoDB used by the offline benchmarks
+
+Only the subset of the discord_slash / odmantic / motor API the cogs use is implemented.
+"""
+
+import asyncio
+import copy
+import datetime
+import itertools
+import operator
+
+from bson import ObjectId
+from odmantic import Model
+from pymongo import ReplaceOne, UpdateOne
+
+_ids = itertools.count(10**17)
+
+
+def _normalize(value):
+    if isinstance(value, Model):
+        return value.id
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    return value
+
+
+def _resolve(doc, path):
+    value = doc
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return False, None
+        value = value[part]
+    return True, value
+
+
+def _compare(func):
+    def compare(found, value, argument):
+        if not found or value is None:
+            return False
+        try:
+            return func(value, argument)
+        except TypeError:
+            return False
+
+    return compare
+
+
+_QUERY_OPERATORS = {
+    "$eq": lambda found, value, argument: value == argument,
+    "$ne": lambda found, value, argument: value != argument,
+    "$gt": _compare(operator.gt),
+    "$gte": _compare(operator.ge),
+    "$lt": _compare(operator.lt),
+    "$lte": _compare(operator.le),
+    "$in": lambda found, value, argument: value in argument,
+    "$nin": lambda found, value, argument: value not in argument,
+    "$exists": lambda found, value, argument: found == bool(argument),
+}
+
+
+def _is_operator(condition):
+    return isinstance(condition, dict) and all(key.startswith("$") for key in condition)
+
+
+def normalize_query(query):
+    """Replaces models in the query arguments with their ids, once per query"""
+    normalized = {}
+    for key, condition in query.items():
+        if key in ("$and", "$or"):
+            normalized[key] = [normalize_query(sub_query) for sub_query in condition]
+        elif _is_operator(condition):
+            normalized[key] = {
+                name: _normalize(argument) for name, argument in condition.items()
+            }
+        else:
+            normalized[key] = _normalize(condition)
+    return normalized
+
+
+def _equalities(query):
+    """Yields (key, allowed values) of the conditions that can use an index"""
+    for key, condition in query.items():
+        if key == "$and":
+            for sub_query in condition:
+                yield from _equalities(sub_query)
+        elif key == "$or":
+            continue
+        elif not _is_operator(condition):
+            yield key, [condition]
+        elif "$eq" in condition:
+            yield key, [condition["$eq"]]
+        elif isinstance(condition.get("$in"), list):
+            yield key, condition["$in"]
+
+
+def _hashable(value):
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
+
+def matches(doc, query):
+    """:param query: Query passed through normalize_query"""
+    for key, condition in query.items():
+        if key == "$and":
+            if not all(matches(doc, sub_query) for sub_query in condition):
+                return False
+        elif key == "$or":
+            if not any(matches(doc, sub_query) for sub_query in condition):
+                return False
+        else:
+            found, value = _resolve(doc, key)
+            if _is_operator(condition):
+                for name, argument in condition.items():
+                    if not _QUERY_OPERATORS[name](found, value, argument):
+                        return False
+            elif value != condition:
+                return False
+    return True
+
+
+def _set_path(doc, path, value):
+    *parents, last = path.split(".")
+    for part in parents:
+        doc = doc.setdefault(part, {})
+    doc[last] = value
+
+
+def _unset_path(doc, path):
+    *parents, last = path.split(".")
+    for part in parents:
+        doc = doc.get(part, {})
+    doc.pop(last, None)
+
+
+def _subtract(a, b):
+    if a is None or b is None:
+        return None
+    difference = a - b
+    if isinstance(difference, datetime.timedelta):  # Dates subtract to milliseconds
+        return difference.total_seconds() * 1000
+    return difference
+
+
+def _greater(a, b):
+    # null is less than any other value
+    return a is not None and (b is None or a > b)
+
+
+_EXPRESSION_OPERATORS = {
+    "$add": lambda *args: sum(args),
+    "$subtract": _subtract,
+    "$ifNull": lambda value, replacement: replacement if value is None else value,
+    "$max": lambda *args: max((arg for arg in args if arg is not None), default=None),
+    "$min": lambda *args: min((arg for arg in args if arg is not None), default=None),
+    "$eq": operator.eq,
+    "$gt": _greater,
+    "$or": lambda *args: any(args),
+    "$cond": lambda condition, then, otherwise: then if condition else otherwise,
+}
+
+
+def evaluate(doc, expression):
+    """Aggregation expression, the subset the pipeline updates use"""
+    if isinstance(expression, str) and expression.startswith("$"):
+        return _resolve(doc, expression[1:])[1]
+    if isinstance(expression, dict) and len(expression) == 1:
+        ((name, arguments),) = expression.items()
+        if name == "$literal":
+            return arguments
+        if name in _EXPRESSION_OPERATORS:
+            return _EXPRESSION_OPERATORS[name](
+                *(evaluate(doc, argument) for argument in arguments)
+            )
+    return expression
+
+
+def _apply_pipeline(doc, pipeline):
+    for stage in pipeline:
+        ((name, fields),) = stage.items()
+        if name not in ("$set", "$addFields"):
+            raise NotImplementedError(f"Update stage {name} is not supported")
+        # Expressions of a stage read the document before it
+        values = {
+            path: evaluate(doc, expression) for path, expression in fields.items()
+        }
+        for path, value in values.items():
+            _set_path(doc, path, copy.deepcopy(value))
+
+
+def apply_update(doc, update, inserting=False):
+    if isinstance(update, list):
+        _apply_pipeline(doc, update)
+        return
+    for name, fields in update.items():
+        for path, argument in fields.items():
+            found, value = _resolve(doc, path)
+            if name == "$set":
+                _set_path(doc, path, copy.deepcopy(argument))
+            elif name == "$setOnInsert":
+                if inserting:
+                    _set_path(doc, path, copy.deepcopy(argument))
+            elif name == "$unset":
+                _unset_path(doc, path)
+            elif name == "$inc":
+                _set_path(doc, path, (value if found else 0) + argument)
+            elif name == "$max":
+                _set_path(doc, path, argument if not found else max(value, argument))
+            elif name == "$min":
+                _set_path(doc, path, argument if not found else min(value, argument))
+            elif name == "$push":
+                _set_path(
+                    doc, path, (value if found else []) + [copy.deepcopy(argument)]
+                )
+            else:
+                raise NotImplementedError(f"Update operator {name} is not supported")
+
+
+def _project(doc, projection):
+    if not projection:
+        return doc
+    projected = {"_id": doc["_id"]} if projection.get("_id", True) else {}
+    for path, value in projection.items():
+        found, field = _resolve(doc, path)
+        if value and found and path != "_id":
+            _set_path(projected, path, field)
+    return projected
+
+
+def _lookup(engine, docs, stage):
+    foreign = engine.collections.get(stage["from"])
+    for doc in docs:
+        local = doc.get(stage["localField"])
+        doc[stage["as"]] = [
+            copy.deepcopy(other)
+            for other in (
+                foreign.matching({stage["foreignField"]: local}) if foreign else ()
+            )
+        ]
+    return docs
+
+
+def _unwind(docs, path):
+    field = path.lstrip("$")
+    return [{**doc, field: item} for doc in docs for item in doc.get(field, [])]
+
+
+def _sort(docs, keys):
+    """:param keys: List of (key, direction) like in pymongo"""
+    for key, direction in reversed(keys):
+        docs.sort(key=lambda doc: _resolve(doc, key)[1], reverse=direction < 0)
+    return docs
+
+
+class FakeUpdateResult:
+    def __init__(self, matched_count, modified_count, upserted_id=None):
+        self.matched_count = matched_count
+        self.modified_count = modified_count
+        self.upserted_id = upserted_id
+
+
+class FakeMotorCursor:
+    def __init__(self, docs):
+        self._docs = docs
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self._docs:
+            yield doc
+
+    async def to_list(self, length=None):
+        return self._docs[:length]
+
+
+class FakeCollection:
+    """Motor collection subset backed by a dict of documents
+
+    Equality conditions use hash indexes that are built on the first query by a key and
+    kept up to date by the writes, so the load test measures the cogs rather than scans.
+    Documents must be changed with the methods, not through `docs`.
+    """
+
+    def __init__(self, engine, name):
+        self.engine = engine
+        self.name = name
+        self.docs = {}
+        # Key -> {value: set of document ids}, the documents with unhashable values of
+        # the key are under the `_unhashable` set of ids
+        self._indexes = {}
+        self._unhashable = {}
+        # Id -> insertion number, the order of the results is the order of `docs`
+        self._positions = {}
+        self._inserted = 0
+
+    def _index(self, doc):
+        for key, index in self._indexes.items():
+            value = _resolve(doc, key)[1]
+            if _hashable(value):
+                index.setdefault(value, set()).add(doc["_id"])
+            else:
+                self._unhashable[key].add(doc["_id"])
+
+    def _unindex(self, doc):
+        for key, index in self._indexes.items():
+            value = _resolve(doc, key)[1]
+            if _hashable(value):
+                index.get(value, set()).discard(doc["_id"])
+            else:
+                self._unhashable[key].discard(doc["_id"])
+
+    def _build_index(self, key):
+        self._indexes[key] = {}
+        self._unhashable[key] = set()
+        for doc in self.docs.values():
+            value = _resolve(doc, key)[1]
+            if _hashable(value):
+                self._indexes[key].setdefault(value, set()).add(doc["_id"])
+            else:
+                self._unhashable[key].add(doc["_id"])
+
+    def put(self, doc):
+        old = self.docs.get(doc["_id"])
+        if old is not None:
+            self._unindex(old)
+        else:
+            self._positions[doc["_id"]] = self._inserted
+            self._inserted += 1
+        self.docs[doc["_id"]] = doc
+        self._index(doc)
+
+    def remove(self, doc_id):
+        doc = self.docs.pop(doc_id, None)
+        if doc is not None:
+            self._unindex(doc)
+            del self._positions[doc_id]
+
+    def _update(self, doc, update):
+        self._unindex(doc)
+        apply_update(doc, update)
+        self._index(doc)
+
+    def _candidates(self, query):
+        """:return: Ids of the documents that may match, None if all of them may"""
+        best = None
+        for key, values in _equalities(query):
+            if not all(map(_hashable, values)):
+                continue
+            if key == "_id":
+                ids = {value for value in values if value in self.docs}
+            else:
+                if key not in self._indexes:
+                    self._build_index(key)
+                index = self._indexes[key]
+                ids = set(self._unhashable[key])
+                for value in values:
+                    ids.update(index.get(value, ()))
+            if best is None or len(ids) < len(best):
+                best = ids
+        return best
+
+    def matching(self, query):
+        query = normalize_query(query or {})
+        ids = self._candidates(query)
+        if ids is None:
+            docs = self.docs.values()
+        else:
+            docs = [
+                self.docs[doc_id] for doc_id in sorted(ids, key=self._positions.get)
+            ]
+        return [doc for doc in docs if matches(doc, query)]
+
+    async def find_one(self, query=None, projection=None):
+        await self.engine.round_trip()
+        docs = self.matching(query)
+        return copy.deepcopy(_project(docs[0], projection)) if docs else None
+
+    def find(self, query=None, projection=None, sort=None, **kwargs):
+        docs = _sort(self.matching(query), sort or [])
+        return FakeMotorCursor(
+            [copy.deepcopy(_project(doc, projection)) for doc in docs]
+        )
+
+    def aggregate(self, pipeline):
+        """Supports $match, $lookup, $unwind, $project and $limit stages"""
+        pipeline = list(pipeline)
+        # A leading $match uses the indexes, like it does in MongoDB
+        query = (
+            pipeline.pop(0)["$match"] if pipeline and "$match" in pipeline[0] else {}
+        )
+        docs = [copy.deepcopy(doc) for doc in self.matching(query)]
+        for stage in pipeline:
+            ((name, argument),) = stage.items()
+            if name == "$match":
+                argument = normalize_query(argument)
+                docs = [doc for doc in docs if matches(doc, argument)]
+            elif name == "$lookup":
+                docs = _lookup(self.engine, docs, argument)
+            elif name == "$unwind":
+                docs = _unwind(docs, argument)
+            elif name == "$project":
+                docs = [_project(doc, argument) for doc in docs]
+            elif name == "$limit":
+                docs = docs[:argument]
+            else:
+                raise NotImplementedError(f"Aggregation stage {name} is not supported")
+        return FakeMotorCursor(docs)
+
+    async def count_documents(self, query):
+        await self.engine.round_trip()
+        return len(self.matching(query))
+
+    async def insert_one(self, doc):
+        await self.engine.round_trip()
+        doc.setdefault("_id", ObjectId())
+        self.put(copy.deepcopy(doc))
+
+    async def insert_many(self, docs, ordered=True):
+        await self.engine.round_trip()
+        for doc in docs:
+            doc.setdefault("_id", ObjectId())
+            self.put(copy.deepcopy(doc))
+
+    async def update_one(self, query, update, upsert=False):
+        await self.engine.round_trip()
+        return self._update_one(query, update, upsert)
+
+    def _update_one(self, query, update, upsert):
+        docs = self.matching(query)
+        if docs:
+            self._update(docs[0], update)
+            return FakeUpdateResult(1, 1)
+        if not upsert:
+            return FakeUpdateResult(0, 0)
+
+        doc = {
+            key: value
+            for key, value in query.items()
+            if not key.startswith("$") and not isinstance(value, dict)
+        }
+        doc.setdefault("_id", ObjectId())
+        apply_update(doc, update, inserting=True)
+        self.put(doc)
+        return FakeUpdateResult(0, 0, doc["_id"])
+
+    async def find_one_and_update(
+        self, query, update, projection=None, return_document=False, upsert=False
+    ):
+        await self.engine.round_trip()
+        docs = self.matching(query)
+        before = copy.deepcopy(docs[0]) if docs else None
+        result = self._update_one(query, update, upsert)
+        if return_document:
+            after = self.docs.get(before["_id"] if before else result.upserted_id)
+            return copy.deepcopy(_project(after, projection)) if after else None
+        return _project(before, projection) if before else None
+
+    async def update_many(self, query, update):
+        await self.engine.round_trip()
+        docs = self.matching(query)
+        for doc in docs:
+            self._update(doc, update)
+        return FakeUpdateResult(len(docs), len(docs))
+
+    def _replace_one(self, query, replacement, upsert):
+        docs = self.matching(query)
+        if not docs and not upsert:
+            return
+        doc = copy.deepcopy(replacement)
+        if docs:
+            doc["_id"] = docs[0]["_id"]
+        doc.setdefault("_id", ObjectId())
+        self.put(doc)
+
+    async def bulk_write(self, requests, ordered=True):
+        """Supports UpdateOne and ReplaceOne requests, in a single round trip"""
+        await self.engine.round_trip()
+        for request in requests:
+            if isinstance(request, UpdateOne):
+                self._update_one(request._filter, request._doc, request._upsert)
+            elif isinstance(request, ReplaceOne):
+                self._replace_one(request._filter, request._doc, request._upsert)
+            else:
+                raise NotImplementedError(f"{type(request).__name__} is not supported")
+
+    async def delete_one(self, query):
+        await self.engine.round_trip()
+        docs = self.matching(query)
+        if docs:
+            self.remove(docs[0]["_id"])
+
+    async def delete_many(self, query):
+        await self.engine.round_trip()
+        for doc in self.matching(query):
+            self.remove(doc["_id"])
+
+    async def create_index(self, keys, **kwargs):
+        pass
+
+
+class FakeCursor:
+    def __init__(self, coro):
+        self._coro = coro
+
+    def __await__(self):
+        return self._coro.__await__()
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for instance in await self._coro:
+            yield instance
+
+
+class FakeEngine:
+    """odmantic AIOEngine subset, `latency` simulates a database round-trip"""
+
+    def __init__(self, latency=0.0, database="test"):
+        self.latency = latency
+        self.database_name = database
+        self.collections = {}
+
+    async def round_trip(self):
+        await asyncio.sleep(self.latency)
+
+    def get_collection(self, model):
+        name = model.__collection__
+        if name not in self.collections:
+            self.collections[name] = FakeCollection(self, name)
+        return self.collections[name]
+
+    def _parse(self, model, doc):
+        doc = copy.deepcopy(doc)
+        for name in model.__references__:
+            field = model.__odm_fields__[name]
+            referenced = self.get_collection(field.model).docs[doc[field.key_name]]
+            doc[field.key_name] = copy.deepcopy(referenced)
+        return model.parse_doc(doc)
+
+    @staticmethod
+    def _query(queries):
+        queries = [dict(query) for query in queries]
+        if len(queries) == 1:
+            return queries[0]
+        return {"$and": queries}
+
+    @staticmethod
+    def _sort_keys(sort):
+        if sort is None:
+            return []
+        keys = []
+        for item in sort if isinstance(sort, tuple) else (sort,):
+            if isinstance(item, dict):  # SortExpression
+                keys.extend(item.items())
+            else:  # FieldProxy
+                keys.append((+item, 1))
+        return keys
+
+    async def _find(self, model, queries, skip, limit, sort=None):
+        await self.round_trip()
+        docs = self.get_collection(model).matching(self._query(queries))
+        docs = _sort(docs, self._sort_keys(sort))
+        docs = docs[skip:] if limit is None else docs[skip : skip + limit]
+        return [self._parse(model, doc) for doc in docs]
+
+    def find(self, model, *queries, sort=None, skip=0, limit=None):
+        return FakeCursor(self._find(model, queries, skip, limit, sort))
+
+    async def find_one(self, model, *queries, sort=None):
+        instances = await self._find(model, queries, 0, 1, sort)
+        return instances[0] if instances else None
+
+    async def count(self, model, *queries):
+        await self.round_trip()
+        return len(self.get_collection(model).matching(self._query(queries)))
+
+    def _save(self, instance):
+        for name in type(instance).__references__:
+            self._save(getattr(instance, name))
+        doc = instance.doc()
+        self.get_collection(type(instance)).put(copy.deepcopy(doc))
+
+    async def save(self, instance):
+        await self.round_trip()
+        self._save(instance)
+        return instance
+
+    async def delete(self, instance):
+        await self.round_trip()
+        self.get_collection(type(instance)).remove(instance.id)
+
+
+class FakeUser:
+    def __init__(self, user_id, name=None):
+        self.id = user_id
+        self.name = self.display_name = name or f"user{user_id}"
+        self.mention = f"<@{user_id}>"
+        self.bot = False
+
+    def __eq__(self, other):
+        return isinstance(other, FakeUser) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+
+class FakeGuild:
+    def __init__(self, guild_id, members=()):
+        self.id = guild_id
+        self.members = {member.id: member for member in members}
+
+    def get_member(self, user_id):
+        return self.members.get(user_id)
+
+    async def fetch_member(self, user_id):
+        return self.members[user_id]
+
+
+class FakeMessage:
+    def __init__(self, channel, content=None, embeds=(), components=None):
+        self.id = next(_ids)
+        self.channel = channel
+        self.content = content
+        self.embeds = list(embeds)
+        self.components = components
+
+    async def edit(self, content=None, embed=None, components=None, **kwargs):
+        await self.channel.round_trip()
+        if content is not None:
+            self.content = content
+        if embed is not None:
+            self.embeds = [embed]
+        if components is not None:
+            self.components = components
+
+
+class FakeChannel:
+    def __init__(self, channel_id, latency=0.0, guild=None):
+        self.id = channel_id
+        self.latency = latency
+        self.guild = guild
+        self.messages = {}
+
+    async def round_trip(self):
+        await asyncio.sleep(self.latency)
+
+    async def send(
+        self, content=None, *, embed=None, embeds=None, components=None, **kwargs
+    ):
+        await self.round_trip()
+        message = FakeMessage(
+            self, content, [embed] if embed else embeds or (), components
+        )
+        self.messages[message.id] = message
+        return message
+
+    def get_partial_message(self, message_id):
+        return self.messages[message_id]
+
+    async def fetch_message(self, message_id):
+        await self.round_trip()
+        return self.messages[message_id]
+
+
+class FakeSlashContext:
+    def __init__(self, bot, author, guild, channel, name, subcommand_name=None):
+        self.bot = bot
+        self.author = author
+        self.author_id = author.id
+        self.guild = guild
+        self.guild_id = guild.id
+        self.channel = channel
+        self.channel_id = channel.id
+        self.name = self.command = name
+        self.subcommand_name = subcommand_name
+        self.subcommand_group = None
+        self.deferred = False
+        self.message = None
+
+    async def defer(self, hidden=False):
+        await self.channel.round_trip()
+        self.deferred = True
+
+    async def send(
+        self,
+        content="",
+        *,
+        embed=None,
+        embeds=None,
+        components=None,
+        hidden=False,
+        **kwargs,
+    ):
+        message = await self.channel.send(
+            content, embed=embed, embeds=embeds, components=components
+        )
+        self.message = self.message or message
+        return message
+
+
+class FakeComponentContext(FakeSlashContext):
+    def __init__(self, bot, author, guild, channel, origin_message, custom_id):
+        super().__init__(bot, author, guild, channel, None)
+        self.origin_message = origin_message
+        self.origin_message_id = origin_message.id
+        self.custom_id = custom_id
+        self.selected_options = None
+
+    async def defer(self, hidden=False, edit_origin=False):
+        await super().defer(hidden)
+
+    async def edit_origin(self, **fields):
+        await self.origin_message.edit(**fields)
+
+
+class FakeSlash:
+    def __init__(self):
+        self.invocation_hooks = []
+        self.autocomplete_handlers = {}
+
+
+class FakeBot:
+    """Enough of RPbot for the cogs to run without a gateway connection"""
+
+    def __init__(self, db, config=None):
+        self.db = db
+        self.config = config or {}
+        self.loop = asyncio.get_event_loop()
+        self.owner_ids = set()
+        self.caches = {}
+        self.slash = FakeSlash()
+        self.cogs = []
+        self.channels = {}
+
+    def add_cog(self, cog):
+        self.cogs.append(cog)
+
+    def get_db(self, guild_id):
+        return self.db
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+    def get_cache(self, name, factory):
+        if name not in self.caches:
+            self.caches[name] = factory()
+        return self.caches[name]
+
+    async def wait_for(self, event, *, check=None, timeout=None):
+        # Nobody ever clicks the buttons
+        raise asyncio.TimeoutError
+
+    def dispatch(self, event, *args, **kwargs):
+        for cog in self.cogs:
+            listener = getattr(cog, f"on_{event}", None)
+            if listener is not None:
+                self.loop.create_task(listener(*args, **kwargs))
+
+    async def invalidate_cache(self, name, key=None):
+        self.dispatch("cache_invalidate", name, key)
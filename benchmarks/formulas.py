@@ -0,0 +1,97 @@
+"""Micro-benchmark of derived characteristic reads: precomputed block vs plain formulas
+
+Plain formulas are the inlined lambdas that recompute the stat bonuses and level
+multipliers on every read, block formulas read them from the block of the character.
+
+Usage: python -m benchmarks.formulas --characters 200 --repeat 5 --json formulas.json
+"""
+
+import argparse
+import json
+import random
+import timeit
+
+from src.mg_character_models import DEFAULT_RULESET, Character, Player, Stat
+from src.utils.misc import make_table
+
+
+def plain_formulas(ruleset):
+    return {
+        name: ruleset._compile_lambda(name, ruleset._expand(name))
+        for name in ruleset.source
+    }
+
+
+def make_characters(count, rng):
+    player = Player(user_id=1)
+    return [
+        Character(
+            name=f"Character {i}",
+            player=player,
+            level=rng.randint(1, 30),
+            stats={stat.value: rng.randint(1, 100) for stat in Stat},
+        )
+        for i in range(count)
+    ]
+
+
+def read_all(formulas, characters):
+    for character in characters:
+        for formula in formulas:
+            formula(character)
+
+
+def change_then_read_all(formulas, characters):
+    """Like set_stat: the level changes, so the block is computed again on the next read"""
+    for character in characters:
+        character.level = character.level
+        for formula in formulas:
+            formula(character)
+
+
+def bench(function, repeat, number):
+    return min(timeit.repeat(function, repeat=repeat, number=number)) / number
+
+
+def main(args):
+    rng = random.Random(args.seed)
+    characters = make_characters(args.characters, rng)
+    reads = len(characters) * len(DEFAULT_RULESET.formulas)
+    variants = {
+        "plain": list(plain_formulas(DEFAULT_RULESET).values()),
+        "block": list(DEFAULT_RULESET.formulas.values()),
+    }
+    for character in characters:
+        for name, formula in zip(DEFAULT_RULESET.formulas, variants["plain"]):
+            assert DEFAULT_RULESET.formulas[name](character) == formula(character)
+
+    results = {}
+    for scenario in (read_all, change_then_read_all):
+        for variant, formulas in variants.items():
+            seconds = bench(
+                lambda: scenario(formulas, characters), args.repeat, args.number
+            )
+            results[f"{scenario.__name__}/{variant}"] = seconds / reads * 1e9
+
+    rows = []
+    for scenario in ("read_all", "change_then_read_all"):
+        plain, block = results[f"{scenario}/plain"], results[f"{scenario}/block"]
+        rows.append([scenario, f"{plain:.0f}", f"{block:.0f}", f"{plain / block:.2f}x"])
+    print(
+        f"{reads} reads of {len(DEFAULT_RULESET.formulas)} formulas, "
+        f"block of {DEFAULT_RULESET.block_size} values"
+    )
+    print(make_table(rows, labels=["Scenario", "Plain ns", "Block ns", "Speedup"]))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"ns_per_read": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--characters", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--number", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write the results as JSON to this path")
+    main(parser.parse_args())
@@ -0,0 +1,324 @@
+"""Offline load test of CharactersCog with synthetic interactions
+
+Usage: python -m benchmarks.load_test --invocations 5000 --concurrency 500 \
+    --mix info=3,pointbuy=1,regen=2,roll=2,refresh_charsheet=2
+"""
+
+import argparse
+import asyncio
+import collections
+import inspect
+import itertools
+import json
+import random
+import time
+
+import discord
+from discord_slash.model import (
+    CogBaseCommandObject,
+    CogComponentCallbackObject,
+    CogSubcommandObject,
+)
+
+from benchmarks.fakes import (
+    FakeBot,
+    FakeChannel,
+    FakeComponentContext,
+    FakeEngine,
+    FakeGuild,
+    FakeMessage,
+    FakeSlashContext,
+    FakeUser,
+)
+from src.main_game import CharactersCog
+from src.mg_character_models import Character, Player, Stat
+from src.utils.autocomplete import AutocompleteContext
+from src.utils.misc import make_table
+
+DEFAULT_MIX = "info=3,pointbuy=1,regen=2,roll=2,refresh_charsheet=2"
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    unknown = set(mix) - set(SCENARIOS)
+    if unknown:
+        raise argparse.ArgumentTypeError(
+            f"Unknown commands: {', '.join(sorted(unknown))}"
+        )
+    return mix
+
+
+def percentile(values, percent):
+    if not values:
+        return 0
+    index = min(len(values) - 1, max(0, round(percent / 100 * len(values)) - 1))
+    return values[index]
+
+
+def bind_cog(cog):
+    """Does what SlashCommand.get_cog_commands does for the command objects"""
+    for _, member in inspect.getmembers(cog):
+        if isinstance(
+            member,
+            (CogBaseCommandObject, CogSubcommandObject, CogComponentCallbackObject),
+        ):
+            member.cog = cog
+
+
+class Harness:
+    def __init__(self, players, db_latency, http_latency, seed):
+        self.random = random.Random(seed)
+        self.db = FakeEngine(latency=db_latency)
+        self.bot = FakeBot(self.db)
+        self.users = [FakeUser(10**6 + i) for i in range(players)]
+        self.guild = FakeGuild(1, self.users)
+        self.channel = FakeChannel(2, latency=http_latency, guild=self.guild)
+        self.bot.channels[self.channel.id] = self.channel
+        self.characters = {}
+        self.interaction_ids = itertools.count(1)
+        self.posted = {}
+
+        self.cog = CharactersCog(self.bot)
+        bind_cog(self.cog)
+        self.bot.add_cog(self.cog)
+
+    async def populate(self):
+        for user in self.users:
+            player = Player(
+                guild_id=self.guild.id, user_id=user.id, is_gm=user is self.users[0]
+            )
+            character = Character(
+                guild_id=self.guild.id,
+                name=f"Hero {user.id % 1000}",
+                player=player,
+                level=self.random.randint(1, 20),
+                free_points=1000,
+                stats={stat: self.random.randint(20, 60) for stat in Stat},
+            )
+            player.current_character = character.id
+            self.db._save(character)
+            self.db._save(player)
+            self.characters[user.id] = character
+
+    def slash_context(self, user, name, subcommand_name=None):
+        return FakeSlashContext(
+            self.bot, user, self.guild, self.channel, name, subcommand_name
+        )
+
+    def invocation(self, name):
+        user = self.random.choice(self.users)
+        stat = self.random.choice(list(Stat))
+        if name == "info":
+            ctx = self.slash_context(user, "character", "info")
+            return self.cog.info.invoke(ctx)
+        if name == "pointbuy":
+            ctx = self.slash_context(user, "character", "pointbuy")
+            mode = self.random.choice(["add", "sub"])
+            return self.cog.pointbuy.invoke(ctx, stat=stat, value=1, mode=mode)
+        if name == "regen":
+            ctx = self.slash_context(user, "regen")
+            return self.cog.regen.invoke(ctx, rounds=self.random.randint(1, 5))
+        if name == "roll":
+            ctx = self.slash_context(user, "roll", "stat")
+            modifier = self.random.randint(-10, 10)
+            return self.cog.roll.invoke(ctx, stat=stat, modifier=modifier)
+        if name == "party":
+            ctx = self.slash_context(self.users[0], "roll", "party")
+            return self.cog.roll_party.invoke(ctx, stat=stat)
+        if name == "refresh_charsheet":
+            character = self.characters[user.id]
+            if character.id not in self.posted:
+                embed = discord.Embed(description=f"ID: ||{character.id}||")
+                message = FakeMessage(self.channel, embeds=[embed])
+                self.channel.messages[message.id] = message
+                self.posted[character.id] = message
+            origin = self.posted[character.id]
+            ctx = FakeComponentContext(
+                self.bot, user, self.guild, self.channel, origin, "refresh_charsheet"
+            )
+            return self.cog.refresh_charsheet.invoke(ctx)
+        if name == "autocomplete":
+            typed = f"hero {self.random.randint(0, 999)}"[: self.random.randint(0, 7)]
+            data = {
+                "id": str(next(self.interaction_ids)),
+                "token": "token",
+                "guild_id": str(self.guild.id),
+                "member": {"user": {"id": str(user.id)}},
+                "data": {
+                    "name": "character",
+                    "options": [
+                        {
+                            "type": 1,
+                            "name": "select",
+                            "options": [
+                                {
+                                    "type": 3,
+                                    "name": "character",
+                                    "value": typed,
+                                    "focused": True,
+                                }
+                            ],
+                        }
+                    ],
+                },
+            }
+            ctx = AutocompleteContext(self.bot, data)
+            handler = self.bot.slash.autocomplete_handlers[(ctx.command, ctx.option)]
+            return handler(ctx)
+        if name == "inventory":
+            item = f"item {self.random.randint(1, 50)}"
+            action = self.random.choices(["add", "remove", "list"], [6, 3, 1])[0]
+            ctx = self.slash_context(user, "inventory", action)
+            if action == "add":
+                weight = self.random.randint(1, 40) / 4
+                return self.cog.inventory_add.invoke(ctx, name=item, weight=weight)
+            if action == "remove":
+                return self.cog.inventory_remove.invoke(ctx, name=item)
+            return self.cog.inventory_list.invoke(ctx)
+        raise ValueError(name)
+
+    async def run(self, invocations, concurrency, mix):
+        names = self.random.choices(
+            list(mix), weights=list(mix.values()), k=invocations
+        )
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = collections.defaultdict(list)
+        errors = collections.defaultdict(collections.Counter)
+
+        async def invoke(name):
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    await self.invocation(name)
+                except asyncio.TimeoutError:
+                    pass  # Component waiters time out as nobody clicks
+                except Exception as error:
+                    errors[name][type(error).__name__] += 1
+                latencies[name].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(invoke(name) for name in names))
+        elapsed = time.perf_counter() - start
+
+        return Report(elapsed, latencies, errors)
+
+
+class Report:
+    def __init__(self, elapsed, latencies, errors):
+        self.elapsed = elapsed
+        self.latencies = {name: sorted(values) for name, values in latencies.items()}
+        self.errors = errors
+
+    @property
+    def total(self):
+        return sum(len(values) for values in self.latencies.values())
+
+    def rows(self):
+        rows = []
+        for name, values in sorted(self.latencies.items()):
+            rows.append(
+                [
+                    name,
+                    len(values),
+                    sum(self.errors[name].values()),
+                    f"{percentile(values, 50) * 1000:.1f}",
+                    f"{percentile(values, 90) * 1000:.1f}",
+                    f"{percentile(values, 99) * 1000:.1f}",
+                    f"{values[-1] * 1000:.1f}",
+                ]
+            )
+        return rows
+
+    def as_dict(self):
+        return {
+            "elapsed": self.elapsed,
+            "throughput": self.total / self.elapsed,
+            "commands": {
+                name: {
+                    "calls": len(values),
+                    "errors": dict(self.errors[name]),
+                    "p50": percentile(values, 50),
+                    "p90": percentile(values, 90),
+                    "p99": percentile(values, 99),
+                    "max": values[-1],
+                }
+                for name, values in self.latencies.items()
+            },
+        }
+
+    def __str__(self):
+        lines = [
+            f"{self.total} invocations in {self.elapsed:.2f}s - "
+            f"{self.total / self.elapsed:.0f} invocations/s",
+            make_table(
+                self.rows(),
+                labels=[
+                    "Command",
+                    "Calls",
+                    "Errors",
+                    "p50 ms",
+                    "p90 ms",
+                    "p99 ms",
+                    "Max ms",
+                ],
+            ),
+        ]
+        for name, counter in sorted(self.errors.items()):
+            for error, count in counter.most_common():
+                lines.append(f"{name}: {count}x {error}")
+        return "\n".join(lines)
+
+
+SCENARIOS = (
+    "info",
+    "pointbuy",
+    "regen",
+    "roll",
+    "refresh_charsheet",
+    "inventory",
+    "autocomplete",
+    "party",
+)
+
+
+async def main(args):
+    harness = Harness(args.players, args.db_latency, args.http_latency, args.seed)
+    await harness.populate()
+    report = await harness.run(args.invocations, args.concurrency, args.mix)
+    print(report)
+    edit_queue = harness.bot.caches.get("edit_queue")
+    if edit_queue is not None:
+        print(
+            f"Charsheet edits: {edit_queue.scheduled} scheduled, "
+            f"{edit_queue.edited} sent, {len(edit_queue)} pending"
+        )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report.as_dict(), f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--invocations", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=500)
+    parser.add_argument("--players", type=int, default=200)
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX)
+    parser.add_argument(
+        "--db-latency",
+        type=float,
+        default=0.002,
+        help="Simulated database round-trip, s",
+    )
+    parser.add_argument(
+        "--http-latency",
+        type=float,
+        default=0.02,
+        help="Simulated Discord API round-trip, s",
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", help="Write the report as JSON to this path")
+
+    asyncio.run(main(parser.parse_args()))
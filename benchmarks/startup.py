@@ -0,0 +1,72 @@
+"""Startup benchmark: time from process start to gateway READY
+
+Starts the real bot (config.json with a valid token is required) several times with
+RPBOT_EXIT_ON_READY set, so it exits as soon as it is ready.
+
+Usage: python -m benchmarks.startup --runs 5 --json startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from src.utils.misc import abs_join, make_table
+
+MAIN = abs_join(os.path.dirname(__file__), "..", "main.py")
+
+
+def run_once(timeout):
+    env = dict(os.environ, RPBOT_EXIT_ON_READY="1")
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, MAIN],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        timeout=timeout,
+    )
+    wall = time.perf_counter() - start
+
+    for line in process.stderr.splitlines():
+        if line.startswith("STARTUP "):
+            timings = json.loads(line[len("STARTUP ") :])
+            timings["wall"] = wall
+            return timings
+    raise RuntimeError(f"Bot did not become ready:\n{process.stderr[-2000:]}")
+
+
+def main(args):
+    runs = [run_once(args.timeout) for _ in range(args.runs)]
+    stages = list(runs[0])
+    summary = {
+        stage: {
+            "mean": statistics.mean(run[stage] for run in runs),
+            "min": min(run[stage] for run in runs),
+            "max": max(run[stage] for run in runs),
+        }
+        for stage in stages
+    }
+    print(
+        make_table(
+            [
+                [stage, f"{values['mean']:.3f}", f"{values['min']:.3f}", f"{values['max']:.3f}"]
+                for stage, values in summary.items()
+            ],
+            labels=["Stage", "Mean s", "Min s", "Max s"],
+        )
+    )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"runs": runs, "summary": summary}, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--json", help="Write all runs and the summary as JSON to this path")
+    main(parser.parse_args())
@@ -0,0 +1,348 @@
+"""Micro-benchmark suite of the character model and charsheet pipeline
+
+Runs offline, without Discord or MongoDB, with seeded data. Results (ns per operation)
+can be written as JSON together with the commit and the interpreter they were measured
+with, and compared with an earlier run.
+
+Usage: python -m benchmarks.suite --json before.json
+       python -m benchmarks.suite --json after.json --compare before.json
+       python -m benchmarks.suite --only "get_attribute/*" --repeat 11
+"""
+
+import argparse
+import asyncio
+import datetime
+import fnmatch
+import gc
+import itertools
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.fakes import FakeBot, FakeEngine, FakeGuild, FakeUser
+from src.main_game import CharactersCog
+from src.mg_character_models import (
+    Character,
+    Effect,
+    ExtraStat,
+    OverrideMode,
+    Player,
+    Stat,
+    StatOverride,
+)
+from src.utils.misc import make_progress_bar, make_table
+
+# Name -> function of (random.Random, event loop) returning the function to time,
+# a coroutine function is awaited in the loop
+BENCHMARKS = {}
+
+OVERRIDE_TARGETS = ["max_hp", "max_mp", "strength_bonus", "walk_speed", "level"]
+
+
+def benchmark(name):
+    def decorator(setup):
+        BENCHMARKS[name] = setup
+        return setup
+
+    return decorator
+
+
+def character_data(rng, overrides=0, extra_stats=5):
+    modes = [OverrideMode.ADD, OverrideMode.SUBTRACT, OverrideMode.MULTIPLY]
+    return {
+        "guild_id": 1,
+        "name": "Benchmark hero",
+        "player": Player(guild_id=1, user_id=1000),
+        "level": rng.randint(1, 30),
+        "current_hp": rng.randint(0, 100),
+        "current_mp": rng.randint(0, 100),
+        "stats": {stat.value: rng.randint(10, 90) for stat in Stat},
+        "effects": [
+            Effect(
+                name=f"Effect {i}",
+                overrides=[
+                    StatOverride(
+                        attr_name=OVERRIDE_TARGETS[i % len(OVERRIDE_TARGETS)],
+                        value=rng.randint(1, 3),
+                        mode=modes[i % len(modes)],
+                    )
+                ],
+            )
+            for i in range(overrides)
+        ],
+        "extra_stats": {
+            f"skill_{i}": ExtraStat(name=f"skill_{i}", value=rng.randint(0, 20))
+            for i in range(extra_stats)
+        },
+    }
+
+
+def make_character(rng, overrides=0):
+    return Character(**character_data(rng, overrides))
+
+
+@benchmark("character/construct")
+def construct(rng, loop):
+    data = character_data(rng, overrides=3)
+    return lambda: Character(**data)
+
+
+@benchmark("character/parse_doc")
+def parse_doc(rng, loop):
+    character = make_character(rng, overrides=3)
+    # Documents come from the database with the referenced player inlined
+    doc = {**character.doc(), "player": character.player.doc()}
+    return lambda: Character.parse_doc(doc)
+
+
+def _get_attribute(overrides):
+    def setup(rng, loop):
+        character = make_character(rng, overrides)
+        return lambda: character.get_attribute("max_hp")
+
+    return setup
+
+
+for _overrides in (0, 10, 100):
+    benchmark(f"get_attribute/overrides_{_overrides}")(_get_attribute(_overrides))
+
+
+@benchmark("character/set_stat")
+def set_stat(rng, loop):
+    """Every call changes the stat, so the diff of the properties isn't empty"""
+    character = make_character(rng)
+    values = itertools.cycle([40, 41])
+    return lambda: character.set_stat(Stat.build, next(values))
+
+
+@benchmark("character/regen_hp")
+def regen_hp(rng, loop):
+    character = make_character(rng)
+
+    def regen():
+        character.current_hp = 0
+        character.regen_hp(rounds=3)
+
+    return regen
+
+
+@benchmark("character/regen_mp")
+def regen_mp(rng, loop):
+    character = make_character(rng)
+
+    def regen():
+        character.current_mp = 0
+        character.regen_mp(rounds=3)
+
+    return regen
+
+
+@benchmark("charsheet/make")
+def make_charsheet(rng, loop):
+    character = make_character(rng, overrides=10)
+    user = FakeUser(character.player.user_id)
+    guild = FakeGuild(character.guild_id, [user])
+    cog = CharactersCog(FakeBot(FakeEngine()))
+
+    async def make():
+        await cog.make_charsheet(guild, character.player, character)
+
+    return make
+
+
+@benchmark("misc/make_table_stats")
+def make_table_stats(rng, loop):
+    rows = [
+        [
+            stat.title(),
+            rng.randint(10, 90),
+            f"{rng.randint(1, 9)} → {rng.randint(1, 9)}",
+        ]
+        for stat in Stat
+    ]
+    return lambda: make_table(rows, labels=["Name", "Value", "Bonus"])
+
+
+@benchmark("misc/make_table_large")
+def make_table_large(rng, loop):
+    rows = [
+        [f"Item {i}", rng.randint(1, 99), f"{rng.random() * 100:.1f}", i % 2 == 0]
+        for i in range(50)
+    ]
+    return lambda: make_table(rows, labels=["Name", "Quantity", "Weight", "Equipped"])
+
+
+@benchmark("misc/make_progress_bar")
+def progress_bar(rng, loop):
+    max_value = rng.randint(100, 1000)
+    value = rng.randint(0, max_value)
+    checkpoints = [max_value * share // 20 for share in (10, 15, 18)]
+    return lambda: make_progress_bar(
+        33, value, max_value, label="Stress", unit="sp", checkpoints=checkpoints
+    )
+
+
+def batch(function, loop):
+    """:return: Function of number that calls the benchmarked function that many times"""
+    if asyncio.iscoroutinefunction(function):
+
+        async def repeat(number):
+            for _ in itertools.repeat(None, number):
+                await function()
+
+        # A single run of the loop per batch, so its overhead is shared
+        return lambda number: loop.run_until_complete(repeat(number))
+
+    def run(number):
+        for _ in itertools.repeat(None, number):
+            function()
+
+    return run
+
+
+def time_batch(run, number):
+    """Like timeit: garbage collection doesn't interfere with the timing"""
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        run(number)
+        return time.perf_counter() - start
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def measure(function, loop, repeat, min_time):
+    """:return: Dict of statistics of ns per operation"""
+    run = batch(function, loop)
+    number = 1
+    while time_batch(run, number) < min_time:
+        number *= 2
+    times = [time_batch(run, number) / number * 1e9 for _ in range(repeat)]
+    return {
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.mean(times),
+        "stdev": statistics.stdev(times) if len(times) > 1 else 0,
+        "number": number,
+        "repeat": repeat,
+    }
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, bool(dirty)
+
+
+def metadata(args):
+    commit, dirty = git_commit()
+    return {
+        "commit": commit,
+        "dirty": dirty,
+        "time": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": sys.version,
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "min_time": args.min_time,
+    }
+
+
+def compare_rows(results, baseline):
+    rows = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            rows.append([name, "-", f"{result['min']:.0f}", "new"])
+            continue
+        change = result["min"] / before["min"] - 1
+        rows.append(
+            [name, f"{before['min']:.0f}", f"{result['min']:.0f}", f"{change:+.1%}"]
+        )
+    return rows
+
+
+def main(args):
+    names = [
+        name
+        for name in BENCHMARKS
+        if not args.only or any(fnmatch.fnmatch(name, only) for only in args.only)
+    ]
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    results = {}
+    try:
+        for name in names:
+            function = BENCHMARKS[name](random.Random(args.seed), loop)
+            results[name] = measure(function, loop, args.repeat, args.min_time)
+    finally:
+        loop.close()
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(
+            f"Compared with {baseline['meta']['commit'] or 'unknown commit'}, "
+            f"min ns per operation"
+        )
+        print(
+            make_table(
+                compare_rows(results, baseline["results"]),
+                labels=["Benchmark", "Before ns", "After ns", "Change"],
+            )
+        )
+    else:
+        print(
+            make_table(
+                [
+                    [
+                        name,
+                        f"{result['min']:.0f}",
+                        f"{result['median']:.0f}",
+                        f"{result['stdev']:.0f}",
+                        result["number"],
+                    ]
+                    for name, result in results.items()
+                ],
+                labels=["Benchmark", "Min ns", "Median ns", "Stdev ns", "Loops"],
+            )
+        )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"meta": metadata(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--only",
+        action="append",
+        help="Run only benchmarks matching this pattern, can be repeated",
+    )
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument(
+        "--min-time",
+        type=float,
+        default=0.05,
+        help="Seconds every repeat takes at least, the loops are calibrated to it",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write the results as JSON to this path")
+    parser.add_argument("--compare", help="JSON results of an earlier run")
+    main(parser.parse_args())
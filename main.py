@@ -1,29 +1,97 @@
+# Installed before everything else, so the imports below are timed too
+import src.utils.importtime as importtime  # isort:skip
+
+importtime.install()
+
 import asyncio
+import importlib
 
 # import nest_asyncio_apply  # We want to apply nested asyncio as early as we can, so we do it in this import
 import json
 import logging
 import os
 import random
+import sys
+import time
 from datetime import datetime
 
 import discord
 from discord.ext import commands
-from discord_slash import SlashCommand
-from odmantic import AIOEngine
 
+import src.cluster as cluster
+import src.utils.logs as logs
 import src.utils.misc as utils
+import src.utils.slash_sync as slash_sync
+from src.utils.loop_monitor import LoopMonitor
 
+# Slow to import: the discord_slash component stack and odmantic with bson and motor.
+# They are imported in a thread while the bot logs in, see RPbot.start
+DEFERRED_MODULES = ["src.slash", "odmantic"]
 
-class RPbot(commands.Bot):
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self.slash = SlashCommand(self, sync_commands=False)
-        self.db = AIOEngine()
 
+def install_event_loop_policy(config):
+    """Switches asyncio to uvloop if the "event_loop" config section asks for it
+
+    Must run before the loop is created, in every process of the cluster.
+    """
+    if not config.get("event_loop", {}).get("uvloop", False):
+        return
+    try:
+        import uvloop
+    except ImportError:
+        logging.warning("uvloop is not installed, the default event loop is used")
+        return
+    uvloop.install()
+
+
+def import_modules(names):
+    """Imports the modules and their dependencies, errors are left for the real import
+
+    Extensions are executed again when they are loaded, their dependencies are not.
+    """
+    for name in names:
+        try:
+            importlib.import_module(name)
+        except Exception:
+            pass
+
+
+def member_cache_options(config, intents):
+    """Builds member caching options of the bot from the "members" config section"""
+    policy = config.get("cache", "all")
+    if policy == "all":
+        flags = discord.MemberCacheFlags.from_intents(intents)
+    elif policy == "joined":
+        flags = discord.MemberCacheFlags.none()
+        flags.joined = True
+    elif policy == "none":
+        flags = discord.MemberCacheFlags.none()
+    else:
+        raise ValueError(f"Unknown member cache policy: {policy}")
+
+    return {
+        "member_cache_flags": flags,
+        "chunk_guilds_at_startup": config.get("chunk_at_startup", True),
+    }
+
+
+class RPbot(commands.AutoShardedBot):
+    def __init__(self, **kwargs):
         current_dir = os.path.dirname(os.path.realpath(__file__))
         os.chdir(current_dir)
 
+        members_config = self.read_config("config.json").get("members", {})
+        intents = kwargs.get("intents", discord.Intents.default())
+        for key, value in member_cache_options(members_config, intents).items():
+            kwargs.setdefault(key, value)
+
+        super().__init__(**kwargs)
+        # Created in start after their modules are imported, like `slash`, which
+        # discord_slash refuses to set if the attribute exists
+        self.db = None
+        # Database name -> engine of the guilds with dedicated databases, see get_db
+        self.guild_dbs = {}
+
         random.seed()
 
         self.token = None
@@ -33,14 +101,101 @@ class RPbot(commands.Bot):
 
         self.initial_extensions = []
 
-    def load_config(self, path):
+        self.command_cache = slash_sync.CommandSyncCache(
+            utils.abs_join(self.config["discord"].get("command_cache", ".slash_commands.json"))
+        )
+        self.commands_synced = False
+
+        self.ipc = None
+
+        # Caches that must outlive extension reloads, see get_cache
+        self.caches = {}
+
+        # Text command name -> extension that is loaded on the first use of it
+        self.lazy_extensions = {}
+
+        # Started with the bot, see start_loop_monitor
+        self.loop_monitor = None
+
+        self.startup_timings = {}
+        self.mark_startup("bot_created")
+
+    def mark_startup(self, stage):
+        """Records time since the process start for the startup stage"""
+        self.startup_timings.setdefault(stage, time.perf_counter() - importtime.STARTED_AT)
+
+    @staticmethod
+    def read_config(path):
         with open(utils.abs_join(path), "r") as f:
-            self.config = json.load(f)
+            return json.load(f)
+
+    def load_config(self, path):
+        self.apply_config(self.read_config(path))
+
+    def apply_config(self, config):
+        self.config = config
 
         self.owner_ids = set(self.config["discord"]["owner_ids"])
         utils.guild_ids = self.config["discord"]["guild_ids"]
         self.token = self.config["auth"]["discord_token"]
 
+    @property
+    def is_primary(self):
+        """Whether this process does application-wide work like syncing commands"""
+        return self.shard_ids is None or 0 in self.shard_ids
+
+    def get_cache(self, name, factory):
+        """Returns the bot-wide cache with that name, creating it with factory() if needed"""
+        if name not in self.caches:
+            self.caches[name] = factory()
+        return self.caches[name]
+
+    def get_db(self, guild_id):
+        """Engine with the data of the guild, large guilds can have their own database"""
+        partition = self.config.get("partitions", {}).get(str(guild_id), {})
+        database = partition.get("database")
+        if database is None:
+            return self.db
+        if database not in self.guild_dbs:
+            from odmantic import AIOEngine
+
+            self.guild_dbs[database] = AIOEngine(self.db.client, database=database)
+        return self.guild_dbs[database]
+
+    async def reload_config(self, path="config.json"):
+        """Re-reads the config file and applies it here and, in cluster mode, in all workers"""
+        config = self.read_config(path)
+        await self.update_config(config)
+        if self.ipc is not None:
+            await self.ipc.set_state("config", cluster.public_config(config))
+
+    async def update_config(self, config):
+        old_guild_ids = utils.guild_ids
+        self.apply_config(config)
+        self.dispatch("config_reload")
+
+        if utils.guild_ids != old_guild_ids:
+            # Guild ids are read when cogs are decorated, so they have to be re-imported
+            for name in list(self.extensions):
+                self.reload_extension(name)
+            if self.is_primary:
+                await self.sync_commands()
+
+    def with_secrets(self, config):
+        """Shared config completed with the secret sections of this process' config"""
+        return {
+            **config,
+            **{
+                section: self.config[section]
+                for section in cluster.SECRET_SECTIONS
+                if section in self.config
+            },
+        }
+
+    async def _on_shared_state(self, data):
+        if data["key"] == "config":
+            await self.update_config(self.with_secrets(data["value"]))
+
     def load_initial_extensions(self, extensions):
         for name in extensions:
             self.initial_extensions.append(name)
@@ -52,11 +207,122 @@ class RPbot(commands.Bot):
                     exc_info=error,
                 )
 
-    async def start(self):
-        await super().start(self.token)
+    async def connect_ipc(self, address, name, authkey):
+        """Joins the cluster: takes the shared config and receives cache invalidations"""
+        self.ipc = cluster.IPCClient(address, name, authkey)
+        await self.ipc.connect()
+        if "config" in self.ipc.state:
+            self.apply_config(self.with_secrets(self.ipc.state["config"]))
+        self.ipc.subscribe("state", self._on_shared_state)
+        self.ipc.subscribe(
+            "invalidate",
+            lambda data: self.dispatch("cache_invalidate", data["name"], data["key"]),
+        )
+
+    async def invalidate_cache(self, name, key=None):
+        """Drops an item (or the whole cache if key is None) in this and all other processes
+
+        Cogs handle it in `on_cache_invalidate(name, key)` listeners.
+        """
+        self.dispatch("cache_invalidate", name, key)
+        if self.ipc is not None:
+            await self.ipc.publish("invalidate", {"name": name, "key": key})
+
+    def register_lazy_extensions(self, extensions):
+        """:param extensions: Dict of extension name -> text commands that load it when used"""
+        for name, command_names in extensions.items():
+            for command_name in command_names:
+                self.lazy_extensions[command_name.lower()] = name
 
+    async def get_context(self, message, *, cls=commands.Context):
+        ctx = await super().get_context(message, cls=cls)
+        if ctx.command is None and ctx.invoked_with:
+            name = self.lazy_extensions.get(ctx.invoked_with.lower())
+            if name is not None and name not in self.extensions:
+                logging.info(f"Loading extension {name} on first use")
+                self.load_initial_extensions([name])
+                ctx = await super().get_context(message, cls=cls)
+        return ctx
 
-async def main():
+    async def sync_commands(self, force=False):
+        counts = await slash_sync.sync_changed_commands(
+            self.slash, self.command_cache, force
+        )
+        self.commands_synced = True
+        logging.info(f"Slash commands synced: {dict(counts)}")
+        return counts
+
+    async def on_ready(self):
+        if "ready" not in self.startup_timings:
+            self.mark_startup("ready")
+            logging.info(f"Ready in {self.startup_timings['ready']:.2f}s since the process start")
+        if os.environ.get("RPBOT_EXIT_ON_READY"):
+            # Used by the startup benchmark
+            print(f"STARTUP {json.dumps(self.startup_timings)}", file=sys.stderr, flush=True)
+            await self.close()
+            return
+
+        if (
+            self.is_primary
+            and not self.commands_synced
+            and self.config["discord"].get("sync_on_startup", True)
+        ):
+            await self.sync_commands()
+
+    def start_loop_monitor(self):
+        config = self.config.get("event_loop", {})
+        if not config.get("monitor", True):
+            return
+        self.loop_monitor = LoopMonitor(
+            threshold=config.get("lag_threshold", 0.1),
+            interval=config.get("check_interval", 0.25),
+        )
+        self.loop_monitor.start()
+        self.slash.invocation_hooks.append(self.loop_monitor.hook)
+        logging.info(
+            f"Monitoring {type(asyncio.get_running_loop()).__module__} event loop, "
+            f"blocking over {self.loop_monitor.threshold * 1000:.0f}ms is reported"
+        )
+
+    async def start(self, extensions=()):
+        """Logs in and connects to the gateway, loading the extensions in between
+
+        Slow imports run in a thread while the bot logs in, only the connection waits
+        for them. The extensions are loaded before the gateway sends any command.
+        """
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(
+            self.login(self.token),
+            loop.run_in_executor(
+                None, import_modules, [*DEFERRED_MODULES, *extensions]
+            ),
+        )
+        self.mark_startup("logged_in")
+
+        from odmantic import AIOEngine
+
+        from src.slash import RPSlashCommand
+
+        self.slash = RPSlashCommand(self, sync_commands=False)
+        self.db = AIOEngine()
+        self.start_loop_monitor()
+        self.load_initial_extensions(extensions)
+        self.mark_startup("extensions_loaded")
+        await self.connect()
+
+    async def close(self):
+        if self.loop_monitor is not None:
+            self.loop_monitor.stop()
+        await super().close()
+
+
+async def main(
+    shard_ids=None,
+    shard_count=None,
+    ipc_address=None,
+    ipc_authkey=None,
+    worker_name=None,
+):
     intents = discord.Intents.default()
     intents.members = True
     bot = RPbot(
@@ -64,18 +330,23 @@ async def main():
         help_command=None,
         case_insensitive=True,
         intents=intents,
+        shard_ids=shard_ids,
+        shard_count=shard_count,
     )
+    if ipc_address is not None:
+        await bot.connect_ipc(ipc_address, worker_name, ipc_authkey)
 
     @bot.command()
-    async def sync(ctx):
-        await bot.slash.sync_all_commands()
-        await ctx.send("Syncing all slash commands")
-
-    # noinspection PyArgumentList
-    logging.basicConfig(
-        level=logging.DEBUG,
-        format="[%(asctime)s] [%(levelname)-9.9s]-[%(name)-15.15s]: %(message)s",
-    )
+    @commands.is_owner()
+    async def sync(ctx, mode=None):
+        await ctx.send("Syncing changed slash commands")
+        counts = await bot.sync_commands(force=(mode == "force"))
+        await ctx.send(
+            f"Slash commands synced: {counts['added']} added, {counts['updated']} updated, "
+            f"{counts['removed']} removed, {counts['unchanged']} unchanged"
+        )
+
+    log_listener = logs.setup_logging(bot.config.get("logging", {}))
     logging.getLogger("db_client").setLevel(logging.INFO)
     logging.getLogger("aiomysql").setLevel(logging.INFO)
     logging.getLogger("discord.client").setLevel(logging.CRITICAL)
@@ -83,15 +354,28 @@ async def main():
     logging.getLogger("discord.http").setLevel(logging.ERROR)
 
     initial_extensions = ["src.errors", "src.main_game"]
+    lazy_extensions = {
+        "src.diagnostics": ["profile", "memory", "importtime", "loop"],
+        "src.admin": ["reload", "backup"],
+    }
 
-    bot.load_initial_extensions(initial_extensions)
+    bot.register_lazy_extensions(lazy_extensions)
 
     try:
-        await bot.start()
+        await bot.start(initial_extensions)
     finally:
         await bot.logout()
+        if bot.ipc is not None:
+            await bot.ipc.close()
+        log_listener.stop()
 
 
 if __name__ == "__main__":
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(main())
+    os.chdir(os.path.dirname(os.path.realpath(__file__)))
+    config = RPbot.read_config("config.json")
+    install_event_loop_policy(config)
+    if config.get("cluster", {}).get("workers", 1) > 1:
+        cluster.run_cluster(config)
+    else:
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(main())
@@ -0,0 +1,140 @@
+import datetime
+import logging
+import os
+
+from discord.ext import commands
+
+from src.mg_backup import ALL_GUILDS, BackupError, export_backup, import_backup
+from src.utils.misc import make_table
+
+logger = logging.getLogger(__name__)
+
+
+class Admin(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+
+    async def cog_check(self, ctx):
+        return await self.bot.is_owner(ctx.author)
+
+    @commands.group(invoke_without_command=True)
+    async def reload(self, ctx):
+        await ctx.send(
+            "Usage:\n"
+            "`reload config` - re-read config.json without reconnecting\n"
+            "`reload extension <name>` - reload a single extension in place"
+        )
+
+    @reload.command(name="config")
+    async def reload_config(self, ctx):
+        await self.bot.reload_config()
+        await ctx.send("Config reloaded")
+
+    @reload.command(name="extension")
+    async def reload_extension(self, ctx, name):
+        # Cog caches live on the bot (see RPbot.get_cache), pending component waiters are
+        # bot listeners, so both survive the reload
+        if name in self.bot.extensions:
+            self.bot.reload_extension(name)
+        else:
+            self.bot.load_extension(name)
+        logger.info(f"Extension {name} reloaded by {ctx.author}")
+
+        if self.bot.slash.commands and self.bot.is_primary:
+            counts = await self.bot.sync_commands()
+            await ctx.send(
+                f"Extension `{name}` reloaded, "
+                f"{counts['added'] + counts['updated'] + counts['removed']} slash command(s) synced"
+            )
+        else:
+            await ctx.send(f"Extension `{name}` reloaded")
+
+    @property
+    def backup_directory(self):
+        return self.bot.config.get("backups", {}).get("directory", "backups")
+
+    def dedicated_dbs(self):
+        """:return: Dict of guild id -> engine of the guilds with their own databases"""
+        engines = {
+            int(guild_id): self.bot.get_db(int(guild_id))
+            for guild_id in self.bot.config.get("partitions", {})
+        }
+        return {
+            guild_id: engine
+            for guild_id, engine in engines.items()
+            if engine is not self.bot.db
+        }
+
+    @commands.group(invoke_without_command=True)
+    async def backup(self, ctx):
+        await ctx.send(
+            "Usage:\n"
+            "`backup export [guild_id] [jsonl|bson]` - write players and characters to a backup file\n"
+            "`backup validate <file> [guild_id]` - check a backup file without importing it\n"
+            "`backup import <file> [guild_id]` - write the documents of a backup file to the database"
+        )
+
+    @backup.command(name="export")
+    async def backup_export(self, ctx, guild_id: int = None, file_format="jsonl"):
+        if file_format not in ("jsonl", "bson"):
+            raise commands.BadArgument("Format must be `jsonl` or `bson`!")
+        os.makedirs(self.backup_directory, exist_ok=True)
+        name = datetime.datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+        if guild_id is not None:
+            name = f"{name}-{guild_id}"
+        path = os.path.join(self.backup_directory, f"{name}.{file_format}.gz")
+
+        await ctx.send(f"Exporting to `{path}`")
+        counts = await export_backup(
+            self.bot.db,
+            path,
+            ALL_GUILDS if guild_id is None else guild_id,
+            partitions=self.dedicated_dbs(),
+        )
+        await ctx.send(
+            f"Exported to `{path}`\n```\n"
+            f"{make_table(sorted(counts.items()), labels=['Collection', 'Documents'])}\n```"
+        )
+
+    async def run_import(self, ctx, name, guild_id, dry_run):
+        path = os.path.join(self.backup_directory, os.path.basename(name))
+        if not os.path.isfile(path):
+            raise commands.BadArgument(f"There is no backup `{path}`!")
+
+        try:
+            result = await import_backup(
+                self.bot.db,
+                path,
+                ALL_GUILDS if guild_id is None else guild_id,
+                dry_run=dry_run,
+                partitions=self.dedicated_dbs(),
+            )
+        except BackupError as error:
+            raise commands.BadArgument(str(error))
+        if not dry_run:
+            # Cached data of the imported guilds is stale
+            await self.bot.invalidate_cache("character_names", guild_id)
+            await self.bot.invalidate_cache("rulesets", guild_id)
+
+        lines = [
+            f"{'Validated' if dry_run else 'Imported'} `{path}`",
+            f"```\n{make_table(sorted(result.counts.items()), labels=['Collection', 'Documents'])}\n```",
+            f"Skipped (other guilds): {result.skipped}, errors: {result.error_count}",
+        ]
+        lines.extend(
+            f"`{collection} {doc_id}`: {message[:200]}"
+            for collection, doc_id, message in result.errors[:5]
+        )
+        await ctx.send("\n".join(lines))
+
+    @backup.command(name="validate")
+    async def backup_validate(self, ctx, name, guild_id: int = None):
+        await self.run_import(ctx, name, guild_id, dry_run=True)
+
+    @backup.command(name="import")
+    async def backup_import(self, ctx, name, guild_id: int = None):
+        await self.run_import(ctx, name, guild_id, dry_run=False)
+
+
+def setup(bot):
+    bot.add_cog(Admin(bot))
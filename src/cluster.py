@@ -0,0 +1,352 @@
+"""Cluster mode: AutoShardedBot shards spread over several worker processes
+
+The supervisor process runs an IPCHub, workers connect to it with an IPCClient to share
+state (the config) and to broadcast messages (cache invalidations) to each other.
+Messages are JSON objects, one per line.
+
+Peers prove they know the hub's random authkey, passed to the workers when they are
+spawned, by answering a challenge before they get anything. Secret config sections are
+not shared at all, every process reads them from its own config file.
+"""
+
+import asyncio
+import collections
+import hmac
+import json
+import logging
+import multiprocessing
+import secrets
+
+import src.utils.logs as logs
+
+logger = logging.getLogger(__name__)
+
+LINE_LIMIT = 2**24
+AUTH_TIMEOUT = 5
+
+# Config sections that are never put in the shared state
+SECRET_SECTIONS = frozenset({"auth"})
+
+MISSING = object()
+
+
+def assign_shards(shard_count, workers):
+    """Splits shard ids into `workers` contiguous chunks of (almost) equal size"""
+    return [
+        list(
+            range(
+                shard_count * worker // workers, shard_count * (worker + 1) // workers
+            )
+        )
+        for worker in range(workers)
+    ]
+
+
+def shard_id(guild_id, shard_count):
+    return (guild_id >> 22) % shard_count
+
+
+def _encode(message):
+    return json.dumps(message, separators=(",", ":")).encode() + b"\n"
+
+
+def _sign(authkey, challenge):
+    return hmac.new(authkey, challenge.strip(), "sha256").hexdigest().encode()
+
+
+def public_config(config):
+    """The config without its secret sections, for the shared state"""
+    return {key: value for key, value in config.items() if key not in SECRET_SECTIONS}
+
+
+class IPCHub:
+    """Keeps the shared state and relays messages between the workers
+
+    :param drain_timeout: Seconds a worker has to take a message, slower ones are
+        disconnected instead of buffering messages for them without a limit
+    :param authkey: Bytes the peers must know, random by default
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, drain_timeout=5.0, authkey=None):
+        self.host = host
+        self.port = port
+        self.drain_timeout = drain_timeout
+        self.authkey = authkey or secrets.token_bytes(32)
+        self.state = {}
+        self.writers = set()
+        self.server = None
+
+    @property
+    def address(self):
+        return self.host, self.port
+
+    async def start(self):
+        self.server = await asyncio.start_server(
+            self._handle, self.host, self.port, limit=LINE_LIMIT
+        )
+        self.port = self.server.sockets[0].getsockname()[1]
+        logger.info(f"IPC hub listening on {self.host}:{self.port}")
+
+    async def close(self):
+        self.server.close()
+        for writer in list(self.writers):
+            writer.close()
+        await self.server.wait_closed()
+
+    async def set_state(self, key, value):
+        self.state[key] = value
+        await self._broadcast({"op": "set", "key": key, "value": value})
+
+    async def _broadcast(self, message, exclude=None):
+        data = _encode(message)
+        writers = [writer for writer in self.writers if writer is not exclude]
+        for writer in writers:
+            writer.write(data)
+        # Concurrently, so a slow worker doesn't hold the messages of the others back
+        await asyncio.gather(*map(self._drain, writers))
+
+    async def _drain(self, writer):
+        try:
+            await asyncio.wait_for(writer.drain(), self.drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(
+                f"IPC peer {writer.get_extra_info('peername')} didn't take a message "
+                f"in {self.drain_timeout}s, disconnecting it"
+            )
+            self.writers.discard(writer)
+            writer.close()
+        except ConnectionError:
+            self.writers.discard(writer)
+
+    async def _authenticate(self, reader, writer):
+        challenge = secrets.token_hex(16).encode()
+        writer.write(challenge + b"\n")
+        try:
+            answer = await asyncio.wait_for(reader.readline(), AUTH_TIMEOUT)
+        except (asyncio.TimeoutError, ConnectionError):
+            return False
+        return hmac.compare_digest(answer.strip(), _sign(self.authkey, challenge))
+
+    async def _handle(self, reader, writer):
+        if not await self._authenticate(reader, writer):
+            logger.warning(
+                f"IPC peer {writer.get_extra_info('peername')} failed to authenticate"
+            )
+            writer.close()
+            return
+        self.writers.add(writer)
+        writer.write(_encode({"op": "state", "state": self.state}))
+        try:
+            async for line in reader:
+                message = json.loads(line)
+                if message["op"] == "set":
+                    self.state[message["key"]] = message["value"]
+                await self._broadcast(message, exclude=writer)
+        except ConnectionError:
+            pass
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+
+
+class IPCClient:
+    """Connection of a worker to the hub, it reconnects when the hub goes away
+
+    Messages are sent on a best-effort basis: while the hub is unreachable they are
+    dropped with a warning, so callers like cache invalidations never fail on them.
+    """
+
+    def __init__(self, address, name, authkey, max_backoff=30.0):
+        self.address = address
+        self.name = name
+        self.authkey = authkey
+        self.max_backoff = max_backoff
+        self.state = {}
+        self.handlers = collections.defaultdict(list)
+        self._reader = None
+        self._writer = None
+        self._task = None
+
+    async def connect(self):
+        await self._open()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _open(self):
+        """:return: Dict of the shared state values that changed while disconnected"""
+        host, port = self.address
+        reader, writer = await asyncio.open_connection(host, port, limit=LINE_LIMIT)
+        try:
+            challenge = await reader.readline()
+            writer.write(_sign(self.authkey, challenge) + b"\n")
+            await writer.drain()
+            # The hub starts with a state snapshot once the peer is authenticated
+            line = await reader.readline()
+        except ConnectionError:
+            writer.close()
+            raise
+        if not line:
+            writer.close()
+            raise ConnectionError("IPC hub closed the connection, wrong authkey?")
+        state = json.loads(line)["state"]
+        changed = {
+            key: value
+            for key, value in state.items()
+            if self.state.get(key, MISSING) != value
+        }
+        self.state = state
+        self._reader, self._writer = reader, writer
+        return changed
+
+    async def _run(self):
+        while True:
+            try:
+                await self._read()
+            except ConnectionError:
+                pass
+            self._writer.close()
+            logger.error(f"IPC connection of {self.name} to the hub was closed")
+            changed = await self._reconnect()
+            for key, value in changed.items():
+                self._dispatch("state", {"key": key, "value": value})
+
+    async def _reconnect(self):
+        delay = 0.5
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                changed = await self._open()
+            except (OSError, ValueError) as error:
+                delay = min(delay * 2, self.max_backoff)
+                logger.warning(
+                    f"IPC reconnect of {self.name} failed: {repr(error)}, "
+                    f"retrying in {delay:.1f}s"
+                )
+                continue
+            logger.info(f"IPC connection of {self.name} to the hub was restored")
+            return changed
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+
+    def subscribe(self, topic, handler):
+        """:param handler: Function or coroutine function taking message data"""
+        self.handlers[topic].append(handler)
+
+    async def _send(self, message):
+        if self._writer is None or self._writer.is_closing():
+            logger.warning(
+                f"IPC hub is unreachable, {message['op']} of {self.name} was dropped"
+            )
+            return
+        try:
+            self._writer.write(_encode(message))
+            await self._writer.drain()
+        except ConnectionError as error:
+            logger.warning(
+                f"IPC {message['op']} of {self.name} failed: {repr(error)}, dropped"
+            )
+
+    async def publish(self, topic, data):
+        """Sends data to the subscribers of the topic in all other processes"""
+        await self._send(
+            {"op": "publish", "topic": topic, "data": data, "sender": self.name}
+        )
+
+    async def set_state(self, key, value):
+        self.state[key] = value
+        await self._send({"op": "set", "key": key, "value": value})
+
+    def _dispatch(self, topic, data):
+        for handler in self.handlers[topic]:
+            try:
+                result = handler(data)
+                if asyncio.iscoroutine(result):
+                    asyncio.get_running_loop().create_task(result)
+            except Exception as error:
+                logger.error(
+                    f"IPC handler for {topic} failed: {repr(error)}", exc_info=error
+                )
+
+    async def _read(self):
+        async for line in self._reader:
+            message = json.loads(line)
+            if message["op"] == "set":
+                self.state[message["key"]] = message["value"]
+                self._dispatch(
+                    "state", {"key": message["key"], "value": message["value"]}
+                )
+            elif message["op"] == "publish":
+                self._dispatch(message["topic"], message["data"])
+
+
+def worker_main(worker, shard_ids, shard_count, ipc_address, ipc_authkey):
+    import main as bot_main
+
+    # Spawned processes start with the default event loop policy
+    bot_main.install_event_loop_policy(bot_main.RPbot.read_config("config.json"))
+    asyncio.run(
+        bot_main.main(
+            shard_ids=shard_ids,
+            shard_count=shard_count,
+            ipc_address=ipc_address,
+            ipc_authkey=ipc_authkey,
+            worker_name=f"worker-{worker}",
+        )
+    )
+
+
+async def supervise(config, target=worker_main, check_interval=5):
+    """Runs the IPC hub and keeps worker processes alive, restarting crashed ones"""
+    cluster = config.get("cluster", {})
+    workers = cluster.get("workers", multiprocessing.cpu_count())
+    shard_count = cluster.get("shard_count", workers)
+    workers = min(workers, shard_count)
+    assignment = assign_shards(shard_count, workers)
+
+    hub = IPCHub(
+        port=cluster.get("port", 0), drain_timeout=cluster.get("drain_timeout", 5.0)
+    )
+    await hub.start()
+    await hub.set_state("config", public_config(config))
+
+    context = multiprocessing.get_context("spawn")
+
+    def spawn(worker):
+        process = context.Process(
+            target=target,
+            args=(worker, assignment[worker], shard_count, hub.address, hub.authkey),
+            name=f"rpbot-worker-{worker}",
+        )
+        process.start()
+        logger.info(
+            f"Started worker {worker} (pid {process.pid}) with shards {assignment[worker]}"
+        )
+        return process
+
+    processes = [spawn(worker) for worker in range(workers)]
+    try:
+        while True:
+            await asyncio.sleep(check_interval)
+            for worker, process in enumerate(processes):
+                if not process.is_alive():
+                    logger.warning(
+                        f"Worker {worker} exited with code {process.exitcode}, restarting"
+                    )
+                    processes[worker] = spawn(worker)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+        await hub.close()
+
+
+def run_cluster(config):
+    logs.setup_logging(config.get("logging", {}))
+    try:
+        asyncio.run(supervise(config))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,417 @@
+import asyncio
+import collections
+import contextlib
+import cProfile
+import io
+import logging
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+import discord
+from discord.ext import commands
+
+import src.utils.importtime as importtime
+from src.utils.misc import make_table
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_LIMIT = 2000
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _shorten(text, width):
+    return text if len(text) <= width else f"…{text[-(width - 1):]}"
+
+
+def _function_label(func):
+    filename, line, name = func
+    if filename == "~":  # Built-in functions
+        return name
+    return f"{os.path.basename(filename)}:{line}({name})"
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_firstlineno}({code.co_name})"
+
+
+class SamplingProfiler:
+    """Samples the stack of a thread (the event loop one) from a background thread"""
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = 0
+        self.self_counts = collections.Counter()
+        self.total_counts = collections.Counter()
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="sampling-profiler", daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+
+            self.samples += 1
+            self.self_counts[_frame_label(frame)] += 1
+            seen = set()
+            while frame is not None:
+                label = _frame_label(frame)
+                if label not in seen:
+                    seen.add(label)
+                    self.total_counts[label] += 1
+                frame = frame.f_back
+
+    def rows(self, limit):
+        samples = max(1, self.samples)
+        return [
+            [
+                f"{count / samples:.1%}",
+                f"{self.total_counts[label] / samples:.1%}",
+                _shorten(label, 45),
+            ]
+            for label, count in self.self_counts.most_common(limit)
+        ]
+
+
+class CommandProfiler:
+    """Profiles the next N invocations of a slash command or component callback
+
+    cProfile is per-thread, so other tasks running while the command awaits are profiled too.
+    """
+
+    def __init__(self, name, invocations, on_done):
+        self.name = name
+        self.remaining = invocations
+        self.profile = cProfile.Profile()
+        self.on_done = on_done
+        self._active = 0
+
+    @contextlib.contextmanager
+    def hook(self, name, ctx):
+        if name != self.name or self.remaining <= 0:
+            yield
+            return
+
+        self.remaining -= 1
+        if not self._active:
+            self.profile.enable()
+        self._active += 1
+        try:
+            yield
+        finally:
+            self._active -= 1
+            if not self._active:
+                self.profile.disable()
+                if self.remaining <= 0:
+                    self.on_done(self)
+
+
+def _culprit_label(stack):
+    """Innermost frame of the bot's own code in the stack, or the innermost one"""
+    frames = [frame for frame in stack if frame.filename.startswith(PROJECT_DIR)]
+    frame = (frames or list(stack) or [None])[-1]
+    if frame is None:
+        return "unknown"
+    return f"{os.path.basename(frame.filename)}:{frame.lineno}({frame.name})"
+
+
+def profile_rows(profile, sort="cumulative", limit=15):
+    stats = pstats.Stats(profile)
+    stats.sort_stats(sort)
+    rows = []
+    for func in stats.fcn_list[:limit]:
+        primitive_calls, calls, total_time, cumulative_time, _ = stats.stats[func]
+        rows.append(
+            [
+                calls,
+                f"{total_time:.3f}",
+                f"{cumulative_time:.3f}",
+                _shorten(_function_label(func), 45),
+            ]
+        )
+    return rows
+
+
+def profile_file(profile, filename="profile.pstats"):
+    profile.create_stats()
+    return discord.File(io.BytesIO(marshal.dumps(profile.stats)), filename)
+
+
+class Diagnostics(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        # cProfile allows one enabled profiler at a time, profiles don't overlap
+        self.profiler = None
+        self.memory_baseline = None
+
+    async def cog_check(self, ctx):
+        return await self.bot.is_owner(ctx.author)
+
+    def cog_unload(self):
+        for hook in list(self.bot.slash.invocation_hooks):
+            if isinstance(getattr(hook, "__self__", None), CommandProfiler):
+                self.bot.slash.invocation_hooks.remove(hook)
+        self.profiler = None
+
+    def check_profiler_idle(self):
+        if isinstance(self.profiler, CommandProfiler):
+            raise commands.BadArgument(
+                f"Profiler is waiting for {self.profiler.remaining} invocation(s) of "
+                f"`{self.profiler.name}`! Use `profile stop` to stop it"
+            )
+        if self.profiler is not None:
+            raise commands.BadArgument("Profiler is already running!")
+
+    @staticmethod
+    async def send_table(ctx, title, rows, labels, file=None):
+        if not rows:
+            await ctx.send(f"{title}\nNothing was recorded", file=file)
+            return
+
+        while True:
+            message = f"{title}\n```py\n{make_table(rows, labels=labels)}\n```"
+            if len(message) <= MESSAGE_LIMIT or len(rows) == 1:
+                break
+            rows = rows[:-1]
+        await ctx.send(message, file=file)
+
+    @commands.group(invoke_without_command=True)
+    async def profile(self, ctx):
+        await ctx.send(
+            "Usage:\n"
+            "`profile time <seconds> [cprofile|sampling]` - profile the whole bot for N seconds\n"
+            "`profile command <invocations> <name>` - profile next N invocations of a command\n"
+            "`profile stop` - stop profiling a command"
+        )
+
+    @profile.command(name="time")
+    async def profile_time(self, ctx, seconds: float = 10, mode="cprofile"):
+        self.check_profiler_idle()
+        if mode not in ("cprofile", "sampling"):
+            raise commands.BadArgument("Profiling mode must be `cprofile` or `sampling`")
+
+        self.profiler = mode
+        await ctx.send(f"Profiling for {seconds:g}s ({mode})")
+        try:
+            if mode == "cprofile":
+                profile = cProfile.Profile()
+                profile.enable()
+                try:
+                    await asyncio.sleep(seconds)
+                finally:
+                    profile.disable()
+            else:
+                sampler = SamplingProfiler(threading.get_ident())
+                sampler.start()
+                try:
+                    await asyncio.sleep(seconds)
+                finally:
+                    sampler.stop()
+        finally:
+            self.profiler = None
+
+        if mode == "cprofile":
+            await self.send_table(
+                ctx,
+                f"Hot functions during {seconds:g}s",
+                profile_rows(profile),
+                labels=["Calls", "Own s", "Total s", "Function"],
+                file=profile_file(profile),
+            )
+        else:
+            await self.send_table(
+                ctx,
+                f"Hot functions during {seconds:g}s ({sampler.samples} samples)",
+                sampler.rows(15),
+                labels=["Own", "Total", "Function"],
+            )
+
+    @profile.command(name="command")
+    async def profile_command(self, ctx, invocations: int, *, name):
+        if invocations < 1:
+            raise commands.BadArgument("Amount of invocations must be positive!")
+        self.check_profiler_idle()
+
+        def on_done(profiler):
+            self.bot.slash.invocation_hooks.remove(profiler.hook)
+            self.profiler = None
+            self.bot.loop.create_task(
+                self.send_table(
+                    ctx,
+                    f"Hot functions during {invocations} `{name}` invocation(s)",
+                    profile_rows(profiler.profile),
+                    labels=["Calls", "Own s", "Total s", "Function"],
+                    file=profile_file(profiler.profile),
+                )
+            )
+
+        self.profiler = CommandProfiler(name, invocations, on_done)
+        self.bot.slash.invocation_hooks.append(self.profiler.hook)
+        await ctx.send(f"Profiling next {invocations} invocation(s) of `{name}`")
+
+    @profile.command(name="stop")
+    async def profile_stop(self, ctx):
+        profiler = self.profiler
+        if not isinstance(profiler, CommandProfiler):
+            raise commands.BadArgument("No command is being profiled!")
+        if profiler._active:
+            raise commands.BadArgument(
+                f"`{profiler.name}` is being profiled right now!"
+            )
+
+        self.bot.slash.invocation_hooks.remove(profiler.hook)
+        self.profiler = None
+        await ctx.send(f"Stopped profiling `{profiler.name}`")
+
+    @commands.group(invoke_without_command=True)
+    async def memory(self, ctx):
+        await ctx.send(
+            "Usage:\n"
+            "`memory start [frames]` - start tracing allocations and take a baseline snapshot\n"
+            "`memory report [limit]` - show memory growth since the baseline by allocation site\n"
+            "`memory stop` - stop tracing allocations"
+        )
+
+    @memory.command(name="start")
+    async def memory_start(self, ctx, frames: int = 1):
+        loop = asyncio.get_running_loop()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        self.memory_baseline = await loop.run_in_executor(
+            None, tracemalloc.take_snapshot
+        )
+        await ctx.send(f"Tracing allocations ({frames} frame(s)), baseline taken")
+
+    @memory.command(name="report")
+    async def memory_report(self, ctx, limit: int = 15):
+        if self.memory_baseline is None or not tracemalloc.is_tracing():
+            raise commands.BadArgument("Memory tracing is not running! Use `memory start`")
+
+        def compare():
+            snapshot = tracemalloc.take_snapshot().filter_traces(
+                (
+                    tracemalloc.Filter(False, tracemalloc.__file__),
+                    tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+                )
+            )
+            return snapshot.compare_to(self.memory_baseline, "lineno")
+
+        loop = asyncio.get_running_loop()
+        differences = await loop.run_in_executor(None, compare)
+        rows = [
+            [
+                f"{diff.size_diff / 1024:+.1f}",
+                f"{diff.size / 1024:.1f}",
+                f"{diff.count_diff:+}",
+                _shorten(
+                    f"{os.path.basename(diff.traceback[0].filename)}:{diff.traceback[0].lineno}",
+                    40,
+                ),
+            ]
+            for diff in differences[:limit]
+        ]
+        current, peak = tracemalloc.get_traced_memory()
+        await self.send_table(
+            ctx,
+            f"Memory growth since baseline | traced: {current / 2**20:.1f} MiB, peak: {peak / 2**20:.1f} MiB",
+            rows,
+            labels=["Δ KiB", "KiB", "Δ Blocks", "Allocation site"],
+        )
+
+    @memory.command(name="stop")
+    async def memory_stop(self, ctx):
+        tracemalloc.stop()
+        self.memory_baseline = None
+        await ctx.send("Stopped tracing allocations")
+
+    def get_loop_monitor(self):
+        if self.bot.loop_monitor is None:
+            raise commands.BadArgument(
+                "Event loop monitor is disabled in the `event_loop` config!"
+            )
+        return self.bot.loop_monitor
+
+    @commands.group(name="loop", invoke_without_command=True)
+    async def loop_health(self, ctx):
+        monitor = self.get_loop_monitor()
+        rows = [
+            [
+                time.strftime("%H:%M:%S", time.localtime(slow.started_at)),
+                "…" if slow.duration is None else f"{slow.duration * 1000:.0f}",
+                _shorten(slow.command or slow.task or "?", 20),
+                _shorten(_culprit_label(slow.stack), 35),
+            ]
+            for slow in reversed(monitor.slow_callbacks)
+        ]
+        await self.send_table(
+            ctx,
+            f"Event loop `{type(self.bot.loop).__module__}` | lag over "
+            f"{len(monitor.lags)} checks: p50 {monitor.percentile(0.5) * 1000:.1f}ms, "
+            f"p99 {monitor.percentile(0.99) * 1000:.1f}ms, "
+            f"max {monitor.max_lag * 1000:.0f}ms | blocked over "
+            f"{monitor.threshold * 1000:.0f}ms: {monitor.blocked} time(s)\n"
+            f"Latest first, `loop stack <number>` shows the stack",
+            rows,
+            labels=["Time", "ms", "Command", "Where"],
+        )
+
+    @loop_health.command(name="stack")
+    async def loop_stack(self, ctx, number: int = 1):
+        slow_callbacks = list(reversed(self.get_loop_monitor().slow_callbacks))
+        if not 1 <= number <= len(slow_callbacks):
+            raise commands.BadArgument(
+                f"There are {len(slow_callbacks)} recorded slow callback(s)!"
+            )
+
+        slow = slow_callbacks[number - 1]
+        lines = slow.stack.format() if slow.stack else ["Stack is unavailable\n"]
+        duration = "…" if slow.duration is None else f"{slow.duration * 1000:.0f}ms"
+        title = (
+            f"Blocked for {duration} by `{slow.command or slow.task or '?'}`, "
+            f"innermost frame last"
+        )
+        # The innermost frames are the interesting ones, the outer ones are cut first
+        while True:
+            message = f"{title}\n```py\n{''.join(lines)}```"
+            if len(message) <= MESSAGE_LIMIT or len(lines) == 1:
+                break
+            lines = lines[1:]
+        await ctx.send(message[:MESSAGE_LIMIT])
+
+    @commands.command(name="importtime")
+    async def import_time(self, ctx, limit: int = 20, sort="cumulative"):
+        if importtime.timer is None:
+            raise commands.BadArgument("Import timing was not installed at startup!")
+
+        timings = ", ".join(
+            f"{stage}: {seconds:.2f}s" for stage, seconds in self.bot.startup_timings.items()
+        )
+        await self.send_table(
+            ctx,
+            f"Slowest imports ({len(importtime.timer.modules)} modules, "
+            f"{importtime.timer.total:.2f}s total) | startup: {timings}",
+            importtime.timer.rows(limit, sort),
+            labels=["Module", "Self ms", "Total ms"],
+        )
+
+
+def setup(bot):
+    bot.add_cog(Diagnostics(bot))
@@ -1,12 +1,14 @@
 import asyncio
+import collections
 import datetime
+import functools
 import logging
 import math
-import random
 import re
 
 import discord
 from bson import ObjectId
+from bson.errors import InvalidId
 from discord.ext import commands
 from discord_slash import ComponentContext, SlashContext, cog_ext
 from discord_slash.utils.manage_commands import create_choice, create_option
@@ -16,29 +18,176 @@ from discord_slash.utils.manage_components import (
     create_button,
     create_select,
     create_select_option,
-    wait_for_component,
 )
-from odmantic import AIOEngine
-
-from src.mg_character_models import Character, Player, Stat
-from src.utils.misc import guild_ids, make_progress_bar, make_table
+from odmantic import query
+from pymongo import ReturnDocument
+
+from src.mg_character_index import CharacterNameIndex
+from src.mg_character_models import (
+    DEFAULT_RULESET,
+    MAX_ITEM_NAME_LENGTH,
+    Character,
+    InventoryItem,
+    Player,
+    Stat,
+    make_ruleset,
+)
+from src.mg_history import (
+    EXCLUDED_FIELDS,
+    MISSING,
+    CharacterHistory,
+    HistoryError,
+    changes,
+    character_state,
+)
+from src.mg_partitions import Partition
+from src.mg_rolls import (
+    ALL_STATS,
+    ALL_TIME,
+    Check,
+    StatRoll,
+    RollLog,
+    day_bucket,
+    session_bucket,
+)
+from src.mg_rulesets import (
+    DEFAULT_FORMULAS,
+    MAX_CUSTOM_FORMULAS,
+    FormulaError,
+    GuildRuleset,
+)
+from src.utils.autocomplete import AutocompleteContext
+from src.utils.edit_queue import EditQueue
+from src.utils.misc import LRUCache, guild_ids, make_progress_bar, make_table
 
 logger = logging.getLogger(__name__)
 
+EMBED_FIELD_LIMIT = 1024
+EMBED_DESCRIPTION_LIMIT = 4096
+MAX_PARTY_SIZE = 25
+
+# Errors of formulas evaluated with the values of a character, e.g. a division by zero
+FORMULA_ERRORS = (ArithmeticError, TypeError, ValueError)
+# Characters new rulesets are tried with, stats start at 10 and can't go lower
+SAMPLE_LEVELS = (0, 1, 2, 5, 10, 20, 50, 100)
+SAMPLE_STAT_VALUES = (10, 11, 20, 50, 100)
+
 
 class CharactersCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.db: AIOEngine = self.bot.db
+        # Members that are not in the discord.py cache, fetched on demand
+        self.members = self.bot.get_cache(
+            "members",
+            lambda: LRUCache(self.bot.config.get("members", {}).get("lru_size", 256)),
+        )
+        # Guild id -> compiled Ruleset
+        self.rulesets = self.bot.get_cache("rulesets", dict)
+        # Guild id -> CharacterNameIndex
+        self.character_names = self.bot.get_cache("character_names", dict)
+        # Engine -> Partition
+        self.partitions = {}
+        # Message id -> StatRoll that luck can still improve
+        self.luck_rolls = self.bot.get_cache("luck_rolls", lambda: LRUCache(256))
+        charsheets_config = self.bot.config.get("charsheets", {})
+        # Character id -> {message id: channel id} of posted charsheets, latest last
+        self.charsheets = self.bot.get_cache(
+            "charsheets", lambda: LRUCache(charsheets_config.get("lru_size", 1024))
+        )
+        self.charsheets_per_character = charsheets_config.get("per_character", 5)
+        edit_queue_config = self.bot.config.get("edit_queue", {})
+        self.edit_queue = self.bot.get_cache(
+            "edit_queue",
+            lambda: EditQueue(
+                debounce=edit_queue_config.get("debounce", 2.0),
+                rate=edit_queue_config.get("rate", 5),
+                per=edit_queue_config.get("per", 5.0),
+            ),
+        )
+        self.bot.slash.autocomplete_handlers[("character select", "character")] = (
+            self.autocomplete_character
+        )
+        # The shared database is used by most guilds, its indexes are created right away
+        self.partition(None)
+
+    def cog_unload(self):
+        self.bot.slash.autocomplete_handlers.pop(("character select", "character"))
+
+    def partition(self, guild_id) -> Partition:
+        db = self.bot.get_db(guild_id)
+        partition = self.partitions.get(db)
+        if partition is None:
+            history_config = self.bot.config.get("history", {})
+            rolls_config = self.bot.config.get("rolls", {})
+            partition = Partition(
+                db,
+                CharacterHistory(
+                    db,
+                    snapshot_interval=history_config.get("snapshot_interval", 50),
+                    max_entries=history_config.get("max_entries", 1000),
+                ),
+                RollLog(
+                    db,
+                    session_gap=datetime.timedelta(
+                        hours=rolls_config.get("session_gap_hours", 3)
+                    ),
+                ),
+            )
+            self.partitions[db] = partition
+            task = self.bot.loop.create_task(partition.ensure_indexes())
+            task.add_done_callback(
+                functools.partial(self.indexes_created, db.database_name)
+            )
+        return partition
+
+    @staticmethod
+    def indexes_created(db_name, task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(
+                f"Creating indexes of database {db_name} failed",
+                exc_info=task.exception(),
+            )
+
+    async def get_player(self, guild_id, user_id):
+        partition = self.partition(guild_id)
+        player = await partition.get_player(guild_id, user_id)
+        if player is None and partition.db is self.bot.db:
+            player = await partition.adopt_legacy_player(guild_id, user_id)
+            if player is not None:
+                async for doc in partition.db.get_collection(Character).find(
+                    {"player": player.id}, {"name": True, "level": True}
+                ):
+                    await self.publish_character_name(
+                        doc["_id"], guild_id, user_id, doc["name"], doc["level"]
+                    )
+        return player
+
+    async def save_character(self, ctx, character, before, action):
+        """Saves the character and records the change since `before` state in the history"""
+        partition = self.partition(character.guild_id)
+        await partition.db.save(character)
+        await partition.history.record(
+            character.id, before, character_state(character), action, ctx.author.id
+        )
+        if (before["name"], before["level"]) != (character.name, character.level):
+            await self.publish_character_name(
+                character.id,
+                character.guild_id,
+                character.player.user_id,
+                character.name,
+                character.level,
+            )
+        await self.publish_character_change(character.id)
 
     # async def update_options(self):
     #     pass
 
     async def get_character(self, ctx):
-        player = await self.db.find_one(Player, Player.user_id == ctx.author.id)
+        db = self.partition(ctx.guild_id).db
+        player = await self.get_player(ctx.guild_id, ctx.author.id)
 
-        if player is None or not await self.db.count(
-            Character, Character.player == player.id
+        if player is None or not await db.count(
+            Character, Character.guild_id == ctx.guild_id, Character.player == player.id
         ):
             raise commands.BadArgument(
                 "You don't have any characters! Use `/character create` to create character"
@@ -49,21 +198,131 @@ class CharactersCog(commands.Cog):
                 "No character was selected! Use `/character select` to select character to use"
             )
 
-        character = await self.db.find_one(
-            Character, Character.id == player.current_character
+        character = await db.find_one(
+            Character,
+            Character.id == player.current_character,
+            Character.guild_id == ctx.guild_id,
         )
         if character is None:
             player.current_character = None
-            await self.db.save(player)
+            await db.save(player)
             raise commands.BadArgument("Sorry, this character does not exist anymore!")
 
+        character.use_ruleset(await self.get_ruleset(ctx.guild_id))
         return player, character
 
-    async def make_charsheet(self, ctx, player, character):
+    async def get_ruleset(self, guild_id):
+        ruleset = self.rulesets.get(guild_id)
+        if ruleset is None:
+            guild_ruleset = await self.partition(guild_id).db.find_one(
+                GuildRuleset, GuildRuleset.guild_id == guild_id
+            )
+            try:
+                ruleset = make_ruleset(guild_ruleset and guild_ruleset.formulas)
+            except FormulaError as error:
+                logger.error(f"Ruleset of guild {guild_id} is invalid: {error}")
+                ruleset = DEFAULT_RULESET
+            self.rulesets[guild_id] = ruleset
+        return ruleset
+
+    async def get_member(self, guild, user_id):
+        member = guild.get_member(user_id)
+        if member is not None:
+            return member
+
+        key = (guild.id, user_id)
+        member = self.members.get(key)
+        if member is None:
+            try:
+                member = await guild.fetch_member(user_id)
+            except discord.NotFound:
+                return None
+            self.members.put(key, member)
+        return member
+
+    async def role_member_ids(self, guild, role):
+        """Ids of the members with the role, None for @everyone
+
+        role.members only sees cached members, the member list is fetched when the
+        guild isn't fully cached (member cache disabled or not chunked at startup).
+        """
+        if role.is_default():
+            return None
+        if guild.chunked:
+            return [member.id for member in role.members]
+        try:
+            return [
+                member.id
+                async for member in guild.fetch_members(limit=None)
+                if member._roles.has(role.id)
+            ]
+        except discord.ClientException:
+            raise commands.BadArgument(
+                "Party rolls by role need the members intent when the member cache "
+                "is disabled!"
+            )
+
+    @commands.Cog.listener()
+    async def on_cache_invalidate(self, name, key):
+        if name == "members":
+            if key is None:
+                self.members.clear()
+            else:
+                self.members.pop(tuple(key))
+        elif name == "rulesets":
+            if key is None:
+                self.rulesets.clear()
+            else:
+                self.rulesets.pop(key, None)
+        elif name == "character_names":
+            if key is None:
+                self.character_names.clear()
+            elif isinstance(key, int):
+                # Characters of the guild changed in bulk, its index is loaded again
+                self.character_names.pop(key, None)
+            else:
+                character_id, guild_id, user_id, character_name, level = key
+                self.get_name_index(guild_id).add(
+                    ObjectId(character_id), user_id, character_name, level
+                )
+        elif name == "charsheets":
+            if key is None:
+                self.charsheets.clear()
+            else:
+                # Posted charsheets of the character are stale, they are kept tracked
+                self.schedule_charsheet_edits(ObjectId(key))
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before, after):
+        self.members.pop((after.guild.id, after.id))
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member):
+        self.members.pop((member.guild.id, member.id))
+
+    @staticmethod
+    def format_override(value, effective):
+        return f"{value} → {effective}" if effective != value else f"{value}"
+
+    @staticmethod
+    def check_formulas(character):
+        """Raises BadArgument if a formula of the ruleset fails for the character"""
+        for name in character.ruleset.formulas:
+            try:
+                character.get_attribute(name)
+            except FORMULA_ERRORS as error:
+                raise commands.BadArgument(
+                    f"Formula `{name}` of the server's ruleset fails for {character}: "
+                    f"{type(error).__name__}: {error}"
+                )
+
+    async def make_charsheet(self, guild, player, character):
+        self.check_formulas(character)
+        member = await self.get_member(guild, player.user_id)
         embed = discord.Embed(color=discord.Color.blue())
         embed.title = f"{character}"
         embed.description = (
-            f"Player: {ctx.guild.get_member(player.user_id).mention}\n"
+            f"Player: {member.mention if member else f'<@{player.user_id}>'}\n"
             f"ID: ||{character.id}||"
         )
 
@@ -71,7 +330,7 @@ class CharactersCog(commands.Cog):
             [
                 stat.title(),
                 character.get_stat(stat),
-                f"{character.get_stat_bonus(stat)} → {character.get_attribute(f'{stat}_bonus', True)}",
+                f"{character.get_stat_bonus(stat)} → {character.get_attribute(f'{stat.value}_bonus', True)}",
             ]
             for stat in Stat
         ]
@@ -83,6 +342,25 @@ class CharactersCog(commands.Cog):
             inline=False,
         )
 
+        extra_stats = [
+            [stat.name, self.format_override(stat.value, character.get_attribute(name))]
+            for name, stat in character.extra_stats.items()
+            if not stat.hidden
+        ]
+        if extra_stats:
+            shown = len(extra_stats)
+            while True:
+                table = make_table(extra_stats[:shown], labels=["Name", "Value"])
+                if len(table) <= EMBED_FIELD_LIMIT - 8 or shown == 1:
+                    break
+                shown -= 1
+            hidden = len(extra_stats) - shown
+            embed.add_field(
+                name="Extra stats" + (f" | {hidden} more not shown" if hidden else ""),
+                value=f"```py\n{table}\n```",
+                inline=False,
+            )
+
         width = 33
 
         bar_lines = [
@@ -118,7 +396,7 @@ class CharactersCog(commands.Cog):
             ),
             make_progress_bar(
                 width,
-                character.get_attribute("current_weight"),
+                character.get_attribute("total_weight"),
                 character.get_attribute("max_weight"),
                 label=f"Weight [{character.weight_status}]",
                 unit="kg",
@@ -137,6 +415,10 @@ class CharactersCog(commands.Cog):
         )
 
         weights = [
+            [
+                "Items",
+                f"{character.inventory_count} ({character.inventory_weight:g} kg)",
+            ],
             ["Carry", character.get_attribute("carry_weight")],
             ["Overweight", character.get_attribute("overweight_weight")],
             ["Maximum", character.get_attribute("max_weight")],
@@ -166,14 +448,15 @@ class CharactersCog(commands.Cog):
         """Displays charsheet with all stats and characteristics"""
         await ctx.defer()
         player, character = await self.get_character(ctx)
-        embed = await self.make_charsheet(ctx, player, character)
+        embed = await self.make_charsheet(ctx.guild, player, character)
         components = [
             create_actionrow(
                 create_button(ButtonStyle.blue, "Refresh", "🔄", "refresh_charsheet")
             )
         ]
 
-        await ctx.send(embed=embed, components=components)
+        message = await ctx.send(embed=embed, components=components)
+        self.track_charsheet(character.id, ctx.channel_id, message.id)
 
     @cog_ext.cog_component()
     async def refresh_charsheet(self, ctx: ComponentContext):
@@ -182,13 +465,70 @@ class CharactersCog(commands.Cog):
             0
         ]
         character_id = ObjectId(oid=id_str)
-        character = await self.db.find_one(Character, Character.id == character_id)
+        character = await self.partition(ctx.guild_id).db.find_one(
+            Character, Character.id == character_id, Character.guild_id == ctx.guild_id
+        )
         if character is None:
             await ctx.edit_origin(content="")
             raise commands.BadArgument("This character does not exist anymore!")
 
-        embed = await self.make_charsheet(ctx, character.player, character)
+        character.use_ruleset(await self.get_ruleset(ctx.guild_id))
+        embed = await self.make_charsheet(ctx.guild, character.player, character)
         await ctx.edit_origin(embed=embed)
+        # Charsheets posted before a restart are live again after a refresh
+        self.track_charsheet(character.id, ctx.channel_id, ctx.origin_message_id)
+
+    def track_charsheet(self, character_id, channel_id, message_id):
+        """Keeps the posted charsheet message up to date with the character"""
+        messages = self.charsheets.get(character_id)
+        if messages is None:
+            messages = collections.OrderedDict()
+            self.charsheets.put(character_id, messages)
+        messages[message_id] = channel_id
+        messages.move_to_end(message_id)
+        while len(messages) > self.charsheets_per_character:
+            messages.popitem(last=False)
+
+    def untrack_charsheet(self, character_id, message_id):
+        messages = self.charsheets.get(character_id)
+        if messages is not None:
+            messages.pop(message_id, None)
+            if not messages:
+                self.charsheets.pop(character_id)
+
+    async def publish_character_change(self, character_id):
+        """Refreshes posted charsheets of the character here and in the other workers"""
+        await self.bot.invalidate_cache("charsheets", str(character_id))
+
+    def schedule_charsheet_edits(self, character_id):
+        messages = self.charsheets.get(character_id)
+        for message_id, channel_id in list((messages or {}).items()):
+            self.edit_queue.schedule(
+                channel_id,
+                message_id,
+                functools.partial(
+                    self.edit_charsheet, character_id, channel_id, message_id
+                ),
+            )
+
+    async def edit_charsheet(self, character_id, channel_id, message_id):
+        """Re-renders a posted charsheet from the latest state of the character"""
+        channel = self.bot.get_channel(channel_id)
+        character = channel and await self.partition(channel.guild.id).db.find_one(
+            Character,
+            Character.id == character_id,
+            Character.guild_id == channel.guild.id,
+        )
+        if character is None:
+            self.untrack_charsheet(character_id, message_id)
+            return
+
+        character.use_ruleset(await self.get_ruleset(channel.guild.id))
+        embed = await self.make_charsheet(channel.guild, character.player, character)
+        try:
+            await channel.get_partial_message(message_id).edit(embed=embed)
+        except (discord.NotFound, discord.Forbidden):
+            self.untrack_charsheet(character_id, message_id)
 
     @cog_ext.cog_subcommand(
         base="character",
@@ -206,15 +546,19 @@ class CharactersCog(commands.Cog):
     async def new_character(self, ctx: SlashContext, name):
         """Creates a new character"""
         await ctx.defer()
-        player = await self.db.find_one(Player, Player.user_id == ctx.author.id)
+        db = self.partition(ctx.guild_id).db
+        player = await self.get_player(ctx.guild_id, ctx.author.id)
         if player is None:
-            player = Player(user_id=ctx.author.id)
+            player = Player(guild_id=ctx.guild_id, user_id=ctx.author.id)
 
-        character = Character(name=name, player=player)
-        await self.db.save(character)
+        character = Character(guild_id=ctx.guild_id, name=name, player=player)
+        await db.save(character)
+        await self.publish_character_name(
+            character.id, ctx.guild_id, player.user_id, character.name, character.level
+        )
 
         player.current_character = character.id
-        await self.db.save(player)
+        await db.save(player)
 
         embed = discord.Embed(
             title="New character created", color=discord.Color.green()
@@ -225,26 +569,45 @@ class CharactersCog(commands.Cog):
 
         await ctx.send(embed=embed)
 
-    @cog_ext.cog_subcommand(base="character", name="select", guild_ids=guild_ids)
-    async def character_selector(self, ctx: SlashContext):
-        """Sends a select menu to select your current character"""
+    @cog_ext.cog_subcommand(
+        base="character",
+        name="select",
+        options=[
+            {
+                **create_option(
+                    name="character",
+                    description="Character to play with, shows a menu if not set",
+                    option_type=str,
+                    required=False,
+                ),
+                "autocomplete": True,
+            }
+        ],
+        guild_ids=guild_ids,
+    )
+    async def character_selector(self, ctx: SlashContext, character=None):
+        """Selects your current character or sends a select menu with them"""
         await ctx.defer(hidden=True)
 
-        player = await self.db.find_one(Player, Player.user_id == ctx.author.id)
+        db = self.partition(ctx.guild_id).db
+        player = await self.get_player(ctx.guild_id, ctx.author.id)
 
-        if player is None or not await self.db.count(
-            Character, Character.player == player
+        if player is None or not await db.count(
+            Character, Character.guild_id == ctx.guild_id, Character.player == player.id
         ):
             await ctx.send(
                 "Sorry, but you don't have any characters! Create one with `/character create`"
             )
+            return
 
-        if player.is_gm:
-            available_characters = await self.db.find(Character)
-        else:
-            available_characters = await self.db.find(
-                Character, Character.player == player
-            )
+        if character is not None:
+            await self.select_character(ctx, player, character)
+            return
+
+        queries = [Character.guild_id == ctx.guild_id]
+        if not player.is_gm:
+            queries.append(Character.player == player.id)
+        available_characters = await db.find(Character, *queries, limit=25)
 
         component = create_actionrow(
             create_select(
@@ -255,7 +618,7 @@ class CharactersCog(commands.Cog):
                 options=[
                     create_select_option(
                         label=f"{character}",
-                        value=character.id,
+                        value=str(character.id),
                     )
                     for character in available_characters
                 ],
@@ -269,25 +632,60 @@ class CharactersCog(commands.Cog):
     @cog_ext.cog_component()
     async def character_selected(self, ctx: ComponentContext):
         await ctx.defer(hidden=True)
+        player = await self.get_player(ctx.guild_id, ctx.author.id)
+        if player is None:
+            raise commands.BadArgument("This character is not available!")
+        await self.select_character(ctx, player, ctx.selected_options[0])
+
+    async def select_character(self, ctx, player, value):
+        """:param value: Character id or name"""
+        try:
+            queries = [Character.id == ObjectId(value)]
+        except InvalidId:
+            queries = [Character.name == value]
+        queries.append(Character.guild_id == ctx.guild_id)
+        if not player.is_gm:
+            queries.append(Character.player == player.id)
+
+        db = self.partition(ctx.guild_id).db
+        characters = await db.find(Character, *queries, limit=2)
+        if not characters:
+            raise commands.BadArgument("This character is not available!")
+        if len(characters) > 1:
+            raise commands.BadArgument(
+                f"There are several characters named {value}, "
+                "pick one from the suggestions!"
+            )
 
-        character_id = int(ctx.selected_options[0])
-        player = await self.db.find_one(Player, Player.user_id == ctx.author.id)
+        selected_character = characters[0]
 
-        if player.is_gm:
-            selected_character = await self.db.find_one(
-                Character, Character.id == character_id
-            )
-        else:
-            selected_character = await self.db.find_one(
-                Character, Character.id == character_id, Character.player == player
-            )
+        player.current_character = selected_character.id
+        await db.save(player)
+        await ctx.send(
+            f"Successfully selected character: {selected_character}", hidden=True
+        )
 
-        if selected_character is None:
-            raise commands.BadArgument("This character is not available!")
+    def get_name_index(self, guild_id):
+        index = self.character_names.get(guild_id)
+        if index is None:
+            index = self.character_names[guild_id] = CharacterNameIndex(guild_id)
+        return index
+
+    async def autocomplete_character(self, ctx: AutocompleteContext):
+        index = self.get_name_index(ctx.guild_id)
+        await index.ensure_loaded(self.partition(ctx.guild_id).db)
+        return [
+            create_choice(name=label, value=str(character_id))
+            for character_id, label in index.search(ctx.author_id, ctx.value)
+        ]
 
-        player.selected_character = selected_character.id
-        await self.db.save(player)
-        await ctx.send(f"Successfully selected character: {selected_character}")
+    async def publish_character_name(
+        self, character_id, guild_id, user_id, name, level
+    ):
+        """Updates the name index here and in the other cluster workers"""
+        await self.bot.invalidate_cache(
+            "character_names", [str(character_id), guild_id, user_id, name, level]
+        )
 
     @cog_ext.cog_subcommand(
         base="character",
@@ -334,6 +732,7 @@ class CharactersCog(commands.Cog):
         await ctx.defer()
 
         player, character = await self.get_character(ctx)
+        before = character_state(character)
         current_value = character.get_stat(stat)
         if mode == "new":
             new_value = value
@@ -355,8 +754,13 @@ class CharactersCog(commands.Cog):
                 f"You miss {-character.free_points} stat points"
             )
 
-        diff = character.set_stat(stat, new_value)
-        await self.db.save(character)
+        try:
+            diff = character.set_stat(stat, new_value)
+        except FORMULA_ERRORS:
+            # Names the failing formula, the changed character isn't saved
+            self.check_formulas(character)
+            raise
+        await self.save_character(ctx, character, before, "pointbuy")
 
         embed = discord.Embed(
             title=f"{character} changed stats",
@@ -427,6 +831,7 @@ class CharactersCog(commands.Cog):
         rounds = None if full else (rounds or 1)
 
         player, character = await self.get_character(ctx)
+        before = character_state(character)
         regen_types = ["health", "mana"] if regen_type == "all" else [regen_type]
 
         embed = discord.Embed(color=discord.Color.green())
@@ -472,7 +877,7 @@ class CharactersCog(commands.Cog):
             if total_rounds
             else "Nothing was regenerated tho"
         )
-        await self.db.save(character)
+        await self.save_character(ctx, character, before, "regen")
         await ctx.send(embed=embed)
 
     @cog_ext.cog_subcommand(
@@ -508,59 +913,804 @@ class CharactersCog(commands.Cog):
         await ctx.defer()
         player, character = await self.get_character(ctx)
 
-        stat_value = character.get_stat(stat)
-        difficulty = min(99, max(1, stat_value + modifier))
-        roll = random.randint(1, 100)
-        success = roll <= difficulty
-        success_level = max(1, math.ceil(abs(roll - difficulty) / 10))
-        if not success:
-            success_level *= -1
+        check = Check(
+            character.id,
+            ctx.author.id,
+            f"{character}",
+            character.get_stat(stat),
+            modifier,
+        )
+        await self.partition(ctx.guild_id).rolls.record(
+            character.id,
+            ctx.guild_id,
+            Stat(stat).value,
+            check.roll,
+            check.difficulty,
+            modifier,
+            check.success_level,
+        )
 
-        color = discord.Color.green() if success else discord.Color.red()
+        roll = StatRoll(stat, modifier, [check])
+        message = await ctx.send(
+            **self.make_roll_message(roll, can_reroll=character.luck_points > 0)
+        )
+        self.luck_rolls.put(message.id, roll)
+
+    @staticmethod
+    def make_roll_message(roll: StatRoll, can_reroll=True):
+        (check,) = roll.checks.values()
+        color = discord.Color.green() if check.success else discord.Color.red()
         embed = discord.Embed(color=color)
-        embed.title = f"{character} {stat} roll"
+        embed.title = f"{check.name} {roll.stat} roll"
         embed.description = (
-            f"Modifier: **{modifier}**\n"
-            f"{stat.title()}: **{stat_value}**\n"
-            f"Success threshold: **<= {difficulty}**"
+            f"Modifier: **{roll.modifier}**\n"
+            f"{roll.stat.title()}: **{check.stat_value}**\n"
+            f"Success threshold: **<= {check.difficulty}**"
         )
         embed.add_field(
-            name=("Success!" if success else "Fail!"),
-            value=f"Roll result: **{roll}**\n" f"Success level: **{success_level}**",
+            name=("Success!" if check.success else "Fail!"),
+            value=f"Roll result: **{check.roll}**\n"
+            f"Success level: **{check.success_level}**"
+            + ("\nLuck used 🍀" if check.rerolled else ""),
         )
 
         row = create_actionrow(
             create_button(
                 ButtonStyle.blue,
                 "Use luck to improve roll",
-                disabled=(character.luck_points > 0),
+                custom_id="roll_luck",
+                disabled=not can_reroll or check.rerolled,
             )
         )
-        await ctx.send(embed=embed, components=[row])
+        return {"embed": embed, "components": [row]}
+
+    async def spend_luck(self, ctx, character_id):
+        """Takes a luck point of the character with one conditional update
+
+        :return: Whether the character had a point to spend
+        """
+        partition = self.partition(ctx.guild_id)
+        doc = await partition.db.get_collection(Character).find_one_and_update(
+            {"_id": character_id, "luck_points": {"$gt": 0}},
+            {"$inc": {"luck_points": -1}},
+            projection={"luck_points": True},
+            return_document=ReturnDocument.AFTER,
+        )
+        # Like the other $inc counters, luck points are not in the history, so an undo
+        # can't give a spent point back
+        return doc is not None
+
+    async def load_party(self, guild_id, user_ids=None):
+        """Selected characters of the players of the guild in one projected query"""
+        match = {"guild_id": guild_id, "current_character": {"$ne": None}}
+        if user_ids is not None:
+            match["user_id"] = {"$in": list(user_ids)}
+        pipeline = [
+            {"$match": match},
+            {
+                "$lookup": {
+                    "from": Character.__collection__,
+                    "localField": "current_character",
+                    "foreignField": "_id",
+                    "as": "character",
+                }
+            },
+            {"$unwind": "$character"},
+            {
+                "$project": {
+                    "_id": False,
+                    "user_id": True,
+                    "character._id": True,
+                    "character.name": True,
+                    "character.stats": True,
+                }
+            },
+            {"$limit": MAX_PARTY_SIZE},
+        ]
+        collection = self.partition(guild_id).db.get_collection(Player)
+        return await collection.aggregate(pipeline).to_list(length=MAX_PARTY_SIZE)
 
-        async def callback(button_ctx: ComponentContext):
-            if button_ctx.author != ctx.author:
-                await button_ctx.send(
-                    "Sorry, but it's not your decision to make!", hidden=True
+    @staticmethod
+    def make_party_roll_embed(party: StatRoll):
+        checks = sorted(
+            party.checks.values(), key=lambda check: check.success_level, reverse=True
+        )
+        successes = sum(check.success for check in checks)
+        rows = [
+            [
+                check.name,
+                check.stat_value,
+                check.roll,
+                f"{check.success_level:+}",
+                "🍀" if check.rerolled else "",
+            ]
+            for check in checks
+        ]
+        embed = discord.Embed(
+            color=(
+                discord.Color.green()
+                if successes * 2 >= len(checks)
+                else discord.Color.red()
+            )
+        )
+        embed.title = f"Party {party.stat} roll"
+        embed.description = (
+            f"Modifier: **{party.modifier}** | successes: **{successes}/{len(checks)}**\n"
+            f"```py\n"
+            f"{make_table(rows, labels=['Character', 'Stat', 'Roll', 'Level', 'Luck'])}\n"
+            f"```"
+        )
+        return embed
+
+    @cog_ext.cog_subcommand(
+        base="roll",
+        name="party",
+        options=[
+            create_option(
+                name="stat",
+                description="Stat to perform roll on",
+                option_type=str,
+                required=True,
+                choices=[
+                    create_choice(name="Strength", value=Stat.strength),
+                    create_choice(name="Agility", value=Stat.agility),
+                    create_choice(name="Perception", value=Stat.perception),
+                    create_choice(name="Intelligence", value=Stat.intelligence),
+                    create_choice(name="Will", value=Stat.will),
+                    create_choice(name="Build", value=Stat.build),
+                    create_choice(name="Charisma", value=Stat.charisma),
+                    create_choice(name="Luck", value=Stat.luck),
+                ],
+            ),
+            create_option(
+                name="modifier",
+                description="GM-provided roll modifier",
+                option_type=int,
+                required=False,
+            ),
+            create_option(
+                name="role",
+                description="Only players with this role roll (default: everyone)",
+                option_type=discord.Role,
+                required=False,
+            ),
+        ],
+        guild_ids=guild_ids,
+    )
+    async def roll_party(self, ctx: SlashContext, stat: str, modifier=0, role=None):
+        """Rolls the stat for the selected characters of all players (GM only)"""
+        await ctx.defer()
+        player = await self.get_player(ctx.guild_id, ctx.author.id)
+        if player is None or not player.is_gm:
+            raise commands.CheckFailure("Only game masters can roll for the party!")
+
+        user_ids = None
+        if role is not None:
+            user_ids = await self.role_member_ids(ctx.guild, role)
+            if user_ids == []:
+                raise commands.BadArgument(f"Nobody has the role {role.name}!")
+        members = await self.load_party(ctx.guild_id, user_ids)
+        if not members:
+            raise commands.BadArgument("Nobody in the party has a selected character!")
+
+        party = StatRoll(
+            stat,
+            modifier,
+            [
+                Check(
+                    doc["character"]["_id"],
+                    doc["user_id"],
+                    doc["character"]["name"],
+                    doc["character"]["stats"][stat],
+                    modifier,
+                )
+                for doc in members
+            ],
+        )
+        rolls = self.partition(ctx.guild_id).rolls
+        await asyncio.gather(
+            *(
+                rolls.record(
+                    check.character_id,
+                    ctx.guild_id,
+                    Stat(stat).value,
+                    check.roll,
+                    check.difficulty,
+                    modifier,
+                    check.success_level,
                 )
-                return False
+                for check in party.checks.values()
+            )
+        )
 
-            _, btn_character = await self.get_character(ctx)
-            if btn_character.luck_points <= 0:
-                pass
+        row = create_actionrow(
+            create_button(
+                ButtonStyle.blue, "Use luck to reroll", "🍀", custom_id="party_luck"
+            )
+        )
+        message = await ctx.send(
+            embed=self.make_party_roll_embed(party), components=[row]
+        )
+        self.luck_rolls.put(message.id, party)
+
+    async def use_luck(self, ctx: ComponentContext, make_message):
+        """Rerolls the check of the clicking player, the message updates in place
+
+        :param make_message: Function of the StatRoll returning message fields
+        """
+        roll = self.luck_rolls.get(ctx.origin_message_id)
+        if roll is None:
+            await ctx.send("This roll is too old to use luck on it", hidden=True)
+            return
+        check = roll.checks.get(ctx.author_id)
+        if check is None:
+            await ctx.send("Sorry, but it's not your decision to make!", hidden=True)
+            return
+        if check.rerolled:
+            await ctx.send("You have already used luck on this roll!", hidden=True)
+            return
+
+        # Marked before the first await, so mashing the button spends a single point
+        check.rerolled = True
+        await ctx.defer(edit_origin=True)
+        if not await self.spend_luck(ctx, check.character_id):
+            check.rerolled = False
+            await ctx.send("You don't have any luck points left!", hidden=True)
+            return
+
+        reroll, success_level = check.reroll(roll.modifier)
+        await self.partition(ctx.guild_id).rolls.record(
+            check.character_id,
+            ctx.guild_id,
+            Stat(roll.stat).value,
+            reroll,
+            check.difficulty,
+            roll.modifier,
+            success_level,
+            luck=True,
+        )
+        await ctx.edit_origin(**make_message(roll))
 
-            await button_ctx.defer(edit_origin=True)
+    @cog_ext.cog_component()
+    async def roll_luck(self, ctx: ComponentContext):
+        await self.use_luck(ctx, self.make_roll_message)
 
-            pass
+    @cog_ext.cog_component()
+    async def party_luck(self, ctx: ComponentContext):
+        await self.use_luck(
+            ctx, lambda party: {"embed": self.make_party_roll_embed(party)}
+        )
 
-        async def button_processor():
-            while True:
-                button_ctx = await wait_for_component(self.bot)
-                do_exit = await callback(button_ctx)
-                if do_exit:
-                    return
+    @cog_ext.cog_subcommand(
+        base="character",
+        subcommand_group="extra",
+        name="set",
+        options=[
+            create_option(
+                name="name",
+                description="Name of the extra stat",
+                option_type=str,
+                required=True,
+            ),
+            create_option(
+                name="value",
+                description="Value of the extra stat",
+                option_type=int,
+                required=True,
+            ),
+            create_option(
+                name="hidden",
+                description="Whether to hide the stat from the charsheet (default: no)",
+                option_type=bool,
+                required=False,
+            ),
+        ],
+        guild_ids=guild_ids,
+    )
+    async def extra_stat_set(self, ctx: SlashContext, name, value, hidden=False):
+        """Adds or changes a custom stat of the character"""
+        await ctx.defer()
+        player, character = await self.get_character(ctx)
+
+        if not name.isidentifier():
+            # Names are document keys and are used in formulas, so `.` or `$` can't be
+            raise commands.BadArgument(
+                f"`{name}` can't be used as an extra stat name, "
+                f"use only letters, digits and `_`, not starting with a digit"
+            )
+        if len(name) > 25 or character.is_reserved_name(name):
+            raise commands.BadArgument(
+                f"`{name}` can't be used as an extra stat name, "
+                f"it's too long or already used by the game"
+            )
+
+        before = character_state(character)
+        old_stat = character.extra_stats.get(name)
+        character.set_extra_stat(name, value, hidden)
+        await self.save_character(ctx, character, before, "extra set")
+
+        old_value = f"**{old_stat.value}** → " if old_stat else ""
+        await ctx.send(f"{character} {name}: {old_value}**{value}**", hidden=hidden)
 
-        await asyncio.wait_for(button_processor(), timeout=10*60)
+    @cog_ext.cog_subcommand(
+        base="character",
+        subcommand_group="extra",
+        name="remove",
+        options=[
+            create_option(
+                name="name",
+                description="Name of the extra stat",
+                option_type=str,
+                required=True,
+            ),
+        ],
+        guild_ids=guild_ids,
+    )
+    async def extra_stat_remove(self, ctx: SlashContext, name):
+        """Removes a custom stat of the character"""
+        await ctx.defer()
+        player, character = await self.get_character(ctx)
+        if name not in character.extra_stats:
+            raise commands.BadArgument(f"{character} doesn't have `{name}` stat!")
+
+        before = character_state(character)
+        character.remove_extra_stat(name)
+        await self.save_character(ctx, character, before, "extra remove")
+        await ctx.send(f"Removed `{name}` stat of {character}")
+
+    @staticmethod
+    def format_change(path, old, new, width=40):
+        def value(v):
+            if v is MISSING:
+                return "∅"
+            if isinstance(v, dict) and "value" in v:  # Extra stats
+                return f"{v['value']}"
+            if isinstance(v, list):
+                return f"[{len(v)}]"
+            return f"{v}"
+
+        text = f"{path}: {value(old)} → {value(new)}"
+        return text if len(text) <= width else f"{text[:width - 1]}…"
+
+    @cog_ext.cog_subcommand(
+        base="character",
+        name="history",
+        options=[
+            create_option(
+                name="limit",
+                description="Amount of latest changes to show (default: 10)",
+                option_type=int,
+                required=False,
+            ),
+        ],
+        guild_ids=guild_ids,
+    )
+    async def character_history(self, ctx: SlashContext, limit=10):
+        """Displays the latest changes of the character"""
+        await ctx.defer(hidden=True)
+        player, character = await self.get_character(ctx)
+        entries = await self.partition(ctx.guild_id).history.entries(
+            character.id, min(max(limit, 1), 25)
+        )
+        if not entries:
+            raise commands.BadArgument(f"{character} has no history yet!")
+
+        now = datetime.datetime.utcnow()
+        lines = []
+        for entry in entries:
+            minutes = int((now - entry.time).total_seconds() // 60)
+            age = f"{minutes // 60}h" if minutes >= 60 else f"{minutes}m"
+            lines.append(f"#{entry.seq} {entry.action} ({age} ago)")
+            lines.extend(
+                f"  {self.format_change(*change)}"
+                for change in changes(entry.before, entry.after)
+            )
+
+        embed = discord.Embed(color=discord.Color.blue())
+        embed.title = f"{character} history"
+        embed.description = "```py\n" + "\n".join(lines)[:4000] + "\n```"
+        embed.set_footer(text="Use `/character undo` to revert changes")
+        await ctx.send(embed=embed, hidden=True)
+
+    @cog_ext.cog_subcommand(
+        base="character",
+        name="undo",
+        options=[
+            create_option(
+                name="changes",
+                description="Amount of latest changes to revert (default: 1)",
+                option_type=int,
+                required=False,
+            ),
+        ],
+        connector={"changes": "count"},
+        guild_ids=guild_ids,
+    )
+    async def character_undo(self, ctx: SlashContext, count=1):
+        """Reverts the character to the state before the latest changes"""
+        if count < 1:
+            raise commands.BadArgument("Amount of changes must be positive!")
+        await ctx.defer()
+        player, character = await self.get_character(ctx)
+        partition = self.partition(ctx.guild_id)
+
+        try:
+            target = await partition.history.undo_target(character, count)
+            state = await partition.history.state_at(character, target)
+        except HistoryError as error:
+            raise commands.BadArgument(str(error))
+
+        current = character_state(character)
+        # States saved before a field was excluded from the history may still have it
+        state = {
+            key: value for key, value in state.items() if key not in EXCLUDED_FIELDS
+        }
+        update = {
+            "$set": {
+                key: value
+                for key, value in state.items()
+                if current.get(key, MISSING) != value
+            },
+            "$unset": {key: "" for key in current.keys() - state.keys()},
+        }
+        update = {operator: fields for operator, fields in update.items() if fields}
+        if not update:
+            await ctx.send(f"{character} is already in that state")
+            return
+
+        await partition.db.get_collection(Character).update_one(
+            {"_id": character.id}, update
+        )
+        await partition.history.record(
+            character.id,
+            current,
+            state,
+            f"undo {count}",
+            ctx.author.id,
+            reverts_to=target,
+        )
+        await self.publish_character_name(
+            character.id,
+            character.guild_id,
+            character.player.user_id,
+            state["name"],
+            state["level"],
+        )
+        await self.publish_character_change(character.id)
+        await ctx.send(
+            f"Reverted {character} to the state before {count} latest change(s)"
+        )
+
+    async def change_inventory_totals(self, character, weight, count):
+        """Moves the running inventory totals of the character by the given deltas"""
+        collection = self.partition(character.guild_id).db.get_collection(Character)
+        await collection.update_one(
+            {"_id": character.id},
+            {"$inc": {"inventory_weight": weight, "inventory_count": count}},
+        )
+        await self.publish_character_change(character.id)
+
+    @cog_ext.cog_subcommand(
+        base="inventory",
+        name="add",
+        options=[
+            create_option(
+                name="name",
+                description="Name of the item",
+                option_type=str,
+                required=True,
+            ),
+            create_option(
+                name="weight",
+                description="Weight of a single item in kg",
+                option_type=float,
+                required=True,
+            ),
+            create_option(
+                name="quantity",
+                description="Amount of items to add (default: 1)",
+                option_type=int,
+                required=False,
+            ),
+        ],
+        guild_ids=guild_ids,
+    )
+    async def inventory_add(self, ctx: SlashContext, name, weight, quantity=1):
+        """Adds items to the inventory of the character"""
+        if weight < 0 or quantity < 1:
+            raise commands.BadArgument(
+                "Weight can't be negative and quantity must be positive!"
+            )
+        # The upsert below skips the model validation
+        if len(name) > MAX_ITEM_NAME_LENGTH:
+            raise commands.BadArgument(
+                f"Item name can't be longer than {MAX_ITEM_NAME_LENGTH} characters!"
+            )
+        await ctx.defer()
+        player, character = await self.get_character(ctx)
+
+        collection = self.partition(ctx.guild_id).db.get_collection(InventoryItem)
+        before = await collection.find_one_and_update(
+            {"character": character.id, "name": name},
+            {"$inc": {"quantity": quantity}, "$set": {"weight": weight}},
+            upsert=True,
+        )
+        old_quantity = before["quantity"] if before else 0
+        old_weight = before["weight"] if before else 0
+        # The whole stack is re-weighted in case the weight of the item was changed
+        weight_delta = (old_quantity + quantity) * weight - old_quantity * old_weight
+        await self.change_inventory_totals(character, weight_delta, quantity)
+
+        await ctx.send(
+            f"Added **{quantity}** × {name} ({weight:g} kg each) to {character}'s inventory"
+        )
+
+    @cog_ext.cog_subcommand(
+        base="inventory",
+        name="remove",
+        options=[
+            create_option(
+                name="name",
+                description="Name of the item",
+                option_type=str,
+                required=True,
+            ),
+            create_option(
+                name="quantity",
+                description="Amount of items to remove (default: 1)",
+                option_type=int,
+                required=False,
+            ),
+        ],
+        guild_ids=guild_ids,
+    )
+    async def inventory_remove(self, ctx: SlashContext, name, quantity=1):
+        """Removes items from the inventory of the character"""
+        if quantity < 1:
+            raise commands.BadArgument("Quantity must be positive!")
+        await ctx.defer()
+        player, character = await self.get_character(ctx)
+
+        collection = self.partition(ctx.guild_id).db.get_collection(InventoryItem)
+        item = await collection.find_one_and_update(
+            {"character": character.id, "name": name, "quantity": {"$gte": quantity}},
+            {"$inc": {"quantity": -quantity}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if item is None:
+            raise commands.BadArgument(
+                f"{character} doesn't have {quantity} × {name} in the inventory!"
+            )
+        if item["quantity"] == 0:
+            await collection.delete_one({"_id": item["_id"], "quantity": 0})
+        await self.change_inventory_totals(
+            character, -quantity * item["weight"], -quantity
+        )
+
+        await ctx.send(f"Removed **{quantity}** × {name} from {character}'s inventory")
+
+    @cog_ext.cog_subcommand(base="inventory", name="list", guild_ids=guild_ids)
+    async def inventory_list(self, ctx: SlashContext):
+        """Displays the heaviest items in the inventory of the character"""
+        await ctx.defer()
+        player, character = await self.get_character(ctx)
+
+        limit = 20
+        items = await self.partition(ctx.guild_id).db.find(
+            InventoryItem,
+            InventoryItem.character == character.id,
+            sort=query.desc(InventoryItem.weight),
+            limit=limit,
+        )
+
+        embed = discord.Embed(color=discord.Color.blue())
+        embed.title = f"{character} inventory"
+        embed.description = (
+            f"Items: **{character.inventory_count}**\n"
+            f"Weight: **{character.inventory_weight:g}** kg "
+            f"[{character.weight_status}]"
+        )
+        if items:
+            rows = [
+                [item.name, item.quantity, f"{item.weight * item.quantity:g}"]
+                for item in items
+            ]
+            embed.add_field(
+                name=f"Heaviest {limit} items" if len(items) == limit else "Items",
+                value=f"```py\n"
+                f"{make_table(rows, labels=['Name', 'Qty', 'kg'])}\n"
+                f"```",
+                inline=False,
+            )
+
+        await ctx.send(embed=embed)
+
+    @staticmethod
+    def format_ruleset(ruleset):
+        lines = [
+            f"{'*' if DEFAULT_FORMULAS.get(name) != source else ' '} {name} = {source}"
+            for name, source in ruleset.source.items()
+        ]
+        return "```py\n" + "\n".join(lines) + "\n```"
+
+    async def change_ruleset(self, ctx, update):
+        """Applies update(formulas) to the custom formulas of the guild and validates them"""
+        if not ctx.author.guild_permissions.manage_guild:
+            raise commands.CheckFailure(
+                "You need Manage Server permission to change the ruleset!"
+            )
+
+        guild_ruleset = await self.partition(ctx.guild_id).db.find_one(
+            GuildRuleset, GuildRuleset.guild_id == ctx.guild_id
+        )
+        if guild_ruleset is None:
+            guild_ruleset = GuildRuleset(guild_id=ctx.guild_id)
+
+        formulas = dict(guild_ruleset.formulas)
+        update(formulas)
+        # Rulesets saved before the limit can still be reduced
+        if len(formulas) > max(MAX_CUSTOM_FORMULAS, len(guild_ruleset.formulas)):
+            raise commands.BadArgument(
+                f"A server can change or add at most {MAX_CUSTOM_FORMULAS} formulas"
+            )
+        try:
+            ruleset = make_ruleset(formulas)
+        except FormulaError as error:
+            raise commands.BadArgument(str(error))
+        if len(self.format_ruleset(ruleset)) > EMBED_DESCRIPTION_LIMIT:
+            raise commands.BadArgument("The formulas are too long to be displayed")
+
+        # Compiling only checks the syntax and the names, errors like a division by
+        # zero show up when a formula is evaluated. Characters the samples miss are
+        # reported when their charsheet is shown.
+        player = Player(user_id=0)
+        for level in SAMPLE_LEVELS:
+            for value in SAMPLE_STAT_VALUES:
+                sample = Character(
+                    name="Sample",
+                    player=player,
+                    level=level,
+                    stats={stat: value for stat in Stat},
+                )
+                sample.use_ruleset(ruleset)
+                for name in ruleset.formulas:
+                    try:
+                        ruleset.evaluate(name, sample)
+                    except Exception as error:
+                        raise commands.BadArgument(
+                            f"Formula `{name}` fails for a level {level} character "
+                            f"with stats of {value}: {type(error).__name__}: {error}"
+                        )
+
+        guild_ruleset.formulas = formulas
+        await self.partition(ctx.guild_id).db.save(guild_ruleset)
+        await self.bot.invalidate_cache("rulesets", ctx.guild_id)
+
+    @cog_ext.cog_subcommand(base="ruleset", name="show", guild_ids=guild_ids)
+    async def ruleset_show(self, ctx: SlashContext):
+        """Displays formulas of the derived characteristics used in this server"""
+        await ctx.defer(hidden=True)
+        ruleset = await self.get_ruleset(ctx.guild_id)
+
+        embed = discord.Embed(color=discord.Color.blue())
+        embed.title = "Ruleset"
+        embed.description = self.format_ruleset(ruleset)
+        embed.set_footer(text="* - changed in this server")
+        await ctx.send(embed=embed, hidden=True)
+
+    @cog_ext.cog_subcommand(
+        base="ruleset",
+        name="set",
+        options=[
+            create_option(
+                name="name",
+                description="Name of the characteristic, e.g. max_hp",
+                option_type=str,
+                required=True,
+            ),
+            create_option(
+                name="formula",
+                description="Formula using stats, character fields and other formulas",
+                option_type=str,
+                required=True,
+            ),
+        ],
+        guild_ids=guild_ids,
+    )
+    async def ruleset_set(self, ctx: SlashContext, name, formula):
+        """Changes or adds a derived characteristic formula in this server"""
+        await ctx.defer(hidden=True)
+        await self.change_ruleset(
+            ctx, lambda formulas: formulas.update({name: formula})
+        )
+        await ctx.send(f"Formula changed: `{name} = {formula}`", hidden=True)
+
+    @cog_ext.cog_subcommand(
+        base="ruleset",
+        name="reset",
+        options=[
+            create_option(
+                name="name",
+                description="Formula to reset to default (default: all of them)",
+                option_type=str,
+                required=False,
+            ),
+        ],
+        guild_ids=guild_ids,
+    )
+    async def ruleset_reset(self, ctx: SlashContext, name=None):
+        """Resets formulas of this server to the default ones"""
+        await ctx.defer(hidden=True)
+        if name is None:
+            await self.change_ruleset(ctx, lambda formulas: formulas.clear())
+            await ctx.send("All formulas were reset", hidden=True)
+        else:
+            await self.change_ruleset(ctx, lambda formulas: formulas.pop(name, None))
+            await ctx.send(f"Formula `{name}` was reset", hidden=True)
+
+    @cog_ext.cog_subcommand(
+        base="roll",
+        name="stats",
+        options=[
+            create_option(
+                name="period",
+                description="Rolls to take into account (default: all time)",
+                option_type=str,
+                required=False,
+                choices=[
+                    create_choice(name="All time", value="all"),
+                    create_choice(name="Current session", value="session"),
+                    create_choice(name="Today", value="today"),
+                ],
+            ),
+        ],
+        guild_ids=guild_ids,
+    )
+    async def roll_stats(self, ctx: SlashContext, period="all"):
+        """Displays roll statistics of the character"""
+        await ctx.defer()
+        player, character = await self.get_character(ctx)
+        rolls = self.partition(ctx.guild_id).rolls
+
+        if period == "session":
+            session_start = await rolls.current_session(character.id)
+            bucket = session_start and session_bucket(session_start)
+        elif period == "today":
+            bucket = day_bucket(datetime.datetime.utcnow())
+        else:
+            bucket = ALL_TIME
+        rollups = await rolls.rollups(character.id, bucket) if bucket else []
+        if not rollups:
+            raise commands.BadArgument(f"{character} has no rolls for this period!")
+
+        rows = [
+            [
+                "All" if rollup.stat == ALL_STATS else rollup.stat.title(),
+                rollup.count,
+                f"{rollup.success_rate:.0%}",
+                f"{rollup.mean_level:+.1f}",
+                f"{rollup.worst_level:+}…{rollup.best_level:+}",
+                f"{rollup.streak:+}",
+                f"{rollup.longest_success_streak}/{rollup.longest_fail_streak}",
+            ]
+            for rollup in rollups
+        ]
+        embed = discord.Embed(color=discord.Color.blue())
+        embed.title = f"{character} roll statistics"
+        embed.description = (
+            f"```py\n"
+            f"{make_table(rows, labels=['Stat', 'Rolls', 'Win', 'SL', 'Range', 'Now', 'Best'])}\n"
+            f"```"
+        )
+        footer = (
+            "SL - mean success level, Now - current streak, "
+            "Best - longest success/fail streaks"
+        )
+        # The "*" rollup is the first one
+        if rollups[0].luck_rerolls:
+            footer += f"\nRerolls with luck among the rolls: {rollups[0].luck_rerolls}"
+        embed.set_footer(text=footer)
+        await ctx.send(embed=embed)
 
     @cog_ext.cog_subcommand(
         base="character",
@@ -0,0 +1,404 @@
+"""Streaming export and import of players, characters and their data
+
+Backups are files of records {"collection", "guild_id", "doc"} in the order players,
+characters followed by their inventory items, guild rulesets. They are written as JSON
+lines (MongoDB extended JSON) or concatenated BSON documents, gzip-compressed if the
+path ends with .gz. Documents are read and written in batches, so memory use doesn't
+depend on the size of the collections. Importing replaces documents with the same ids,
+invalid documents and failed writes are skipped and reported.
+
+Guilds with dedicated databases (see src.mg_partitions) are given as `partitions`, a dict
+of guild id -> engine, their documents are read from and written to those databases.
+
+Usage: python -m src.mg_backup export campaign.jsonl.gz --guild 123
+       python -m src.mg_backup import campaign.jsonl.gz --dry-run
+"""
+
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import gzip
+import itertools
+import logging
+import multiprocessing
+
+import bson
+from bson import ObjectId, json_util
+from odmantic import AIOEngine
+from pymongo import ReplaceOne
+from pymongo.errors import BulkWriteError
+
+from src.mg_character_models import Character, InventoryItem, Player
+from src.mg_rulesets import GuildRuleset
+
+logger = logging.getLogger(__name__)
+
+MODELS = {
+    model.__collection__: model
+    for model in (Player, Character, InventoryItem, GuildRuleset)
+}
+
+# Referenced documents are validated on their own, stubs stand in for them
+REFERENCE_STUBS = {Player: {"user_id": 0}}
+
+MAX_ERRORS = 20
+
+ALL_GUILDS = object()
+
+
+class BackupError(ValueError):
+    pass
+
+
+def _open(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+def _format(path):
+    name = path[: -len(".gz")] if path.endswith(".gz") else path
+    if name.endswith(".jsonl"):
+        return "jsonl"
+    if name.endswith(".bson"):
+        return "bson"
+    raise BackupError(f"Unknown backup format of {path}, use .jsonl(.gz) or .bson(.gz)")
+
+
+def _encode(records, file_format):
+    if file_format == "bson":
+        return b"".join(bson.encode(record) for record in records)
+    options = json_util.RELAXED_JSON_OPTIONS
+    return b"".join(
+        f"{json_util.dumps(record, json_options=options)}\n".encode()
+        for record in records
+    )
+
+
+def _read_records(file, file_format):
+    if file_format == "bson":
+        return bson.decode_file_iter(file)
+    return (json_util.loads(line) for line in file if line.strip())
+
+
+def _sources(engine, guild_id, partitions):
+    """:return: List of (engine, query) with the documents of the guild or all guilds"""
+    if guild_id is not ALL_GUILDS:
+        return [(partitions.get(guild_id, engine), {"guild_id": guild_id})]
+    shared_query = {"guild_id": {"$nin": list(partitions)}} if partitions else {}
+    return [(engine, shared_query)] + [
+        (partition, {"guild_id": partition_guild_id})
+        for partition_guild_id, partition in partitions.items()
+    ]
+
+
+def _record(collection, doc, guild_id):
+    return {"collection": collection, "guild_id": guild_id, "doc": doc}
+
+
+async def _batches(cursor, batch_size):
+    batch = []
+    async for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def _export_batches(engine: AIOEngine, query, batch_size):
+    """Yields lists of records, the inventory items after the batch of their characters"""
+    for model in (Player, Character, GuildRuleset):
+        cursor = engine.get_collection(model).find(query, batch_size=batch_size)
+        async for docs in _batches(cursor, batch_size):
+            yield [
+                _record(model.__collection__, doc, doc.get("guild_id")) for doc in docs
+            ]
+            if model is not Character:
+                continue
+
+            guilds = {doc["_id"]: doc.get("guild_id") for doc in docs}
+            items = engine.get_collection(InventoryItem).find(
+                {"character": {"$in": list(guilds)}}, batch_size=batch_size
+            )
+            async for item_docs in _batches(items, batch_size):
+                yield [
+                    _record(InventoryItem.__collection__, doc, guilds[doc["character"]])
+                    for doc in item_docs
+                ]
+
+
+async def export_backup(
+    engine: AIOEngine, path, guild_id=ALL_GUILDS, batch_size=500, partitions=None
+):
+    """Writes the documents of the guild (or all of them) to the file
+
+    :return: Counter of exported documents by collection
+    """
+    file_format = _format(path)
+    loop = asyncio.get_running_loop()
+    counts = collections.Counter()
+    file = await loop.run_in_executor(None, _open, path, "wb")
+    try:
+        for source, query in _sources(engine, guild_id, partitions or {}):
+            async for batch in _export_batches(source, query, batch_size):
+                counts.update(record["collection"] for record in batch)
+                # Encoding, compression and disk writes don't block the event loop
+                await loop.run_in_executor(
+                    None, lambda: file.write(_encode(batch, file_format))
+                )
+    finally:
+        await loop.run_in_executor(None, file.close)
+    logger.info(f"Exported {sum(counts.values())} documents to {path}")
+    return counts
+
+
+def _read_batches(path, batch_size):
+    """Blocking iterator over lists of records of the file"""
+    file_format = _format(path)
+    with _open(path, "rb") as file:
+        records = _read_records(file, file_format)
+        while True:
+            batch = list(itertools.islice(records, batch_size))
+            if not batch:
+                return
+            yield batch
+
+
+def _validate(record):
+    """:return: Error message of the record, None if it's valid"""
+    model = MODELS[record["collection"]]
+    doc = record.get("doc")
+    if not isinstance(doc, dict):
+        return "Malformed record"
+    if not isinstance(doc.get("_id"), ObjectId):
+        return "_id is not an id"
+
+    doc = dict(doc)
+    for name in model.__references__:
+        field = model.__odm_fields__[name]
+        if not isinstance(doc.get(field.key_name), ObjectId):
+            return f"{name} is not an id"
+        doc[field.key_name] = {
+            "_id": doc[field.key_name],
+            **REFERENCE_STUBS[field.model],
+        }
+    try:
+        model.parse_doc(doc)
+    except Exception as error:
+        return str(error)
+    return None
+
+
+def validate_batch(records):
+    """Parses the documents with their odmantic models, runs in worker processes
+
+    :return: List of (position in the batch, collection, document id, error message)
+    """
+    errors = []
+    for position, record in enumerate(records):
+        message = _validate(record)
+        if message is not None:
+            doc = record.get("doc")
+            doc_id = doc.get("_id") if isinstance(doc, dict) else None
+            errors.append((position, record["collection"], doc_id, message))
+    return errors
+
+
+class ImportResult:
+    def __init__(self, dry_run):
+        self.dry_run = dry_run
+        self.counts = collections.Counter()
+        self.skipped = 0
+        self.error_count = 0
+        self.errors = []  # First MAX_ERRORS (collection, document id, message)
+
+    def add_errors(self, errors):
+        self.error_count += len(errors)
+        self.errors.extend(errors[: MAX_ERRORS - len(self.errors)])
+
+    def add_batch(self, counts, errors):
+        self.counts.update(counts)
+        self.add_errors(errors)
+
+
+async def _write_batch(engine, records, partitions):
+    """:return: List of (collection, document id, error message) of failed writes"""
+    by_collection = collections.defaultdict(list)
+    for record in records:
+        target = partitions.get(record.get("guild_id"), engine)
+        by_collection[target, record["collection"]].append(record["doc"])
+    errors = []
+    for (target, collection), docs in by_collection.items():
+        requests = [ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in docs]
+        try:
+            await target.get_collection(MODELS[collection]).bulk_write(
+                requests, ordered=False
+            )
+        except BulkWriteError as error:
+            # Unordered writes go on after a failure, only the failed ones are missing
+            errors.extend(
+                (collection, docs[write_error["index"]]["_id"], write_error["errmsg"])
+                for write_error in error.details.get("writeErrors", [])
+            )
+    return errors
+
+
+async def _import_batch(engine, records, dry_run, pool, partitions):
+    """Validates the records and writes the valid ones unless it's a dry run
+
+    :return: Counter of valid (dry run) or written documents by collection, list of
+        (collection, document id, error message)
+    """
+    loop = asyncio.get_running_loop()
+    invalid = await loop.run_in_executor(pool, validate_batch, records)
+    errors = [error[1:] for error in invalid]
+    skip = {error[0] for error in invalid}
+    records = [
+        record for position, record in enumerate(records) if position not in skip
+    ]
+    if not dry_run and records:
+        write_errors = await _write_batch(engine, records, partitions)
+        errors.extend(write_errors)
+        failed = {(collection, doc_id) for collection, doc_id, _ in write_errors}
+        records = [
+            record
+            for record in records
+            if (record["collection"], record["doc"]["_id"]) not in failed
+        ]
+    return collections.Counter(record["collection"] for record in records), errors
+
+
+async def import_backup(
+    engine: AIOEngine,
+    path,
+    guild_id=ALL_GUILDS,
+    batch_size=500,
+    dry_run=False,
+    workers=None,
+    partitions=None,
+):
+    """Writes the documents of the guild (or all of them) from the file to the database
+
+    The documents are validated in a process pool of `workers` processes, invalid
+    documents and failed writes are reported in the result and skipped. In dry run
+    nothing is written.
+    """
+    loop = asyncio.get_running_loop()
+    result = ImportResult(dry_run)
+    batches = _read_batches(path, batch_size)
+    pending = collections.deque()
+    workers = workers or multiprocessing.cpu_count()
+    pool = concurrent.futures.ProcessPoolExecutor(
+        workers, mp_context=multiprocessing.get_context("spawn")
+    )
+
+    try:
+        while True:
+            batch = await loop.run_in_executor(None, next, batches, None)
+            if batch is None:
+                break
+            records = []
+            for record in batch:
+                if guild_id is not ALL_GUILDS and record.get("guild_id") != guild_id:
+                    result.skipped += 1
+                elif record.get("collection") not in MODELS:
+                    result.add_errors(
+                        [(record.get("collection"), None, "Unknown collection")]
+                    )
+                else:
+                    records.append(record)
+            if not records:
+                continue
+
+            # Dry runs validate few batches in parallel, so memory use stays bounded.
+            # Writes are in the order of the file.
+            if len(pending) >= (workers * 2 if dry_run else 1):
+                result.add_batch(*await pending.popleft())
+            pending.append(
+                asyncio.ensure_future(
+                    _import_batch(engine, records, dry_run, pool, partitions or {})
+                )
+            )
+        for task in pending:
+            result.add_batch(*await task)
+    finally:
+        for task in pending:
+            task.cancel()
+        batches.close()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    logger.info(
+        f"{'Validated' if dry_run else 'Imported'} {sum(result.counts.values())} "
+        f"documents from {path}, {result.error_count} error(s)"
+    )
+    return result
+
+
+def parse_partition(value):
+    guild_id, _, database = value.partition("=")
+    if not guild_id.isdigit() or not database:
+        raise argparse.ArgumentTypeError("Partition must be <guild id>=<database>")
+    return int(guild_id), database
+
+
+async def main(args):
+    engine = AIOEngine(database=args.database)
+    partitions = {
+        guild_id: AIOEngine(engine.client, database=database)
+        for guild_id, database in args.partition or []
+    }
+    guild_id = ALL_GUILDS if args.guild is None else args.guild
+    if args.command == "export":
+        counts = await export_backup(
+            engine, args.path, guild_id, args.batch_size, partitions
+        )
+        for collection, count in sorted(counts.items()):
+            print(f"{collection}: {count}")
+        return
+
+    result = await import_backup(
+        engine,
+        args.path,
+        guild_id,
+        args.batch_size,
+        args.dry_run,
+        args.workers,
+        partitions,
+    )
+    for collection, count in sorted(result.counts.items()):
+        print(f"{collection}: {count}")
+    print(f"Skipped (other guilds): {result.skipped}")
+    print(f"Errors: {result.error_count}")
+    for collection, doc_id, message in result.errors:
+        print(f"{collection} {doc_id}: {message}")
+    if result.error_count:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("path", help="Backup file: .jsonl, .bson, optionally .gz")
+    parser.add_argument("--guild", type=int, help="Only the data of this guild")
+    parser.add_argument(
+        "--database", default="test", help="MongoDB database of the bot"
+    )
+    parser.add_argument(
+        "--partition",
+        type=parse_partition,
+        action="append",
+        help="<guild id>=<database> of a guild with a dedicated database, repeatable",
+    )
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Validate the documents of the import without writing them",
+    )
+    parser.add_argument("--workers", type=int, help="Processes of the validation")
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,79 @@
+import asyncio
+import logging
+
+from src.mg_character_models import Character, Player
+from src.utils.autocomplete import MAX_CHOICES, PrefixIndex
+
+logger = logging.getLogger(__name__)
+
+
+class CharacterNameIndex:
+    """In-memory character name search of a guild for autocomplete, loaded once
+
+    Players search their own characters, game masters search all of them.
+    """
+
+    def __init__(self, guild_id):
+        self.guild_id = guild_id
+        self.all = PrefixIndex()
+        self.players = {}  # User id -> PrefixIndex
+        self.owners = {}  # Character id -> user id
+        self.levels = {}  # Character id -> level
+        self.gms = set()
+        self._loading = None
+
+    async def ensure_loaded(self, engine):
+        if self._loading is None:
+            self._loading = asyncio.ensure_future(self._load(engine))
+        try:
+            await asyncio.shield(self._loading)
+        except Exception:
+            self._loading = None
+            raise
+
+    async def _load(self, engine):
+        users = {}
+        async for doc in engine.get_collection(Player).find(
+            {"guild_id": self.guild_id}, {"user_id": True, "is_gm": True}
+        ):
+            users[doc["_id"]] = doc["user_id"]
+            if doc.get("is_gm"):
+                self.gms.add(doc["user_id"])
+
+        async for doc in engine.get_collection(Character).find(
+            {"guild_id": self.guild_id}, {"name": True, "level": True, "player": True}
+        ):
+            if doc.get("player") in users:
+                self.add(doc["_id"], users[doc["player"]], doc["name"], doc["level"])
+        logger.info(
+            f"Character name index of guild {self.guild_id} loaded: "
+            f"{len(self.all)} characters"
+        )
+
+    def add(self, character_id, user_id, name, level):
+        """Adds or updates a character"""
+        old_user_id = self.owners.get(character_id)
+        if old_user_id is not None and old_user_id != user_id:
+            self.players[old_user_id].remove(character_id)
+
+        self.owners[character_id] = user_id
+        self.levels[character_id] = level
+        self.all.add(character_id, name)
+        self.players.setdefault(user_id, PrefixIndex()).add(character_id, name)
+
+    def remove(self, character_id):
+        user_id = self.owners.pop(character_id, None)
+        self.levels.pop(character_id, None)
+        self.all.remove(character_id)
+        if user_id is not None:
+            self.players[user_id].remove(character_id)
+
+    def search(self, user_id, prefix, limit=MAX_CHOICES):
+        """:return: List of (character id, label) available to the user"""
+        index = self.all if user_id in self.gms else self.players.get(user_id)
+        if index is None:
+            return []
+        return [
+            (character_id, f"{name} (lvl {self.levels[character_id]})")
+            for character_id, name in index.search(prefix, limit)
+        ]
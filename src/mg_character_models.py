@@ -1,7 +1,6 @@
 import collections
 import enum
 import functools
-import inspect
 import math
 import operator
 from typing import Dict, List, Optional, Union
@@ -9,6 +8,8 @@ from typing import Dict, List, Optional, Union
 from bson import ObjectId
 from odmantic import EmbeddedModel, Field, Model, Reference
 
+from src.mg_rulesets import DEFAULT_FORMULAS, NO_BLOCK, Ruleset
+
 
 class Stat(str, enum.Enum):
     strength = "strength"
@@ -50,10 +51,12 @@ class OverrideMode(str, enum.Enum):
 
     @property
     def func(self):
-        return self.func
+        return self._func
 
 
 class Player(Model):
+    # A player per guild, None in the ones saved before guilds were partitioned
+    guild_id: Optional[int]
     user_id: int
     current_character: Optional[ObjectId]
 
@@ -63,7 +66,7 @@ class Player(Model):
 class ExtraStat(EmbeddedModel):
     name: str
     value: Union[int, float]
-    hidden: bool
+    hidden: bool = False
 
 
 class StatOverride(EmbeddedModel):
@@ -81,6 +84,7 @@ class Effect(EmbeddedModel):
 
 
 class Character(Model):
+    guild_id: Optional[int]
     player: Player = Reference()
     name: str = Field(max_length=25)
     level: int = Field(default=1, ge=0)
@@ -91,15 +95,49 @@ class Character(Model):
     current_weight: int = 0
     action_points: int = 0
 
+    # Running totals of the InventoryItem documents of the character, kept with $inc
+    inventory_weight: float = 0
+    inventory_count: int = 0
+
     luck_points: int = 0
 
     effects: List[Effect] = []
-    extra_stats: List[ExtraStat] = []
+    # Name -> extra stat
+    extra_stats: Dict[str, ExtraStat] = {}
 
     free_points: int = Field(default=15, ge=0)
 
+    # Number of the last change in the history, kept with $inc
+    history_seq: int = 0
+
     stats: Dict[str, int] = {stat: 10 for stat in Stat}
 
+    # Ruleset used for the derived characteristics and the values it precomputed from
+    # the stats and the level, they are not stored in the database
+    __slots__ = ("__ruleset__", "__block__")
+
+    def __init__(self, **data):
+        # odmantic models can't use super(), their metaclass rejects the __class__ cell
+        Model.__init__(self, **data)
+        object.__setattr__(self, "__ruleset__", DEFAULT_RULESET)
+        object.__setattr__(self, "__block__", NO_BLOCK)
+
+    def __setattr__(self, name, value):
+        Model.__setattr__(self, name, value)
+        if name in BLOCK_FIELDS:
+            object.__setattr__(self, "__block__", NO_BLOCK)
+
+    @classmethod
+    def parse_doc(cls, raw_doc):
+        extra_stats = raw_doc.get("extra_stats")
+        if isinstance(extra_stats, list):
+            # Documents saved when extra stats were stored as a list
+            raw_doc = {
+                **raw_doc,
+                "extra_stats": {stat["name"]: stat for stat in extra_stats},
+            }
+        return Model.parse_doc.__func__(cls, raw_doc)
+
     def __str__(self):
         return f"{self.name} (lvl {self.level})"
 
@@ -113,9 +151,27 @@ class Character(Model):
 
         return overrides
 
+    @property
+    def ruleset(self):
+        try:
+            return self.__ruleset__
+        except AttributeError:  # Copies made without __init__
+            return DEFAULT_RULESET
+
+    def use_ruleset(self, ruleset):
+        object.__setattr__(self, "__ruleset__", ruleset)
+
     def get_attribute(self, name, use_overrides=True):
-        value = self.__getattribute__(name)
-        if use_overrides:
+        """Value of a ruleset formula, an extra stat or a field with overrides applied"""
+        formula = self.ruleset.formulas.get(name)
+        if formula is not None:
+            value = formula(self)
+        elif name in self.extra_stats:
+            value = self.extra_stats[name].value
+        else:
+            value = self.__getattribute__(name)
+
+        if use_overrides and self.effects:
             overrides = self.all_overrides()[name]
             for override in overrides:
                 value = override.mode.func(value, override.value)
@@ -126,12 +182,7 @@ class Character(Model):
         return self.stats[stat]
 
     def get_properties(self):
-        properties = {
-            name: self.get_attribute(name)
-            for (name, value) in inspect.getmembers(
-                Character, lambda v: isinstance(v, property)
-            )
-        }
+        properties = {name: self.get_attribute(name) for name in self.ruleset.formulas}
         return properties
 
     @staticmethod
@@ -144,16 +195,41 @@ class Character(Model):
         return diff
 
     def set_stat(self, stat, value):
+        """Changes the stat, the only way to change one in place"""
         before = self.get_properties()
 
         self.stats[stat] = value
+        object.__setattr__(self, "__block__", NO_BLOCK)
 
         after = self.get_properties()
         diff = self.get_properties_diff(before, after)
         return diff
 
+    def is_reserved_name(self, name):
+        """Whether the game reads the name: a stat, a field, a formula or a property
+
+        Extra stats are looked up before attributes, so one with such a name would
+        replace the value of the game.
+        """
+        return (
+            name in Stat.__members__
+            or name in Character.__fields__
+            or name in FORMULA_FIELDS
+            or name in self.ruleset
+            or hasattr(Character, name)
+        )
+
+    def get_extra_stat(self, name):
+        return self.extra_stats[name].value
+
+    def set_extra_stat(self, name, value, hidden=False):
+        self.extra_stats[name] = ExtraStat(name=name, value=value, hidden=hidden)
+
+    def remove_extra_stat(self, name):
+        return self.extra_stats.pop(name)
+
     def get_stat_bonus(self, stat: Stat):
-        return self.get_stat(stat) // 10
+        return self.ruleset.formulas[f"{Stat(stat).value}_bonus"](self)
 
     def _regen(self, current_attr, max_attr, rate_attr, rounds=None):  # TODO I was working on that
         current = self.__getattribute__(current_attr)
@@ -193,125 +269,80 @@ class Character(Model):
         self.current_mp = min(self.get_attribute("max_mp"), self.current_mp + regen)
 
     @property
-    def strength_bonus(self):
-        return self.get_stat_bonus(Stat.strength)
-
-    @property
-    def agility_bonus(self):
-        return self.get_stat_bonus(Stat.agility)
-
-    @property
-    def perception_bonus(self):
-        return self.get_stat_bonus(Stat.perception)
-
-    @property
-    def intelligence_bonus(self):
-        return self.get_stat_bonus(Stat.intelligence)
-
-    @property
-    def will_bonus(self):
-        return self.get_stat_bonus(Stat.will)
-
-    @property
-    def build_bonus(self):
-        return self.get_stat_bonus(Stat.build)
-
-    @property
-    def charisma_bonus(self):
-        return self.get_stat_bonus(Stat.charisma)
-
-    @property
-    def luck_bonus(self):
-        return self.get_stat_bonus(Stat.luck)
-
-    @property
-    def hp_regen_rate(self):
-        # if self.level < 5:
-        #     return 0
-        regen = self.build_bonus * (self.level // 5)
-        return math.ceil(regen)
-
-    @property
-    def mp_regen_rate(self):
-        regen = (
-            (self.intelligence_bonus + self.perception_bonus)
-            / 2
-            * (self.build_bonus / 2)
-            * (self.level // 5 + 1)
-        )
-        return math.ceil(regen)
-
-    @property
-    def max_hp(self):
-        return (
-            self.get_stat(Stat.build) * (self.level // 5 + 1)
-            + self.build_bonus * self.level
-        )
-
-    @property
-    def max_mp(self):
-        return (
-            (self.get_stat(Stat.perception) + self.get_stat(Stat.intelligence))
-            // 2
-            * self.build_bonus
-            * (self.level // 5 + 1)
-        )
-
-    @property
-    def max_stress(self):
-        return 20 * self.get_stat(Stat.will) * (
-            self.level // 5 + 1
-        ) + 20 * self.get_stat(Stat.will) * (self.level // 10)
-
-    @property
-    def max_action_points(self):
-        return self.get_stat(Stat.will) * (self.level // 2 + 1)
-
-    # Weight calculation
-
-    @property
-    def carry_weight(self):
-        return self.get_stat(Stat.strength)
-
-    @property
-    def overweight_weight(self):
-        return 2 * self.get_stat(Stat.strength)
-
-    @property
-    def max_weight(self):
-        return 3 * self.get_stat(Stat.strength)
+    def total_weight(self):
+        return self.current_weight + self.inventory_weight
 
     @property
     def weight_status(self):
-        if self.current_weight >= self.overweight_weight:
-            return WeightStatus.overweight
-        elif self.current_weight >= self.max_weight:
+        if self.total_weight >= self.max_weight:
             return WeightStatus.over_limit
+        elif self.total_weight >= self.overweight_weight:
+            return WeightStatus.overweight
         else:
             return WeightStatus.normal
 
-    # Speed calculation
 
-    @property
-    def walk_speed(self):
-        speed = self.get_stat(Stat.agility)
-        if self.current_weight >= self.overweight_weight:
-            speed //= 2
-        return speed
+def _derived_property(name):
+    def get(self):
+        return self.ruleset.formulas[name](self)
+
+    get.__name__ = name
+    return property(get, doc=f"`{name}` formula of the ruleset")
+
+
+# Derived characteristics are available as properties, e.g. `character.max_hp`
+for _name in DEFAULT_FORMULAS:
+    setattr(Character, _name, _derived_property(_name))
+
+FORMULA_FIELDS = (
+    "level",
+    "current_hp",
+    "current_mp",
+    "current_stress",
+    "current_weight",
+    "action_points",
+    "inventory_weight",
+    "inventory_count",
+    "luck_points",
+    "free_points",
+    "total_weight",
+)
+
+# Fields that are precomputed with the stats
+BLOCK_FIELDS = ("stats", "level")
+
+
+def make_ruleset(formulas=None):
+    """Compiles the default formulas replaced or extended with the given ones
+
+    :raises FormulaError: if any formula is invalid
+    """
+    if not formulas:
+        return DEFAULT_RULESET
+    return Ruleset(
+        {**DEFAULT_FORMULAS, **formulas},
+        stats=[stat.value for stat in Stat],
+        fields=FORMULA_FIELDS,
+        block_fields=["level"],
+    )
 
-    @property
-    def run_speed(self):
-        return self.walk_speed * 2
 
-    @property
-    def run_speed(self):
-        return self.walk_speed * 2
+DEFAULT_RULESET = Ruleset(
+    DEFAULT_FORMULAS,
+    stats=[stat.value for stat in Stat],
+    fields=FORMULA_FIELDS,
+    block_fields=["level"],
+)
 
-    @property
-    def dash_speed(self):
-        if self.current_weight >= self.overweight_weight:
-            return 0
-        return self.get_stat(Stat.agility) * 3
+
+MAX_ITEM_NAME_LENGTH = 50
+
+
+class InventoryItem(Model):
+    character: ObjectId
+    name: str = Field(max_length=MAX_ITEM_NAME_LENGTH)
+    weight: float = Field(ge=0)
+    quantity: int = Field(default=1, ge=0)
 
 
 class Battle(Model):
@@ -0,0 +1,272 @@
+"""Append-only history of character changes
+
+Every change is stored as a delta: two partial documents with the old and the new values
+of the changed fields only. Every `snapshot_interval` changes the whole state is stored
+too, so a past state is rebuilt from the nearest snapshot (or the current state) and at
+most a few deltas. Only the last `max_entries` changes of a character are kept.
+
+An undo is a change too, its entry keeps the number of the change it reverted to in
+`reverts_to`. Going back in the history follows these links, so the changes an undo
+reverted are skipped and undoing again never brings them back.
+"""
+
+import copy
+import datetime
+import logging
+from typing import Any, Dict, Optional
+
+import bson
+from bson import ObjectId
+from odmantic import AIOEngine, Field, Model, query
+from pymongo import ReturnDocument
+
+from src.mg_character_models import Character
+
+logger = logging.getLogger(__name__)
+
+# Fields that are not part of the history: identity and $inc-maintained counters
+EXCLUDED_FIELDS = frozenset(
+    {
+        "_id",
+        "guild_id",
+        "player",
+        "inventory_weight",
+        "inventory_count",
+        "history_seq",
+        "luck_points",
+    }
+)
+
+MISSING = object()
+
+
+class HistoryError(LookupError):
+    pass
+
+
+class HistoryEntry(Model):
+    character: ObjectId
+    seq: int = Field(ge=1)
+    time: datetime.datetime
+    action: str
+    author_id: Optional[int]
+    # Number of the change whose state an undo restored
+    reverts_to: Optional[int]
+
+    # Partial character documents with only the changed values
+    before: Dict[str, Any] = {}
+    after: Dict[str, Any] = {}
+
+
+class CharacterSnapshot(Model):
+    """Whole history state of the character right after the change `seq`"""
+
+    character: ObjectId
+    seq: int = Field(ge=0)
+    state: Dict[str, Any]
+
+
+def document_state(doc):
+    """History-tracked fields of a character document as plain BSON types"""
+    doc = {key: value for key, value in doc.items() if key not in EXCLUDED_FIELDS}
+    # The round-trip also makes it a deep copy with enum keys turned into strings
+    return bson.decode(bson.encode(doc))
+
+
+def character_state(character):
+    return document_state(character.doc())
+
+
+def diff_states(before, after):
+    """:return: Partial before and after documents containing only changed values"""
+    old, new = {}, {}
+    for key in before.keys() | after.keys():
+        if key in before and key in after:
+            a, b = before[key], after[key]
+            if isinstance(a, dict) and isinstance(b, dict):
+                sub_old, sub_new = diff_states(a, b)
+                if sub_old or sub_new:
+                    old[key], new[key] = sub_old, sub_new
+            elif a != b:
+                old[key], new[key] = a, b
+        elif key in before:
+            old[key] = before[key]
+        else:
+            new[key] = after[key]
+    return old, new
+
+
+def patch(state, source, target):
+    """Changes values of the state that are in `source` delta to the `target` ones
+
+    patch(state, entry.before, entry.after) redoes an entry, swapped ones undo it.
+    """
+    for key in source.keys() | target.keys():
+        old, new = source.get(key, MISSING), target.get(key, MISSING)
+        if isinstance(old, dict) and isinstance(new, dict):
+            patch(state.setdefault(key, {}), old, new)
+        elif new is MISSING:
+            state.pop(key, None)
+        else:
+            state[key] = copy.deepcopy(new)
+    return state
+
+
+def changes(before, after, prefix=""):
+    """Yields (path, old, new) of the delta, MISSING marks absent values"""
+    for key in sorted(before.keys() | after.keys()):
+        old, new = before.get(key, MISSING), after.get(key, MISSING)
+        path = f"{prefix}{key}"
+        if isinstance(old, dict) and isinstance(new, dict):
+            yield from changes(old, new, f"{path}.")
+        else:
+            yield path, old, new
+
+
+class CharacterHistory:
+    def __init__(self, engine: AIOEngine, snapshot_interval=50, max_entries=1000):
+        self.db = engine
+        self.snapshot_interval = snapshot_interval
+        self.max_entries = max_entries
+
+    async def ensure_indexes(self):
+        for model in (HistoryEntry, CharacterSnapshot):
+            await self.db.get_collection(model).create_index(
+                [("character", 1), ("seq", 1)], unique=True
+            )
+
+    async def record(
+        self, character_id, before, after, action, author_id=None, reverts_to=None
+    ):
+        """Appends the change between two character states, if there is any
+
+        :param reverts_to: Number of the change an undo reverted the character to
+        :return: New HistoryEntry or None
+        """
+        old, new = diff_states(before, after)
+        if not old and not new:
+            return None
+
+        doc = await self.db.get_collection(Character).find_one_and_update(
+            {"_id": character_id},
+            {"$inc": {"history_seq": 1}},
+            return_document=ReturnDocument.AFTER,
+        )
+        seq = doc["history_seq"]
+        entry = HistoryEntry(
+            character=character_id,
+            seq=seq,
+            time=datetime.datetime.utcnow(),
+            action=action,
+            author_id=author_id,
+            reverts_to=reverts_to,
+            before=old,
+            after=new,
+        )
+        await self.db.save(entry)
+
+        if seq % self.snapshot_interval == 0:
+            # The stored document, `after` is what the caller meant to save, other
+            # fields may have changed in the database since it was read
+            await self.db.save(
+                CharacterSnapshot(
+                    character=character_id, seq=seq, state=document_state(doc)
+                )
+            )
+            await self.prune(character_id, seq)
+        return entry
+
+    async def prune(self, character_id, seq):
+        cutoff = seq - self.max_entries
+        if cutoff <= 0:
+            return
+        await self.db.get_collection(HistoryEntry).delete_many(
+            {"character": character_id, "seq": {"$lte": cutoff}}
+        )
+        await self.db.get_collection(CharacterSnapshot).delete_many(
+            {"character": character_id, "seq": {"$lt": cutoff}}
+        )
+
+    async def entries(self, character_id, limit=10):
+        """Latest entries, newest first"""
+        return await self.db.find(
+            HistoryEntry,
+            HistoryEntry.character == character_id,
+            sort=query.desc(HistoryEntry.seq),
+            limit=limit,
+        )
+
+    async def undo_target(self, character, count):
+        """:return: Number of the change to revert the character to, to undo `count`
+        latest changes that were not undone yet
+        """
+        undos = await self.db.find(
+            HistoryEntry,
+            HistoryEntry.character == character.id,
+            HistoryEntry.reverts_to != None,  # noqa: E711
+            HistoryEntry.seq <= character.history_seq,
+        )
+        reverts_to = {entry.seq: entry.reverts_to for entry in undos}
+        seq = character.history_seq
+        for _ in range(count):
+            # The state after an undo is the state it reverted to
+            while seq in reverts_to:
+                seq = reverts_to[seq]
+            if seq <= 0:
+                raise HistoryError("There are no more changes to undo")
+            seq -= 1
+        return seq
+
+    async def _entries_between(self, character_id, start, end, descending):
+        """Entries with start < seq <= end, checking none of them were pruned"""
+        entries = await self.db.find(
+            HistoryEntry,
+            HistoryEntry.character == character_id,
+            HistoryEntry.seq > start,
+            HistoryEntry.seq <= end,
+            sort=(query.desc if descending else query.asc)(HistoryEntry.seq),
+        )
+        if len(entries) != end - start:
+            raise HistoryError(f"History before change #{end} is not available")
+        return entries
+
+    async def state_at(self, character, seq):
+        """Rebuilds the history state of the character right after the change `seq`"""
+        current_seq = character.history_seq
+        if seq >= current_seq:
+            return character_state(character)
+        if seq < 0:
+            raise HistoryError("There is no history before the first change")
+
+        earlier = await self.db.find_one(
+            CharacterSnapshot,
+            CharacterSnapshot.character == character.id,
+            CharacterSnapshot.seq <= seq,
+            sort=query.desc(CharacterSnapshot.seq),
+        )
+        later = await self.db.find_one(
+            CharacterSnapshot,
+            CharacterSnapshot.character == character.id,
+            CharacterSnapshot.seq > seq,
+            CharacterSnapshot.seq <= current_seq,
+            sort=query.asc(CharacterSnapshot.seq),
+        )
+        if later is not None:
+            later_seq, later_state = later.seq, later.state
+        else:
+            later_seq, later_state = current_seq, character_state(character)
+
+        # Going either way, whichever needs fewer deltas
+        if earlier is not None and seq - earlier.seq <= later_seq - seq:
+            state = earlier.state
+            for entry in await self._entries_between(
+                character.id, earlier.seq, seq, descending=False
+            ):
+                patch(state, entry.before, entry.after)
+        else:
+            state = later_state
+            for entry in await self._entries_between(
+                character.id, seq, later_seq, descending=True
+            ):
+                patch(state, entry.after, entry.before)
+        return state
@@ -0,0 +1,67 @@
+"""Guild partitions of the game data
+
+Players, characters and everything that belongs to them are scoped to a guild: every
+query filters by the guild id and is backed by an index that starts with it. Guilds
+share the bot database unless the config gives a large guild a database of its own:
+
+    "partitions": {"<guild id>": {"database": "rpbot_<guild id>"}}
+"""
+
+import logging
+
+from odmantic import AIOEngine
+from pymongo import ReturnDocument
+
+from src.mg_character_models import Character, InventoryItem, Player
+from src.mg_history import CharacterHistory
+from src.mg_rolls import RollLog
+from src.mg_rulesets import GuildRuleset
+
+logger = logging.getLogger(__name__)
+
+
+class Partition:
+    """Database of one or more guilds and the stores built on it"""
+
+    def __init__(self, engine: AIOEngine, history: CharacterHistory, rolls: RollLog):
+        self.db = engine
+        self.history = history
+        self.rolls = rolls
+
+    async def ensure_indexes(self):
+        await self.db.get_collection(Player).create_index(
+            [("guild_id", 1), ("user_id", 1)], unique=True
+        )
+        characters = self.db.get_collection(Character)
+        await characters.create_index([("guild_id", 1), ("player", 1)])
+        await characters.create_index([("guild_id", 1), ("name", 1)])
+        await self.db.get_collection(GuildRuleset).create_index("guild_id", unique=True)
+        await self.db.get_collection(InventoryItem).create_index(
+            [("character", 1), ("name", 1)], unique=True
+        )
+        await self.history.ensure_indexes()
+        await self.rolls.ensure_indexes()
+
+    async def get_player(self, guild_id, user_id):
+        return await self.db.find_one(
+            Player, Player.guild_id == guild_id, Player.user_id == user_id
+        )
+
+    async def adopt_legacy_player(self, guild_id, user_id):
+        """Moves the player saved before partitioning with characters to the guild
+
+        :return: Adopted Player or None if the user has no such data
+        """
+        doc = await self.db.get_collection(Player).find_one_and_update(
+            {"user_id": user_id, "guild_id": None},
+            {"$set": {"guild_id": guild_id}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if doc is None:
+            return None
+
+        await self.db.get_collection(Character).update_many(
+            {"player": doc["_id"], "guild_id": None}, {"$set": {"guild_id": guild_id}}
+        )
+        logger.info(f"Characters of user {user_id} were moved to guild {guild_id}")
+        return Player.parse_doc(doc)
@@ -0,0 +1,288 @@
+"""Stat checks and the roll log with rollups maintained on every roll
+
+Every roll is stored as a small RollRecord. RollRollup documents keep the statistics of
+a character per stat (and "*" for all stats) in a bucket: all time, a day or a session.
+They are updated with pipeline updates when a roll is logged, so the streaks and the
+session are computed atomically in the database and reading statistics never scans the
+log. A session is a series of rolls of a character without long breaks. Rerolls with
+luck are logged as rolls too.
+"""
+
+import asyncio
+import datetime
+import logging
+import math
+import random
+from typing import Optional
+
+from bson import ObjectId
+from odmantic import AIOEngine, Field, Model, query
+from pymongo import ReturnDocument, UpdateOne
+
+logger = logging.getLogger(__name__)
+
+ALL_STATS = "*"
+ALL_TIME = "all"
+
+
+def make_check(stat_value, modifier, roll=None):
+    """Rolls d100 against the stat
+
+    :return: (roll, difficulty, success level), the level is negative for fails
+    """
+    difficulty = min(99, max(1, stat_value + modifier))
+    if roll is None:
+        roll = random.randint(1, 100)
+    success_level = max(1, math.ceil(abs(roll - difficulty) / 10))
+    return roll, difficulty, success_level if roll <= difficulty else -success_level
+
+
+class Check:
+    """Result of a check of a character, kept in memory while luck can improve it"""
+
+    __slots__ = (
+        "character_id",
+        "user_id",
+        "name",
+        "stat_value",
+        "difficulty",
+        "roll",
+        "success_level",
+        "rerolled",
+    )
+
+    def __init__(self, character_id, user_id, name, stat_value, modifier):
+        self.character_id = character_id
+        self.user_id = user_id
+        self.name = name
+        self.stat_value = stat_value
+        self.roll, self.difficulty, self.success_level = make_check(
+            stat_value, modifier
+        )
+        self.rerolled = False
+
+    @property
+    def success(self):
+        return self.success_level > 0
+
+    def reroll(self, modifier):
+        """Rolls again and keeps the better result
+
+        :return: (roll, success level) of the reroll
+        """
+        self.rerolled = True
+        roll, _, success_level = make_check(self.stat_value, modifier)
+        if success_level > self.success_level:
+            self.roll, self.success_level = roll, success_level
+        return roll, success_level
+
+
+class StatRoll:
+    """Checks of one or more characters for one stat, `checks` by user id"""
+
+    def __init__(self, stat, modifier, checks):
+        self.stat = stat
+        self.modifier = modifier
+        self.checks = {check.user_id: check for check in checks}
+
+
+class RollRecord(Model):
+    character: ObjectId = Field(key_name="c")
+    guild_id: Optional[int] = Field(key_name="g")
+    stat: str = Field(key_name="s")
+    roll: int = Field(key_name="r")
+    difficulty: int = Field(key_name="d")
+    modifier: int = Field(key_name="m")
+    success_level: int = Field(key_name="l")
+    time: datetime.datetime = Field(key_name="t")
+    luck: bool = Field(default=False, key_name="k")
+
+
+class RollRollup(Model):
+    character: ObjectId
+    stat: str
+    bucket: str
+
+    count: int = 0
+    successes: int = 0
+    level_sum: int = 0
+    roll_sum: int = 0
+    luck_rerolls: int = 0
+    best_level: Optional[int]
+    worst_level: Optional[int]
+
+    success_streak: int = 0
+    fail_streak: int = 0
+    longest_success_streak: int = 0
+    longest_fail_streak: int = 0
+
+    last_roll_at: Optional[datetime.datetime]
+    # Only in the all time rollup of all stats
+    session_start: Optional[datetime.datetime]
+
+    @property
+    def success_rate(self):
+        return self.successes / self.count if self.count else 0
+
+    @property
+    def mean_level(self):
+        return self.level_sum / self.count if self.count else 0
+
+    @property
+    def streak(self):
+        """Current streak, negative for fails"""
+        return self.success_streak or -self.fail_streak
+
+
+def _field(name, default=0):
+    return {"$ifNull": [f"${name}", default]}
+
+
+def _rollup_update(record, extra=None):
+    """Pipeline update that adds the roll to a rollup
+
+    All expressions of a $set stage read the document before the stage, so the longest
+    streak is computed from the same streak the update increments.
+    """
+    success = record.success_level > 0
+    streak_name, other_name = "success_streak", "fail_streak"
+    if not success:
+        streak_name, other_name = other_name, streak_name
+    streak = {"$add": [_field(streak_name), 1]}
+    longest_name = f"longest_{streak_name}"
+    return [
+        {
+            "$set": {
+                "count": {"$add": [_field("count"), 1]},
+                "successes": {"$add": [_field("successes"), int(success)]},
+                "level_sum": {"$add": [_field("level_sum"), record.success_level]},
+                "roll_sum": {"$add": [_field("roll_sum"), record.roll]},
+                "luck_rerolls": {"$add": [_field("luck_rerolls"), int(record.luck)]},
+                streak_name: streak,
+                other_name: {"$literal": 0},
+                longest_name: {"$max": [_field(longest_name), streak]},
+                # Missing fields are null, which $max and $min ignore
+                "best_level": {"$max": ["$best_level", record.success_level]},
+                "worst_level": {"$min": ["$worst_level", record.success_level]},
+                "last_roll_at": {"$max": ["$last_roll_at", record.time]},
+                **(extra or {}),
+            }
+        }
+    ]
+
+
+def day_bucket(time):
+    return f"day:{time.date().isoformat()}"
+
+
+def session_bucket(session_start):
+    return f"session:{session_start.isoformat(timespec='seconds')}"
+
+
+class RollLog:
+    def __init__(self, engine: AIOEngine, session_gap=datetime.timedelta(hours=3)):
+        self.db = engine
+        self.session_gap = session_gap
+
+    async def ensure_indexes(self):
+        await self.db.get_collection(RollRecord).create_index([("c", 1), ("t", 1)])
+        await self.db.get_collection(RollRollup).create_index(
+            [("character", 1), ("bucket", 1), ("stat", 1)], unique=True
+        )
+
+    async def _update_overall(self, record):
+        """Adds the roll to the all time rollup of all stats, which tracks the session
+
+        :return: Start of the session of the roll
+        """
+        gap = self.session_gap.total_seconds() * 1000  # Dates subtract to milliseconds
+        new_session = {
+            "$or": [
+                {"$eq": [_field("session_start", None), None]},
+                {"$gt": [{"$subtract": [record.time, "$last_roll_at"]}, gap]},
+            ]
+        }
+        session_start = {
+            "$cond": [
+                new_session,
+                record.time.replace(microsecond=0),
+                "$session_start",
+            ]
+        }
+        overall = await self.db.get_collection(RollRollup).find_one_and_update(
+            {"character": record.character, "stat": ALL_STATS, "bucket": ALL_TIME},
+            _rollup_update(record, {"session_start": session_start}),
+            projection={"session_start": True},
+            return_document=ReturnDocument.AFTER,
+            upsert=True,
+        )
+        return overall["session_start"]
+
+    async def record(
+        self,
+        character_id,
+        guild_id,
+        stat,
+        roll,
+        difficulty,
+        modifier,
+        success_level,
+        luck=False,
+    ):
+        """Logs a roll and updates all rollups of the character it belongs to
+
+        :param luck: Whether it's a reroll with luck
+        """
+        record = RollRecord(
+            character=character_id,
+            guild_id=guild_id,
+            stat=stat,
+            roll=roll,
+            difficulty=difficulty,
+            modifier=modifier,
+            success_level=success_level,
+            time=datetime.datetime.utcnow(),
+            luck=luck,
+        )
+        # The session bucket is known once the overall rollup is updated
+        _, session_start = await asyncio.gather(
+            self.db.save(record), self._update_overall(record)
+        )
+
+        update = _rollup_update(record)
+        keys = [(stat, ALL_TIME)]
+        keys.extend(
+            (stat_name, bucket)
+            for stat_name in (stat, ALL_STATS)
+            for bucket in (day_bucket(record.time), session_bucket(session_start))
+        )
+        await self.db.get_collection(RollRollup).bulk_write(
+            [
+                UpdateOne(
+                    {"character": character_id, "stat": stat_name, "bucket": bucket},
+                    update,
+                    upsert=True,
+                )
+                for stat_name, bucket in keys
+            ],
+            ordered=False,
+        )
+        return record
+
+    async def current_session(self, character_id):
+        overall = await self.db.find_one(
+            RollRollup,
+            RollRollup.character == character_id,
+            RollRollup.stat == ALL_STATS,
+            RollRollup.bucket == ALL_TIME,
+        )
+        return overall and overall.session_start
+
+    async def rollups(self, character_id, bucket):
+        """Rollups of all stats in the bucket, the "*" one first"""
+        return await self.db.find(
+            RollRollup,
+            RollRollup.character == character_id,
+            RollRollup.bucket == bucket,
+            sort=query.asc(RollRollup.stat),
+        )
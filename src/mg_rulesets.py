@@ -0,0 +1,438 @@
+"""Rulesets: derived characteristics of characters defined as formulas
+
+Formulas are arithmetic expressions over character stats, fields and other formulas,
+e.g. `build * (level // 5 + 1) + build_bonus * level`. They are compiled once per
+ruleset into flat functions with the referenced formulas inlined, so evaluating one is a
+single Python function call.
+
+Subexpressions that only read stats and block fields (the level), like the stat bonuses
+and `level // 5 + 1`, are evaluated together into a block: a list kept by the character
+in its `__block__` attribute. Formulas read them from it, the character resets it to
+NO_BLOCK when its stats or level change and the next read computes it again.
+"""
+
+import ast
+import collections
+import math
+from typing import Dict
+
+from odmantic import Model
+
+MAX_FORMULA_LENGTH = 200
+MAX_FORMULA_NODES = 2000
+# Formulas a guild can change or add, `ruleset show` lists them in an embed
+MAX_CUSTOM_FORMULAS = 20
+
+FUNCTIONS = {
+    "ceil": math.ceil,
+    "floor": math.floor,
+    "min": min,
+    "max": max,
+    "abs": abs,
+    "round": round,
+}
+
+_ALLOWED_NODES = (
+    ast.Expression,
+    ast.BinOp,
+    ast.UnaryOp,
+    ast.BoolOp,
+    ast.Compare,
+    ast.IfExp,
+    ast.Call,
+    ast.Name,
+    ast.Load,
+    ast.Constant,
+    ast.Add,
+    ast.Sub,
+    ast.Mult,
+    ast.Div,
+    ast.FloorDiv,
+    ast.Mod,
+    ast.UAdd,
+    ast.USub,
+    ast.Not,
+    ast.And,
+    ast.Or,
+    ast.Eq,
+    ast.NotEq,
+    ast.Lt,
+    ast.LtE,
+    ast.Gt,
+    ast.GtE,
+)
+
+DEFAULT_FORMULAS = {
+    "strength_bonus": "strength // 10",
+    "agility_bonus": "agility // 10",
+    "perception_bonus": "perception // 10",
+    "intelligence_bonus": "intelligence // 10",
+    "will_bonus": "will // 10",
+    "build_bonus": "build // 10",
+    "charisma_bonus": "charisma // 10",
+    "luck_bonus": "luck // 10",
+    "hp_regen_rate": "build_bonus * (level // 5)",
+    "mp_regen_rate": "ceil((intelligence_bonus + perception_bonus) / 2"
+    " * (build_bonus / 2) * (level // 5 + 1))",
+    "max_hp": "build * (level // 5 + 1) + build_bonus * level",
+    "max_mp": "(perception + intelligence) // 2 * build_bonus * (level // 5 + 1)",
+    "max_stress": "20 * will * (level // 5 + 1) + 20 * will * (level // 10)",
+    "max_action_points": "will * (level // 2 + 1)",
+    "carry_weight": "strength",
+    "overweight_weight": "2 * strength",
+    "max_weight": "3 * strength",
+    "walk_speed": "agility // 2 if total_weight >= overweight_weight else agility",
+    "run_speed": "walk_speed * 2",
+    "dash_speed": "0 if total_weight >= overweight_weight else agility * 3",
+}
+
+
+# Block of no ruleset, the first item of a block is the ruleset that computed it
+NO_BLOCK = (None,)
+
+_FORMULA_TEMPLATE = """
+def formula(c):
+    try:
+        b = c.__block__
+    except AttributeError:  # Copies made without __init__
+        b = NO_BLOCK
+    if b[0] is not RULESET:
+        b = RULESET.refresh(c)
+        if b is None:
+            return SLOW(c)
+    return BODY
+"""
+
+
+class FormulaError(ValueError):
+    pass
+
+
+class GuildRuleset(Model):
+    """Formulas of a guild that replace or extend the default ones"""
+
+    guild_id: int
+    formulas: Dict[str, str] = {}
+
+
+def parse_formula(name, source):
+    if not name.isidentifier() or name in FUNCTIONS:
+        raise FormulaError(f"`{name}` can't be used as a formula name")
+    if len(source) > MAX_FORMULA_LENGTH:
+        raise FormulaError(
+            f"Formula `{name}` is longer than {MAX_FORMULA_LENGTH} characters"
+        )
+    try:
+        tree = ast.parse(source, mode="eval")
+    except SyntaxError as error:
+        raise FormulaError(f"Formula `{name}` is not valid: {error.msg}")
+
+    for node in ast.walk(tree):
+        if not isinstance(node, _ALLOWED_NODES):
+            raise FormulaError(
+                f"Formula `{name}` uses unsupported syntax: {type(node).__name__}"
+            )
+        if isinstance(node, ast.Constant) and type(node.value) not in (int, float):
+            raise FormulaError(f"Formula `{name}` can only use numeric constants")
+        if isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS:
+                raise FormulaError(
+                    f"Formula `{name}` calls an unknown function, "
+                    f"available: {', '.join(FUNCTIONS)}"
+                )
+            if node.keywords:
+                raise FormulaError(f"Formula `{name}` uses keyword arguments")
+    return tree.body
+
+
+class _Inliner(ast.NodeTransformer):
+    def __init__(self, ruleset, stack):
+        self.ruleset = ruleset
+        self.stack = stack
+
+    def visit_Call(self, node):
+        # Function names are left alone, they are looked up in the globals of the lambda
+        node.args = [self.visit(arg) for arg in node.args]
+        return node
+
+    def visit_Name(self, node):
+        return self.ruleset._resolve(node.id, self.stack)
+
+
+class _Hoister(ast.NodeTransformer):
+    """Replaces the largest subexpressions that only read stats and block fields
+
+    Branches that may not be evaluated are left alone, evaluating them in advance could
+    raise errors the formula avoids, e.g. `strength / level if level else 0`.
+
+    :param replace: Function of (index of the subexpression in the block) -> new node
+    :param root: Node which is not replaced itself, only its subexpressions
+    """
+
+    def __init__(self, ruleset, reads, replace, root=None):
+        self.ruleset = ruleset
+        self.reads = reads
+        self.replace = replace
+        self.root = root
+
+    def visit(self, node):
+        reads = self.reads.get(node)
+        if (
+            node is not self.root
+            and reads
+            and reads <= self.ruleset._block_reads
+            and not _is_read(node)
+        ):
+            return self.replace(self.ruleset._block_item(node, self.reads))
+        if isinstance(node, ast.IfExp):
+            node.test = self.visit(node.test)
+            return node
+        if isinstance(node, ast.BoolOp):
+            node.values[0] = self.visit(node.values[0])
+            return node
+        return self.generic_visit(node)
+
+
+def _block_local(index):
+    return ast.Name(id=f"v{index}", ctx=ast.Load())
+
+
+class _LocalInliner(ast.NodeTransformer):
+    """Replaces local variables of the block with their expressions"""
+
+    def __init__(self, expressions):
+        self.expressions = expressions
+
+    def visit_Name(self, node):
+        return self.expressions.get(node.id, node)
+
+
+class _LocalReads(ast.NodeTransformer):
+    """Replaces reads of character attributes with local variables of the same name"""
+
+    def visit_Attribute(self, node):
+        if isinstance(node.value, ast.Name) and node.value.id == "c":
+            return ast.Name(id=f"_{node.attr}", ctx=ast.Load())
+        return self.generic_visit(node)
+
+
+def _is_read(node):
+    """Whether the node reads a stat or a field, it's as fast as reading the block"""
+    if isinstance(node, ast.Subscript):
+        node = node.value
+    return isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name)
+
+
+def _copy_tree(node):
+    """Copy of the tree, unlike deepcopy it doesn't share the nodes of the formulas that
+    are inlined several times"""
+    if isinstance(node, list):
+        return [_copy_tree(item) for item in node]
+    if not isinstance(node, ast.AST):
+        return node
+    return type(node)(
+        **{field: _copy_tree(value) for field, value in ast.iter_fields(node)}
+    )
+
+
+def _character_reads(tree):
+    """:return: Dict of node -> frozenset of character attributes its subtree reads"""
+    reads = {}
+
+    def visit(node):
+        if (
+            isinstance(node, ast.Attribute)
+            and isinstance(node.value, ast.Name)
+            and node.value.id == "c"
+        ):
+            result = frozenset([node.attr])
+        else:
+            result = frozenset().union(*map(visit, ast.iter_child_nodes(node)))
+        reads[node] = result
+        return result
+
+    visit(tree)
+    return reads
+
+
+class Ruleset:
+    """Compiled set of formulas
+
+    :param formulas: Dict of formula name -> expression source
+    :param stats: Names that are read from `character.stats`
+    :param fields: Names that are read as character attributes
+    :param block_fields: Fields that are precomputed in the block with the stats
+    """
+
+    def __init__(self, formulas, stats, fields, block_fields=()):
+        self.source = dict(formulas)
+        self.stats = frozenset(stats)
+        self.fields = frozenset(fields)
+        self._block_reads = frozenset(["stats", *block_fields])
+
+        self._trees = {}
+        for name, source in self.source.items():
+            if name in self.stats or name in self.fields:
+                raise FormulaError(f"`{name}` is a stat or a field of the character")
+            self._trees[name] = parse_formula(name, source)
+
+        self._expanded = {}
+        # Expression dump -> index in the block, expressions of the block items in the
+        # order they are computed, their subexpressions in the block are local variables
+        self._block_items = {}
+        self._block = []
+        # Local variable index -> position in the block
+        self._exports = {}
+        self.formulas = {name: self._compile(name) for name in self.source}
+        self._precompute = self._compile_block()
+
+    def __contains__(self, name):
+        return name in self.formulas
+
+    def __getitem__(self, name):
+        return self.formulas[name]
+
+    def evaluate(self, name, character):
+        return self.formulas[name](character)
+
+    @property
+    def block_size(self):
+        return len(self._exports)
+
+    def refresh(self, character):
+        """Computes the block of the character with this ruleset
+
+        :return: The block or None if some formula fails with the character's stats,
+            formulas are evaluated without the block then, so only the failing ones raise
+        """
+        try:
+            block = self._precompute(character)
+        except Exception:
+            object.__setattr__(character, "__block__", NO_BLOCK)
+            return None
+        object.__setattr__(character, "__block__", block)
+        return block
+
+    def _resolve(self, name, stack):
+        character = ast.Name(id="c", ctx=ast.Load())
+        if name in self.stats:
+            attribute = ast.Attribute(value=character, attr="stats", ctx=ast.Load())
+            return ast.Subscript(
+                value=attribute, slice=ast.Constant(value=name), ctx=ast.Load()
+            )
+        if name in self.fields:
+            return ast.Attribute(value=character, attr=name, ctx=ast.Load())
+        if name in self._trees:
+            return self._expand(name, stack)
+        raise FormulaError(f"Formula `{stack[-1]}` uses unknown name `{name}`")
+
+    def _expand(self, name, stack=()):
+        if name in stack:
+            cycle = " → ".join([*stack[stack.index(name) :], name])
+            raise FormulaError(f"Formulas depend on each other: {cycle}")
+        if name not in self._expanded:
+            tree = _Inliner(self, (*stack, name)).visit(
+                ast.parse(self.source[name], mode="eval").body
+            )
+            if sum(1 for _ in ast.walk(tree)) > MAX_FORMULA_NODES:
+                raise FormulaError(f"Formula `{name}` is too complex")
+            self._expanded[name] = tree
+        return self._expanded[name]
+
+    def _block_item(self, node, reads):
+        """:return: Index of the local variable of the subexpression in the block"""
+        key = ast.dump(node)
+        index = self._block_items.get(key)
+        if index is None:
+            node = _Hoister(self, reads, _block_local, root=node).visit(node)
+            self._block.append(node)
+            index = self._block_items[key] = len(self._block)
+        return index
+
+    def _block_read(self, index):
+        """Read of the block item by a formula, only the items formulas read are kept"""
+        position = self._exports.setdefault(index, len(self._exports) + 1)
+        return ast.Subscript(
+            value=ast.Name(id="b", ctx=ast.Load()),
+            slice=ast.Constant(value=position),
+            ctx=ast.Load(),
+        )
+
+    def _compile_block(self):
+        """:return: Function of character -> [ruleset, *values of the block items]"""
+        body = [
+            ast.Assign(
+                targets=[ast.Name(id=f"_{name}", ctx=ast.Store())],
+                value=ast.Attribute(
+                    value=ast.Name(id="c", ctx=ast.Load()), attr=name, ctx=ast.Load()
+                ),
+            )
+            for name in sorted(self._block_reads)
+        ]
+        # Items used once are inlined, the others are computed once into the locals
+        uses = collections.Counter(self._exports)
+        for node in self._block:
+            uses.update(
+                int(child.id[1:])
+                for child in ast.walk(node)
+                if isinstance(child, ast.Name) and child.id.startswith("v")
+            )
+        inlined = {}
+        for index, node in enumerate(self._block, start=1):
+            node = _LocalInliner(inlined).visit(_LocalReads().visit(node))
+            if uses[index] == 1 and index not in self._exports:
+                inlined[f"v{index}"] = node
+                continue
+            body.append(
+                ast.Assign(
+                    targets=[ast.Name(id=f"v{index}", ctx=ast.Store())], value=node
+                )
+            )
+        items = [ast.Name(id="RULESET", ctx=ast.Load())]
+        items.extend(map(_block_local, self._exports))
+        body.append(ast.Return(value=ast.List(elts=items, ctx=ast.Load())))
+        module = ast.parse("def block(c): pass")
+        module.body[0].body = body
+        code = compile(ast.fix_missing_locations(module), "<formula block>", "exec")
+        namespace = self._globals()
+        exec(code, namespace)
+        return namespace["block"]
+
+    def _globals(self, **names):
+        return {"__builtins__": {}, **FUNCTIONS, "RULESET": self, **names}
+
+    def _compile_lambda(self, name, body):
+        arguments = ast.arguments(
+            posonlyargs=[],
+            args=[ast.arg(arg="c")],
+            kwonlyargs=[],
+            kw_defaults=[],
+            defaults=[],
+        )
+        tree = ast.fix_missing_locations(
+            ast.Expression(body=ast.Lambda(args=arguments, body=body))
+        )
+        code = compile(tree, f"<formula {name}>", "eval")
+        return eval(code, self._globals())
+
+    def _compile(self, name):
+        slow = self._compile_lambda(name, self._expand(name))
+        tree = _copy_tree(self._expand(name))
+        body = _Hoister(self, _character_reads(tree), self._block_read).visit(tree)
+        if not any(
+            isinstance(node, ast.Name) and node.id == "b" for node in ast.walk(body)
+        ):
+            return slow
+
+        module = ast.parse(_FORMULA_TEMPLATE)
+        function = module.body[0]
+        function.name = name
+        function.body[-1].value = body
+        code = compile(ast.fix_missing_locations(module), f"<formula {name}>", "exec")
+        # Formulas run without builtins, the template catches AttributeError by name.
+        # Formula sources can't read it, their names are resolved when compiling
+        namespace = self._globals(
+            NO_BLOCK=NO_BLOCK, SLOW=slow, AttributeError=AttributeError
+        )
+        exec(code, namespace)
+        return namespace[name]
@@ -0,0 +1,68 @@
+"""Slash command handler of the bot
+
+It's imported with discord_slash while the bot logs in, see RPbot.start.
+"""
+
+import contextlib
+import logging
+
+from discord_slash import ComponentContext, SlashCommand
+
+from src.utils.autocomplete import MAX_CHOICES, AutocompleteContext
+
+
+def invocation_name(ctx):
+    if isinstance(ctx, ComponentContext):
+        return ctx.custom_id
+    return " ".join(filter(None, [ctx.name, ctx.subcommand_group, ctx.subcommand_name]))
+
+
+class RPSlashCommand(SlashCommand):
+    """SlashCommand that runs every command and component invocation inside registered hooks"""
+
+    def __init__(self, client, **kwargs):
+        super().__init__(client, **kwargs)
+        # Callables taking (name, ctx) and returning a context manager
+        self.invocation_hooks = []
+        # (command name, option name) -> coroutine function taking AutocompleteContext
+        # and returning a list of choices
+        self.autocomplete_handlers = {}
+
+    def _hooks(self, ctx):
+        stack = contextlib.ExitStack()
+        name = invocation_name(ctx)
+        for hook in list(self.invocation_hooks):
+            stack.enter_context(hook(name, ctx))
+        return stack
+
+    async def invoke_command(self, func, ctx, args):
+        with self._hooks(ctx):
+            await super().invoke_command(func, ctx, args)
+
+    async def invoke_component_callback(self, func, ctx):
+        with self._hooks(ctx):
+            await super().invoke_component_callback(func, ctx)
+
+    async def on_socket_response(self, msg):
+        if msg["t"] == "INTERACTION_CREATE" and msg["d"]["type"] == 4:
+            await self.on_autocomplete(msg["d"])
+        else:
+            await super().on_socket_response(msg)
+
+    async def on_autocomplete(self, data):
+        ctx = AutocompleteContext(self._discord, data)
+        handler = self.autocomplete_handlers.get((ctx.command, ctx.option))
+        choices = []
+        if handler is not None:
+            try:
+                choices = await handler(ctx)
+            except Exception as error:
+                logging.error(
+                    f"Autocomplete of {ctx.command} {ctx.option} failed: {repr(error)}",
+                    exc_info=error,
+                )
+        await self.req.post_initial_response(
+            {"type": 8, "data": {"choices": choices[:MAX_CHOICES]}},
+            ctx.interaction_id,
+            ctx.token,
+        )
@@ -0,0 +1,89 @@
+import bisect
+
+MAX_CHOICES = 25
+
+
+class AutocompleteContext:
+    """Parsed autocomplete interaction, discord_slash doesn't support them"""
+
+    def __init__(self, bot, data):
+        self.bot = bot
+        self.interaction_id = data["id"]
+        self.token = data["token"]
+        self.guild_id = int(data["guild_id"]) if "guild_id" in data else None
+        user = data["member"]["user"] if "member" in data else data["user"]
+        self.author_id = int(user["id"])
+
+        command = data["data"]
+        path = [command["name"]]
+        options = command.get("options", [])
+        # Subcommand groups and subcommands are nested options of types 2 and 1
+        while options and options[0]["type"] in (1, 2):
+            path.append(options[0]["name"])
+            options = options[0].get("options", [])
+
+        self.command = " ".join(path)
+        self.options = {option["name"]: option.get("value") for option in options}
+        focused = next(option for option in options if option.get("focused"))
+        self.option = focused["name"]
+        self.value = focused.get("value", "")
+
+
+def _normalize(text):
+    return " ".join(text.casefold().split())
+
+
+def _terms(label):
+    """Keys an item is found by: the whole label and its parts starting at each word"""
+    words = _normalize(label).split()
+    return {" ".join(words[i:]) for i in range(len(words))}
+
+
+class PrefixIndex:
+    """Case-insensitive search of items by a prefix of any word of their labels
+
+    Keys are kept in a sorted list, so a search is a binary search plus a scan of the
+    matches, and adding or removing an item is a few list insertions.
+    """
+
+    def __init__(self):
+        self._keys = []  # Sorted (term, item id)
+        self.labels = {}  # Item id -> label
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __contains__(self, item_id):
+        return item_id in self.labels
+
+    def add(self, item_id, label):
+        if self.labels.get(item_id) == label:
+            return
+        self.remove(item_id)
+        self.labels[item_id] = label
+        for term in _terms(label):
+            bisect.insort(self._keys, (term, item_id))
+
+    def remove(self, item_id):
+        label = self.labels.pop(item_id, None)
+        if label is None:
+            return
+        for term in _terms(label):
+            index = bisect.bisect_left(self._keys, (term, item_id))
+            del self._keys[index]
+
+    def search(self, prefix, limit=MAX_CHOICES):
+        """:return: Up to `limit` (item id, label), matches of the whole label first"""
+        prefix = _normalize(prefix)
+        matches = {}  # Item id -> whether the whole label matches
+        index = bisect.bisect_left(self._keys, (prefix,))
+        while index < len(self._keys) and len(matches) < limit:
+            term, item_id = self._keys[index]
+            if not term.startswith(prefix):
+                break
+            whole = term == _normalize(self.labels[item_id])
+            matches[item_id] = matches.get(item_id, False) or whole
+            index += 1
+
+        ordered = sorted(matches, key=lambda item_id: not matches[item_id])
+        return [(item_id, self.labels[item_id]) for item_id in ordered]
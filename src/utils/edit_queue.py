@@ -0,0 +1,96 @@
+import asyncio
+import collections
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class EditQueue:
+    """Coalesces and paces message edits
+
+    An edit scheduled for a message runs `debounce` seconds later, edits of the same
+    message scheduled in the meantime are merged into it (the latest callable wins).
+    Every channel has its own worker that keeps at most `rate` edits per `per` seconds,
+    like Discord's per-channel rate limit bucket.
+    """
+
+    def __init__(self, debounce=2.0, rate=5, per=5.0):
+        self.debounce = debounce
+        self.rate = rate
+        self.per = per
+        # Channel id -> {message id: [due time, edit coroutine function]}
+        self._pending = collections.defaultdict(dict)
+        # Channel id -> times of the latest edits
+        self._history = collections.defaultdict(
+            lambda: collections.deque(maxlen=self.rate)
+        )
+        self._workers = {}
+        self.scheduled = 0
+        self.edited = 0
+
+    def __len__(self):
+        return sum(len(messages) for messages in self._pending.values())
+
+    def schedule(self, channel_id, message_id, edit):
+        """:param edit: Coroutine function without arguments that does the edit"""
+        self.scheduled += 1
+        pending = self._pending[channel_id]
+        if message_id in pending:
+            pending[message_id][1] = edit
+        else:
+            pending[message_id] = [time.monotonic() + self.debounce, edit]
+
+        if channel_id not in self._workers:
+            self._trim_history()
+            self._workers[channel_id] = asyncio.get_running_loop().create_task(
+                self._work(channel_id)
+            )
+
+    def cancel(self, channel_id, message_id):
+        self._pending.get(channel_id, {}).pop(message_id, None)
+
+    def _trim_history(self):
+        """Drops edit times older than `per`, they no longer count against the rate"""
+        cutoff = time.monotonic() - self.per
+        for channel_id, history in list(self._history.items()):
+            while history and history[0] <= cutoff:
+                history.popleft()
+            if not history and channel_id not in self._workers:
+                del self._history[channel_id]
+
+    async def _wait_for_bucket(self, channel_id):
+        history = self._history[channel_id]
+        if len(history) == self.rate:
+            delay = history[0] + self.per - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    async def _work(self, channel_id):
+        pending = self._pending[channel_id]
+        try:
+            while pending:
+                message_id, (due, _) = min(pending.items(), key=lambda item: item[1][0])
+                delay = due - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    continue  # Something could be scheduled earlier meanwhile
+
+                await self._wait_for_bucket(channel_id)
+                entry = pending.pop(message_id, None)
+                if entry is None:  # Cancelled
+                    continue
+                self._history[channel_id].append(time.monotonic())
+                self.edited += 1
+                try:
+                    await entry[1]()
+                except Exception as error:
+                    logger.error(
+                        f"Edit of message {message_id} failed: {repr(error)}",
+                        exc_info=error,
+                    )
+        finally:
+            del self._workers[channel_id]
+            if not pending:
+                self._pending.pop(channel_id, None)
+            # Edit times are kept, a burst right after this one must still wait for them
@@ -0,0 +1,99 @@
+"""Per-module import timing, like `python -X importtime` but available at runtime
+
+Must be installed before the imports it should measure, so it only uses the standard library.
+"""
+import importlib.abc
+import sys
+import threading
+import time
+
+STARTED_AT = time.perf_counter()
+
+timer = None
+
+
+class _TimedLoader(importlib.abc.Loader):
+    def __init__(self, timer, loader):
+        self.timer = timer
+        self.loader = loader
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        self.timer.enter()
+        try:
+            self.loader.exec_module(module)
+        finally:
+            self.timer.exit(module.__name__)
+            # Hide the wrapper from everyone inspecting the module afterwards
+            module.__loader__ = self.loader
+            if module.__spec__ is not None:
+                module.__spec__.loader = self.loader
+
+
+class ImportTimer(importlib.abc.MetaPathFinder):
+    def __init__(self):
+        # name -> [self time, cumulative time], in import order
+        self.modules = {}
+        # Modules can be imported in several threads, each has its own nesting
+        self._local = threading.local()
+
+    @property
+    def _stack(self):
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = []
+            return self._local.stack
+
+    def find_spec(self, fullname, path, target=None):
+        finders = sys.meta_path[sys.meta_path.index(self) + 1 :]
+        for finder in finders:
+            find_spec = getattr(finder, "find_spec", None)
+            if find_spec is None:
+                continue
+            spec = find_spec(fullname, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+
+        if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+            spec.loader = _TimedLoader(self, spec.loader)
+        return spec
+
+    def enter(self):
+        # [start time, time spent importing nested modules]
+        self._stack.append([time.perf_counter(), 0.0])
+
+    def exit(self, name):
+        start, nested = self._stack.pop()
+        cumulative = time.perf_counter() - start
+        self.modules[name] = [cumulative - nested, cumulative]
+        if self._stack:
+            self._stack[-1][1] += cumulative
+
+    @property
+    def total(self):
+        return sum(self_time for self_time, _ in self.modules.values())
+
+    def rows(self, limit=20, sort="cumulative"):
+        """Rows of [module, self ms, cumulative ms], slowest first"""
+        column = 0 if sort == "self" else 1
+        modules = sorted(self.modules.items(), key=lambda item: item[1][column], reverse=True)
+        return [
+            [name, f"{self_time * 1000:.1f}", f"{cumulative * 1000:.1f}"]
+            for name, (self_time, cumulative) in modules[:limit]
+        ]
+
+
+def install():
+    global timer
+    if timer is None:
+        timer = ImportTimer()
+        sys.meta_path.insert(0, timer)
+    return timer
@@ -0,0 +1,87 @@
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+
+LOG_FORMAT = "[%(asctime)s] [%(levelname)-9.9s]-[%(name)-15.15s]: %(message)s"
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting and tracebacks to the listener thread
+
+    Only the message is merged with its arguments here, they may be mutable objects that
+    change before the listener gets to the record. The records never leave the process,
+    so there is no need to make them picklable.
+    """
+
+    def prepare(self, record):
+        # A copy, other handlers of the logger may still use the original record
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class DebugSampler(logging.Filter):
+    """Keeps only a share of DEBUG records, per logger name prefix"""
+
+    def __init__(self, rates):
+        super().__init__()
+        # Longest prefix first, so "discord.gateway" wins over "discord"
+        self.rates = sorted(rates.items(), key=lambda item: len(item[0]), reverse=True)
+
+    def rate(self, name):
+        for prefix, rate in self.rates:
+            if name == prefix or name.startswith(f"{prefix}."):
+                return rate
+        return 1
+
+    def filter(self, record):
+        if record.levelno != logging.DEBUG:
+            return True
+        return random.random() < self.rate(record.name)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def setup_logging(config):
+    """Routes all logging through a queue to a background writer thread
+
+    :param config: "logging" section of the config.
+    :return: Started QueueListener, stop it on shutdown to flush the queue.
+    """
+    handler = logging.StreamHandler(sys.stderr)
+    if config.get("json", False):
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    sampling = config.get("debug_sampling", {})
+    if sampling:
+        queue_handler.addFilter(DebugSampler(sampling))
+
+    root = logging.getLogger()
+    for old_handler in root.handlers[:]:
+        root.removeHandler(old_handler)
+    root.addHandler(queue_handler)
+    root.setLevel(config.get("level", "DEBUG"))
+
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    listener.start()
+    return listener
@@ -0,0 +1,121 @@
+import asyncio
+import collections
+import contextlib
+import logging
+import sys
+import threading
+import time
+import traceback
+
+logger = logging.getLogger(__name__)
+
+
+class SlowCallback:
+    """Time the event loop was blocked, with the loop thread's stack during it"""
+
+    __slots__ = ("started_at", "duration", "command", "task", "stack")
+
+    def __init__(self, started_at, command, task, stack):
+        self.started_at = started_at  # time.time() of the check that got no answer
+        self.duration = None  # Seconds, None while the loop is still blocked
+        self.command = command
+        self.task = task
+        self.stack = stack  # traceback.StackSummary, innermost frame last
+
+
+class LoopMonitor:
+    """Measures event loop lag from a watchdog thread
+
+    Every `interval` seconds the thread schedules a callback on the loop and measures how
+    long it takes to run. If it doesn't run in `threshold` seconds, the loop is blocked
+    by synchronous code: the stack of the loop thread and the command of the running task
+    are recorded and logged. It works with any loop implementation, unlike asyncio debug
+    mode, which is also too slow for production.
+    """
+
+    def __init__(self, threshold=0.1, interval=0.25, history=20, samples=1000):
+        self.threshold = threshold
+        self.interval = interval
+        self.lags = collections.deque(maxlen=samples)
+        self.slow_callbacks = collections.deque(maxlen=history)
+        self.blocked = 0
+        self.max_lag = 0
+
+        # Task -> name of the command or component it runs, see hook
+        self._commands = {}
+        self._loop = None
+        self._loop_thread_id = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Starts the watchdog of the running loop"""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="loop-monitor", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    @contextlib.contextmanager
+    def hook(self, name, ctx):
+        """Invocation hook that lets slow callbacks be traced back to the command"""
+        task = asyncio.current_task()
+        self._commands[task] = name
+        try:
+            yield
+        finally:
+            self._commands.pop(task, None)
+
+    def _pong(self, sent, answered):
+        lag = time.monotonic() - sent
+        self.lags.append(lag)
+        self.max_lag = max(self.max_lag, lag)
+        answered.set()
+
+    def _capture(self):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        stack = traceback.extract_stack(frame) if frame is not None else []
+        # The task isn't switched while the loop thread is stuck in its step
+        task = asyncio.current_task(self._loop)
+        command = self._commands.get(task)
+        return SlowCallback(
+            time.time(), command, task.get_name() if task else None, stack
+        )
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            answered = threading.Event()
+            sent = time.monotonic()
+            try:
+                self._loop.call_soon_threadsafe(self._pong, sent, answered)
+            except RuntimeError:  # The loop is closed
+                return
+            if answered.wait(self.threshold):
+                continue
+
+            self.blocked += 1
+            slow = self._capture()
+            self.slow_callbacks.append(slow)
+            while not answered.wait(self.interval):
+                if self._stop.is_set() or self._loop.is_closed():
+                    return
+            slow.duration = time.monotonic() - sent
+            logger.warning(
+                f"Event loop was blocked for {slow.duration * 1000:.0f}ms "
+                f"by {slow.command or slow.task or 'unknown task'}, stack:\n"
+                f"{''.join(slow.stack.format()) if slow.stack else 'unavailable'}"
+            )
+
+    def percentile(self, share):
+        if not self.lags:
+            return 0
+        lags = sorted(self.lags)
+        return lags[min(len(lags) - 1, int(len(lags) * share))]
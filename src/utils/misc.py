@@ -1,3 +1,4 @@
+import collections
 import math
 import os
 from typing import Any, List, Optional
@@ -9,6 +10,39 @@ def abs_join(*paths):
     return os.path.abspath(os.path.join(*paths))
 
 
+class LRUCache:
+    """Dict-like cache that keeps at most `max_size` most recently used items"""
+
+    def __init__(self, max_size=128):
+        self.max_size = max_size
+        self._data = collections.OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        try:
+            self._data.move_to_end(key)
+        except KeyError:
+            return default
+        return self._data[key]
+
+    def put(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        return self._data.pop(key, default)
+
+    def clear(self):
+        self._data.clear()
+
+
 def _make_solid_line(
     column_widths: List[int],
     left_char: str,
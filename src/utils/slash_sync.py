@@ -0,0 +1,133 @@
+import collections
+import hashlib
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+def command_hash(payload):
+    """Stable hash of a JSON-serializable command (or command tree) payload"""
+    dump = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(dump.encode()).hexdigest()
+
+
+class CommandSyncCache:
+    """Hashes and ids of the commands pushed by the last sync, stored on disk
+
+    Format: {"tree": <hash>, "scopes": {"global" | "<guild id>": {name: {"hash", "id"}}}}
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.tree = None
+        self.scopes = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            logger.warning(f"Command sync cache {self.path} is corrupted, ignoring it")
+            return
+
+        self.tree = data.get("tree")
+        self.scopes = data.get("scopes", {})
+
+    def save(self):
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"tree": self.tree, "scopes": self.scopes}, f, indent=2)
+        os.replace(temp_path, self.path)
+
+
+def _scope_key(guild_id):
+    return "global" if guild_id is None else str(guild_id)
+
+
+def _scope_id(key):
+    return None if key == "global" else int(key)
+
+
+async def sync_changed_commands(slash, cache, force=False):
+    """Pushes only commands that changed since the last sync and removes unused ones
+
+    :param slash: SlashCommand instance with all commands registered.
+    :param cache: CommandSyncCache of the previous sync.
+    :param force: Compare with commands registered on Discord instead of the cache.
+    :return: Counter with amount of added, updated, removed and unchanged commands.
+    """
+    tree = await slash.to_dict()
+    scopes = [(None, tree["global"]), *tree["guild"].items()]
+    if any(command.get("permissions") for _, commands in scopes for command in commands):
+        logger.warning("Command permissions are not diff-synced, doing full sync instead")
+        await slash.sync_all_commands()
+        cache.tree = None
+        cache.save()
+        return collections.Counter(updated=sum(len(commands) for _, commands in scopes))
+
+    payloads = {
+        _scope_key(guild_id): {
+            command["name"]: {
+                key: value for key, value in command.items() if key != "permissions"
+            }
+            for command in commands
+        }
+        for guild_id, commands in scopes
+    }
+
+    counts = collections.Counter()
+    tree_hash = command_hash(payloads)
+    if not force and tree_hash == cache.tree:
+        counts["unchanged"] = sum(len(commands) for commands in payloads.values())
+        return counts
+
+    for key in sorted(set(payloads) | set(cache.scopes)):
+        guild_id = _scope_id(key)
+        commands = payloads.get(key, {})
+
+        if force or key not in cache.scopes:
+            # We don't know what is registered there, so ask Discord
+            registered = await slash.req.get_all_commands(guild_id=guild_id)
+            previous = {
+                command["name"]: {"hash": None, "id": command["id"]}
+                for command in registered
+            }
+        else:
+            previous = cache.scopes[key]
+
+        synced = {}
+        for name, command in commands.items():
+            digest = command_hash(command)
+            entry = previous.get(name)
+            if entry is not None and entry["hash"] == digest:
+                synced[name] = entry
+                counts["unchanged"] += 1
+                continue
+
+            # Posting a command with an existing name overwrites it
+            response = await slash.req.command_request(
+                method="POST", guild_id=guild_id, json=command
+            )
+            synced[name] = {"hash": digest, "id": response["id"]}
+            counts["added" if entry is None else "updated"] += 1
+            logger.info(f"Synced command {name} in scope {key}")
+
+        for name in set(previous) - set(commands):
+            await slash.req.remove_slash_command(guild_id, previous[name]["id"])
+            counts["removed"] += 1
+            logger.info(f"Removed command {name} from scope {key}")
+
+        if key in payloads:
+            cache.scopes[key] = synced
+        else:
+            cache.scopes.pop(key, None)
+        cache.save()
+
+    cache.tree = tree_hash
+    cache.save()
+    return counts
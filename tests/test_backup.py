@@ -0,0 +1,66 @@
+import asyncio
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+from benchmarks.fakes import FakeCollection, FakeEngine
+from src.mg_backup import _encode, import_backup
+from src.mg_character_models import Player
+
+
+def player_record(**doc):
+    return {"collection": Player.__collection__, "guild_id": 1, "doc": doc}
+
+
+def write_backup(path, records):
+    with open(path, "wb") as file:
+        file.write(_encode(records, "jsonl"))
+
+
+def run_import(engine, path, dry_run=False):
+    return asyncio.run(import_backup(engine, str(path), dry_run=dry_run, workers=1))
+
+
+def test_invalid_documents_are_reported_and_skipped(tmp_path):
+    valid = player_record(_id=ObjectId(), guild_id=1, user_id=1)
+    path = tmp_path / "backup.jsonl"
+    write_backup(
+        path,
+        [
+            valid,
+            player_record(guild_id=1, user_id=2),
+            player_record(_id=ObjectId(), guild_id=1, user_id="nobody"),
+        ],
+    )
+    engine = FakeEngine()
+
+    result = run_import(engine, path)
+
+    assert result.counts == {Player.__collection__: 1}
+    assert result.error_count == 2
+    assert list(engine.get_collection(Player).docs) == [valid["doc"]["_id"]]
+
+
+def test_failed_writes_are_reported(tmp_path, monkeypatch):
+    records = [
+        player_record(_id=ObjectId(), guild_id=1, user_id=user_id)
+        for user_id in (1, 2)
+    ]
+    path = tmp_path / "backup.jsonl"
+    write_backup(path, records)
+
+    async def bulk_write(self, requests, ordered=True):
+        assert not ordered
+        self._replace_one(requests[0]._filter, requests[0]._doc, True)
+        raise BulkWriteError(
+            {"writeErrors": [{"index": 1, "code": 11000, "errmsg": "duplicate key"}]}
+        )
+
+    monkeypatch.setattr(FakeCollection, "bulk_write", bulk_write)
+
+    result = run_import(FakeEngine(), path)
+
+    assert result.counts == {Player.__collection__: 1}
+    assert result.errors == [
+        (Player.__collection__, records[1]["doc"]["_id"], "duplicate key")
+    ]
@@ -0,0 +1,19 @@
+import pytest
+
+from src.mg_character_models import Character, Player
+
+
+def make_character():
+    return Character(name="Hero", player=Player(user_id=1))
+
+
+@pytest.mark.parametrize(
+    "name",
+    ["strength", "level", "free_points", "max_hp", "total_weight", "weight_status"],
+)
+def test_game_names_are_reserved(name):
+    assert make_character().is_reserved_name(name)
+
+
+def test_custom_names_are_not_reserved():
+    assert not make_character().is_reserved_name("lockpicking")
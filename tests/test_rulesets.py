@@ -0,0 +1,39 @@
+import copy
+
+import pytest
+from discord.ext import commands
+
+from src.main_game import CharactersCog
+from src.mg_character_models import Character, Player, make_ruleset
+
+
+def make_character(**data):
+    return Character(name="Hero", player=Player(user_id=1), level=7, **data)
+
+
+@pytest.mark.parametrize(
+    "make_copy",
+    [copy.copy, copy.deepcopy, lambda character: character.copy()],
+    ids=["copy", "deepcopy", "model_copy"],
+)
+def test_derived_stats_of_copies(make_copy):
+    character = make_character()
+    assert make_copy(character).max_hp == character.max_hp
+    assert make_copy(character).mp_regen_rate == character.mp_regen_rate
+
+
+def test_derived_stats_of_constructed_character():
+    character = make_character()
+    constructed = Character.construct(**dict(character))
+    assert constructed.max_hp == character.max_hp
+    assert constructed.walk_speed == character.walk_speed
+
+
+def test_failing_formula_is_reported_for_the_character():
+    character = make_character()
+    character.use_ruleset(make_ruleset({"max_mp": "10 / (level - 7)"}))
+    with pytest.raises(commands.BadArgument, match="max_mp"):
+        CharactersCog.check_formulas(character)
+
+    character.level = 8
+    CharactersCog.check_formulas(character)